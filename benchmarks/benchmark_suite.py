@@ -0,0 +1,286 @@
+"""
+benchmark_suite.py
+This source code is part of temp-monitoring program.
+It runs every stage of the program over a synthetic fleet, from the processing
+of the .json files to the callbacks of the dashboard, and saves the time of each
+one in a .json file tagged with the current git commit, so the results of two
+commits can be compared. The suite works in a temporary folder with its own
+config.ini, so the data, models and results of the project are not touched.
+Run it from the root folder of the project:
+
+    (venv) $ python -m benchmarks.benchmark_suite --vehicles 3 --days 2
+    (venv) $ python -m benchmarks.benchmark_suite --compare old.json new.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from configparser import ConfigParser
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks.synthetic_fleet import add_arguments, get_generator
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def get_commit():
+    """
+    Returns the current git commit of the project and whether the tracked files
+    have uncommitted changes.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+    return commit, bool(status)
+
+
+def write_config(workdir):
+    """
+    Writes in the working folder a copy of the config.ini of the project,
+    with the diagnostic figures switched off and the dashboard reading the
+    published dataset.
+    """
+    config = ConfigParser()
+    config.read(ROOT / "config.ini")
+    config.set("diagnostics", "enabled", "False")
+    config.set("dashboard", "data_mode", "mmap")
+    config.set("dashboard", "background_callbacks", "False")
+    with open(Path(workdir) / "config.ini", "w") as config_file:
+        config.write(config_file)
+
+
+class BenchmarkSuite:
+    """
+    Measures the stages of the program over a synthetic fleet.
+
+    Args:
+        FleetGenerator : generator of the synthetic fleet.
+        str : working folder, where the config.ini of the suite is written.
+        int (optional) : times every stage that doesn't change the data is repeated.
+    """
+    def __init__(self, generator, workdir, repeat=3):
+        self.generator = generator
+        self.workdir = Path(workdir)
+        self.repeat = repeat
+        self.results = []
+
+
+    def measure(self, name, func, rows=None, repeat=None):
+        """
+        Runs a stage and records its best and mean time.
+
+        Args:
+            str : name of the stage.
+            function : function without arguments that runs the stage.
+            int (optional) : number of entries processed by the stage.
+            int (optional) : times the stage is run. Defaults to 'self.repeat'.
+
+        Returns:
+            object : value returned by the last run of the stage.
+        """
+        timings = []
+        for _ in range(repeat or self.repeat):
+            start = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - start)
+        self.results.append({"stage": name,
+                             "best_s": min(timings),
+                             "mean_s": sum(timings) / len(timings),
+                             "runs": len(timings),
+                             "rows": rows,
+                             })
+        print(f"{name:<45}{min(timings):>10.3f} s" + (f"   {rows} rows" if rows is not None else ""))
+
+        return result
+
+
+    def run(self):
+        """
+        Runs all the stages in the working folder, in the order of the program.
+        The modules of the program read config.ini when they are imported, so
+        they are imported once the working folder is the current one.
+
+        Returns:
+            list : results of every stage.
+        """
+        os.chdir(self.workdir)
+        write_config(self.workdir)
+        (self.workdir / "prophet_folder").mkdir(exist_ok=True)
+        sys.path.insert(0, str(ROOT))
+
+        import pandas as pd
+        from data.preprocessing import CheckMainDataset, ProcessingData
+        from data.dataset_store import publish_dataset
+        from prophet_folder.modelo_main import ProphetModel
+        from prophet_folder.prediction_maker import PredictTempForNaN, MergePredictions
+        from dash_folder.dash_elements_functions import GapDeleter, NaNFinder
+
+        parser = ConfigParser()
+        parser.read("config.ini")
+        json_folder = str(self.workdir)+parser.get("path_folder", "json_files")
+        main_folder = str(self.workdir)+parser.get("path_folder", "main_dataset")
+
+        json_files = self.measure("synthetic_fleet", lambda: self.generator.write(json_folder), repeat=1)
+
+        # Ingest.
+        processed = self.measure("ProcessingData",
+                                 lambda: [ProcessingData(path, None) for path in json_files])
+        rows = sum(len(dataset.df) for dataset in processed)
+        self.results[-1]["rows"] = rows
+
+        def merge_all():
+            main_dataset_path = str(CheckMainDataset(main_folder))
+            for path in json_files:
+                dataset = ProcessingData(path, main_dataset_path)
+                dataset.merge_data_to_main_df()
+            return dataset.load_main_df()
+        main_df = self.measure("ProcessingData.merge_data_to_main_df", merge_all, rows, repeat=1)
+
+        real_entries = [dataset.df[dataset.df["date_flag"] != True].assign(
+                            interval_time=lambda df: pd.to_timedelta(df["interval_time"], unit="s"))
+                        for dataset in processed]
+        limit_interval = parser.getint("interval_time_config", "limit")
+        default_interval = parser.getint("interval_time_config", "default")
+        self.measure("ProcessingData.run_upsampler",
+                     lambda: [ProcessingData.run_upsampler(df, limit_interval, default_interval)
+                              for df in real_entries],
+                     sum(len(df) for df in real_entries))
+
+        # Training and predictions.
+        model = ProphetModel(main_df)
+        self.measure("ProphetModel.run_model", model.run_model, len(main_df), repeat=1)
+
+        def predict_all():
+            predictions = []
+            for vehicle_plate in main_df["vehicle_plate"].unique():
+                df_veh_plate = main_df[main_df["vehicle_plate"] == vehicle_plate]
+                df_to_predict = df_veh_plate[df_veh_plate["y"].isna()]
+                predictions.append(PredictTempForNaN(df_to_predict, vehicle_plate).predict_result)
+            return pd.concat(predictions, ignore_index=True)
+        predictions = self.measure("PredictTempForNaN", predict_all, int(main_df["y"].isna().sum()))
+
+        merged_df = self.measure("MergePredictions",
+                                 lambda: MergePredictions(predictions, main_df.copy()).df,
+                                 len(main_df))
+        merged_df["date"] = merged_df["date"].dt.floor("T")
+
+        # Dashboard.
+        vehicle_plate = merged_df["vehicle_plate"].iloc[0]
+        df_veh_plate = merged_df[merged_df["vehicle_plate"] == vehicle_plate]
+        self.measure("GapDeleter", lambda: GapDeleter(df_veh_plate).get_new_list(), len(df_veh_plate))
+        self.measure("NaNFinder", lambda: NaNFinder(df_veh_plate).get_grouped_index(), len(df_veh_plate))
+
+        publish_dataset(merged_df)
+        from dash_folder import app
+        from dash_folder.export import EXPORT_FORMATS, get_export_url
+
+        start_date, end_date = [str(date) for date in app.min_max_date_by_plate(vehicle_plate)[:2]]
+        no_progress = lambda *_: None
+        callbacks = {"min_max_date_by_plate": lambda: app.min_max_date_by_plate(vehicle_plate),
+                     "get_temperature_graph": lambda: app.get_temperature_graph(
+                                                no_progress, vehicle_plate, start_date, end_date, "temp1"),
+                     "get_regnumber_graph": lambda: app.get_regnumber_graph(
+                                                vehicle_plate, start_date, end_date, "H", "temp1"),
+                     "dibujar_grafica": lambda: app.dibujar_grafica(
+                                                no_progress, vehicle_plate, start_date, end_date, "temp1"),
+                     "get_export_links": lambda: app.get_export_links(
+                                                vehicle_plate, start_date, end_date),
+                     "get_excursions_table": lambda: app.get_excursions_table(
+                                                "/excursions", [0, 30]),
+                     }
+        for name, callback in callbacks.items():
+            self.measure(f"callback.{name}", callback, len(df_veh_plate))
+
+        client = app.server.test_client()
+        for export_format in EXPORT_FORMATS:
+            url = get_export_url(export_format, vehicle_plate, start_date, end_date)
+            self.measure(f"export.{export_format}", lambda: client.get(url).get_data(), len(df_veh_plate))
+
+        return self.results
+
+
+def save_results(results, parameters, output=None):
+    """
+    Saves the results of the suite with the commit and the machine they were
+    measured on.
+
+    Returns:
+        Path : path of the saved .json file.
+    """
+    commit, dirty = get_commit()
+    timestamp = datetime.now()
+    if output is None:
+        output = ROOT / "benchmarks" / "results" / f"benchmark_{commit[:8]}_{timestamp:%Y%m%d-%H%M%S}.json"
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    report = {"commit": commit,
+              "dirty": dirty,
+              "timestamp": timestamp.isoformat(timespec="seconds"),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "parameters": parameters,
+              "results": results,
+              }
+    with open(output, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+
+    return output
+
+
+def compare_results(old_path, new_path):
+    """
+    Prints the best time of every stage in two saved results and their ratio.
+    """
+    with open(old_path) as old_file, open(new_path) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    old_times = {result["stage"]: result["best_s"] for result in old["results"]}
+    print(f"{'stage':<45}{old['commit'][:8]:>12}{new['commit'][:8]:>12}{'ratio':>8}")
+    for result in new["results"]:
+        old_time = old_times.get(result["stage"])
+        if old_time is None:
+            print(f"{result['stage']:<45}{'-':>12}{result['best_s']:>12.3f}")
+            continue
+        print(f"{result['stage']:<45}{old_time:>12.3f}{result['best_s']:>12.3f}"
+              f"{result['best_s'] / old_time if old_time else float('nan'):>8.2f}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark suite over a synthetic fleet.")
+    add_arguments(arg_parser)
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("--output", default=None,
+                            help="path of the results. Defaults to benchmarks/results.")
+    arg_parser.add_argument("--workdir", default=None,
+                            help="working folder, kept at the end, so its trained models are reused "
+                                 "by the next runs. Defaults to a temporary one, removed at the end.")
+    arg_parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                            help="compares two saved results instead of running the suite.")
+    args = arg_parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+        sys.exit(0)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="temp_monitoring_benchmark_")
+    Path(workdir).mkdir(parents=True, exist_ok=True)
+    try:
+        results = BenchmarkSuite(get_generator(args), Path(workdir).resolve(), args.repeat).run()
+    finally:
+        os.chdir(ROOT)
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    parameters = {key: value for key, value in vars(args).items()
+                  if key not in ("output", "workdir", "compare")}
+    print(f"\nResults saved in {save_results(results, parameters, args.output)}.")
@@ -0,0 +1,156 @@
+"""
+figure_payload_benchmark.py
+This source code is part of temp-monitoring program.
+It compares the temperature graph built with plotly express, as the dashboard
+did before, with the one built by dash_elements in SVG and WebGL mode: the
+size of the JSON sent to the browser and the time to serialize it. The figures
+are also written in an HTML page that measures the time the browser takes to
+draw each of them. Run it from the root folder of the project:
+
+    (venv) $ python -m benchmarks.figure_payload_benchmark --rows 50000 --html figure_render.html
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.offline import get_plotlyjs
+
+from dash_folder.dash_elements import dash_elements
+from dash_folder.dash_elements_functions import GapDeleter
+
+
+def build_frame(rows, gap_ratio=0.3, seed=0):
+    """
+    Builds the entries of a vehicle as the dashboard receives them: real
+    temperatures every 15 seconds with gaps of predicted temperatures.
+
+    Args:
+        int : number of entries.
+        float : proportion of entries inside a gap.
+
+    Returns:
+        pd.DataFrame : entries of the vehicle.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2022-09-20", periods=rows, freq="15s")
+    temps = 4 + np.cumsum(rng.normal(0, 0.05, rows))
+    in_gap = np.zeros(rows, dtype=bool)
+    for gap_start in rng.integers(0, rows, int(rows * gap_ratio / 120)):
+        in_gap[gap_start:gap_start + 120] = True
+    predicted = temps + rng.normal(0, 0.2, rows)
+    df = pd.DataFrame({"vehicle_plate": "0000AAA",
+                       "date": dates,
+                       "temp1": np.where(in_gap, np.nan, temps.round(1)),
+                       "predicted_temp": np.where(in_gap, predicted, np.nan),
+                       "date_flag": np.where(in_gap, True, None),
+                       })
+
+    return df
+
+
+def get_express_figure(df):
+    """
+    Returns the temperature graph as it was built with plotly express: SVG
+    traces with full precision temperatures and ISO dates.
+    """
+    df = df.copy()
+    df["new_predicted"] = GapDeleter(df).get_new_list()
+    fig1 = px.line(df, x="date", y=["temp1", "predicted_temp", "new_predicted"])
+    fig2 = px.scatter(df, x="date", y="temp1")
+    fig2.update_traces(mode="markers", marker_size=4)
+
+    return go.Figure(data=fig1.data + fig2.data, layout=fig1.layout)
+
+
+def get_figures(df):
+    """
+    Returns the temperature graph built in every way compared.
+    """
+    figures = {"express": get_express_figure(df)}
+    for render_mode in ["svg", "webgl"]:
+        figures[render_mode] = dash_elements(df.copy(), render_mode=render_mode).temperature_graph
+
+    return figures
+
+
+def measure(figure, repeat=3):
+    """
+    Serializes a figure as the dashboard sends it to the browser.
+
+    Returns:
+        tuple : (JSON of the figure, best time to serialize it in seconds).
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        figure_json = pio.to_json(figure, validate=False)
+        timings.append(time.perf_counter() - start)
+
+    return figure_json, min(timings)
+
+
+def write_render_page(figures_json, path):
+    """
+    Writes an HTML page that draws every figure and shows the time the
+    browser took to draw it. plotly.js is included in the page, so it works
+    without internet connection.
+    """
+    divs = "\n".join(f'<h4>{name}</h4><div id="{name}" style="height:300px;width:600px"></div>'
+                     for name in figures_json)
+    figures = ",\n".join(f'"{name}": {figure_json}' for name, figure_json in figures_json.items())
+    page = f"""<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Temperature graph render time</title></head>
+<body>
+<pre id="results">name        points     render (ms)</pre>
+{divs}
+<script>{get_plotlyjs()}</script>
+<script>
+const figures = {{{figures}}};
+async function drawAll() {{
+    const results = document.getElementById("results");
+    for (const [name, figure] of Object.entries(figures)) {{
+        const points = figure.data.reduce((total, trace) => total + trace.x.length, 0);
+        const start = performance.now();
+        await Plotly.newPlot(name, figure.data, figure.layout);
+        await new Promise(resolve => requestAnimationFrame(() => resolve()));
+        const elapsed = performance.now() - start;
+        results.textContent += "\\n" + name.padEnd(12) + String(points).padStart(6)
+                               + elapsed.toFixed(1).padStart(16);
+    }}
+}}
+drawAll();
+</script>
+</body>
+</html>
+"""
+    with open(path, "w") as html_file:
+        html_file.write(page)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Temperature graph payload benchmark.")
+    arg_parser.add_argument("--rows", type=int, default=20000,
+                            help="number of entries of the vehicle.")
+    arg_parser.add_argument("--html", default=None,
+                            help="path of the HTML page that measures the render time.")
+    args = arg_parser.parse_args()
+
+    df = build_frame(args.rows)
+    figures_json = {}
+    print(f"{'figure':<10}{'traces':>8}{'points':>10}{'JSON (kB)':>12}{'to_json (s)':>14}")
+    for name, figure in get_figures(df).items():
+        figure_json, elapsed = measure(figure)
+        figures_json[name] = figure_json
+        points = sum(len(trace.x) for trace in figure.data)
+        print(f"{name:<10}{len(figure.data):>8}{points:>10}{len(figure_json) / 1024:>12.1f}{elapsed:>14.3f}")
+
+    if args.html:
+        write_render_page(figures_json, args.html)
+        print(f"Open {args.html} in a browser to measure the render time.")
@@ -0,0 +1,126 @@
+"""
+gap_storage_benchmark.py
+This source code is part of temp-monitoring program.
+It compares the main dataset with the synthetic entries of the gaps saved in
+main_dataset.csv, as the pipeline does by default, with the one saved with
+virtual gaps, whose entries are created from the gap store when they are
+queried: the entries saved, the size of the files, the time to load them and
+the time to query a period of every vehicle. The entries are the ones of the
+files of data/json_folder, or those of a synthetic fleet. Run it from the root
+folder of the project:
+
+    (venv) $ python -m benchmarks.gap_storage_benchmark
+    (venv) $ python -m benchmarks.gap_storage_benchmark --synthetic --vehicles 20 --days 30
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from benchmarks.synthetic_fleet import FleetGenerator
+from data.dataset_store import InMemoryDataset
+from data.gap_store import GapStore
+from data.merge_engine import SortedMerger
+from data.preprocessing import ProcessingData
+from data.readers import is_telemetry_file
+
+
+def build_dataset(paths, virtual_gaps):
+    """
+    Processes the telemetry files and merges them as the pipeline does.
+
+    Returns:
+        tuple : (main dataset, gap store or None).
+    """
+    dfs = []
+    gap_store = GapStore() if virtual_gaps else None
+    for path in paths:
+        dataset = ProcessingData(path, None, virtual_gaps)
+        dfs.append(dataset.df)
+        if virtual_gaps:
+            gap_store = gap_store.merge(dataset.gaps)
+
+    return SortedMerger(dfs[::-1]).merge(), gap_store
+
+
+def measure(function, repeat):
+    """
+    Runs a function several times.
+
+    Returns:
+        tuple : (result of the function, best time in seconds).
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+
+    return result, min(timings)
+
+
+def run_queries(dataset, window):
+    """
+    Queries the first 'window' of every vehicle.
+
+    Returns:
+        int : number of entries returned.
+    """
+    rows = 0
+    for vehicle_plate in dataset.get_plates():
+        first_date, _ = dataset.get_date_range(vehicle_plate)
+        rows += len(dataset.query(vehicle_plate, first_date, first_date + window))
+
+    return rows
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Virtual gaps storage benchmark.")
+    arg_parser.add_argument("--input", default="data/json_folder",
+                            help="folder with the telemetry files.")
+    arg_parser.add_argument("--synthetic", action="store_true",
+                            help="uses the files of a synthetic fleet instead.")
+    arg_parser.add_argument("--vehicles", type=int, default=10)
+    arg_parser.add_argument("--days", type=float, default=7)
+    arg_parser.add_argument("--sampling-seconds", type=float, default=600,
+                            help="mean time between the entries of the synthetic vehicles.")
+    arg_parser.add_argument("--window-hours", type=float, default=24,
+                            help="period queried of every vehicle.")
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        input_folder = Path(args.input)
+        if args.synthetic:
+            input_folder = Path(folder) / "json_folder"
+            input_folder.mkdir()
+            FleetGenerator(args.vehicles, args.days, args.sampling_seconds).write(input_folder)
+        paths = sorted(filter(is_telemetry_file, input_folder.iterdir()))
+        window = pd.Timedelta(hours=args.window_hours)
+
+        print(f"{'storage':<14}{'saved':>9}{'synthetic':>11}{'csv (MB)':>10}{'gaps (MB)':>11}"
+              f"{'load (s)':>10}{'query (s)':>11}{'entries':>9}")
+        for virtual_gaps in [False, True]:
+            main_df, gap_store = build_dataset(paths, virtual_gaps)
+            csv_path = Path(folder) / f"main_dataset_{virtual_gaps}.csv"
+            gaps_path = Path(folder) / f"gap_store_{virtual_gaps}.npz"
+            main_df.to_csv(csv_path, index=False)
+            gaps_size = 0
+            if gap_store is not None:
+                gap_store.save(str(gaps_path))
+                gaps_size = gaps_path.stat().st_size
+
+            def load():
+                df = pd.read_csv(csv_path, parse_dates=["date"], low_memory=False)
+                return df, GapStore.load(str(gaps_path)) if virtual_gaps else None
+
+            (df, loaded_store), load_time = measure(load, args.repeat)
+            dataset = InMemoryDataset(df, loaded_store)
+            rows, query_time = measure(lambda: run_queries(dataset, window), args.repeat)
+            synthetic = len(gap_store) if virtual_gaps else int(main_df["date_flag"].eq(True).sum())
+            print(f"{'virtual' if virtual_gaps else 'materialized':<14}{len(main_df):>9}{synthetic:>11}"
+                  f"{csv_path.stat().st_size / 2**20:>10.2f}{gaps_size / 2**20:>11.2f}"
+                  f"{load_time:>10.3f}{query_time:>11.3f}{rows:>9}")
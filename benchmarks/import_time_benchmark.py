@@ -0,0 +1,91 @@
+"""
+import_time_benchmark.py
+This source code is part of temp-monitoring program.
+It measures the import time of the modules of the program with
+'python -X importtime' and works as a regression check: it fails if a module
+imports any of the heavy libraries that should only be loaded when a model
+is fitted, plotted or scored, or if it takes longer than the allowed budget.
+Run it from the root folder of the project:
+
+    (venv) $ python -m benchmarks.import_time_benchmark --budget-ms 1500
+"""
+
+import argparse
+import subprocess
+import sys
+
+MODULES = ["data.preprocessing",
+           "data.dataloader",
+           "prophet_folder.model_serializer",
+           "prophet_folder.modelo_main",
+           "prophet_folder.prediction_maker",
+           "dash_folder.dash_elements",
+           ]
+
+HEAVY_LIBRARIES = ["prophet", "cmdstanpy", "matplotlib", "sklearn"]
+
+
+def measure_import(module):
+    """
+    Imports a module in a new interpreter with '-X importtime' and parses the
+    report written to stderr.
+
+    Args:
+        str : name of the module.
+
+    Returns:
+        tuple : (cumulative import time in ms, set of top level packages imported).
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                             capture_output=True,
+                             text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"'{module}' could not be imported:\n{process.stderr}")
+
+    cumulative_us = 0
+    packages = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [field.strip() for field in line[len("import time:"):].split("|")]
+        packages.add(name.split(".")[0])
+        if name == module:
+            cumulative_us = int(cumulative)
+
+    return cumulative_us / 1000, packages
+
+
+def run_benchmark(budget_ms=None, repeat=3):
+    """
+    Measures every module and checks it against the heavy libraries and the
+    time budget.
+
+    Returns:
+        bool : True if every module passes the check.
+    """
+    passed = True
+    print(f"{'module':<35}{'import (ms)':>12}  heavy libraries")
+    for module in MODULES:
+        timings, packages = [], set()
+        for _ in range(repeat):
+            elapsed, packages = measure_import(module)
+            timings.append(elapsed)
+        best = min(timings)
+        heavy = sorted(set(HEAVY_LIBRARIES) & packages)
+        print(f"{module:<35}{best:>12.1f}  {', '.join(heavy) or '-'}")
+        if heavy or (budget_ms is not None and best > budget_ms):
+            passed = False
+
+    return passed
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Import time regression check.")
+    arg_parser.add_argument("--budget-ms", type=float, default=None,
+                            help="maximum import time allowed for every module.")
+    arg_parser.add_argument("--repeat", type=int, default=3,
+                            help="number of imports measured per module.")
+    args = arg_parser.parse_args()
+    if not run_benchmark(args.budget_ms, args.repeat):
+        print("\nImport time regression detected.")
+        sys.exit(1)
@@ -0,0 +1,100 @@
+"""
+merge_predictions_benchmark.py
+This source code is part of temp-monitoring program.
+It compares the time and the peak memory of the two ways MergePredictions
+has to merge the predictions into the main dataset: the index-aligned one and
+the outer join. Run it from the root folder of the project:
+
+    (venv) $ python -m benchmarks.merge_predictions_benchmark --vehicles 50 --rows 20000
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from prophet_folder.prediction_maker import MergePredictions
+
+
+def build_frames(vehicles, rows, gap_ratio=0.4, seed=0):
+    """
+    Builds a main dataset, with Prophet nomenclature as it arrives to
+    MergePredictions, and the predictions for its entries without temperature.
+
+    Args:
+        int : number of vehicles.
+        int : number of entries per vehicle.
+        float : proportion of entries without temperature.
+
+    Returns:
+        tuple : (main dataset, predictions) dataframes.
+    """
+    rng = np.random.default_rng(seed)
+    n = vehicles * rows
+    plates = np.repeat([f"{i:04d}AAA" for i in range(vehicles)], rows)
+    dates = np.tile(pd.date_range("2022-09-01", periods=rows, freq="4min").to_numpy(), vehicles)
+    temps = rng.normal(5, 3, n).round(1)
+    gaps = rng.random(n) < gap_ratio
+    temps[gaps] = np.nan
+    main_df = pd.DataFrame({"vehicle_id": np.repeat(np.arange(vehicles), rows),
+                            "vehicle_plate": plates,
+                            "ds": dates,
+                            "y": temps,
+                            "temp2": rng.normal(5, 3, n).round(1),
+                            "temp3": np.nan,
+                            "temp4": np.nan,
+                            "ignition": rng.integers(0, 2, n),
+                            "door1_status": np.nan,
+                            "door2_status": np.nan,
+                            "date_flag": np.where(gaps, True, None),
+                            "day_of_week": pd.DatetimeIndex(dates).day_name(),
+                            "interval_time": 240.0,
+                            "hour": pd.DatetimeIndex(dates).hour,
+                            "location": "28053 Madrid (Madrid), Spain",
+                            "predicted_temp": np.nan,
+                            "predicted_temp2": np.nan,
+                            })
+    predictions = pd.DataFrame({"date": dates[gaps],
+                                "predicted_temp": rng.normal(5, 3, gaps.sum()).round(1),
+                                "vehicle_plate": plates[gaps],
+                                })
+
+    return main_df, predictions
+
+
+def measure(method, main_df, predictions):
+    """
+    Runs MergePredictions over copies of the frames.
+
+    Returns:
+        tuple : (seconds, peak of memory allocated in MB).
+    """
+    main_df = main_df.copy()
+    predictions = predictions.copy()
+    tracemalloc.start()
+    start = time.perf_counter()
+    MergePredictions(predictions, main_df, method=method)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak / 2**20
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="MergePredictions benchmark.")
+    arg_parser.add_argument("--vehicles", type=int, default=20)
+    arg_parser.add_argument("--rows", type=int, default=20000,
+                            help="number of entries per vehicle.")
+    args = arg_parser.parse_args()
+
+    main_df, predictions = build_frames(args.vehicles, args.rows)
+    dataset_mb = main_df.memory_usage(deep=True).sum() / 2**20
+    print(f"Main dataset: {len(main_df)} entries, {dataset_mb:.1f} MB. "
+          f"Predictions: {len(predictions)} entries.")
+    for method in ["outer", "aligned"]:
+        elapsed, peak = measure(method, main_df, predictions)
+        print(f"{method:<8} time: {elapsed:7.3f} s   extra memory: {peak:8.1f} MB "
+              f"({peak / dataset_mb:.2f} x dataset)")
@@ -0,0 +1,139 @@
+"""
+model_backend_benchmark.py
+This source code is part of temp-monitoring program.
+It compares the model backends of prophet_folder/model_backends.py on the
+training data of every vehicle: the time to fit a model, the fits per second
+and the error predicting blocks of entries removed from the training data,
+as the missing temperatures are predicted. The blocks are predicted without
+temp2, as in a transmission gap, and with it, as when only temp1 is missing.
+The entries are the ones of the files of data/json_folder, or those of a
+synthetic fleet. Run it from the root folder of the project:
+
+    (venv) $ python -m benchmarks.model_backend_benchmark
+    (venv) $ python -m benchmarks.model_backend_benchmark --synthetic --vehicles 5 --days 14
+"""
+
+import argparse
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic_fleet import FleetGenerator
+from data.preprocessing import ProcessingData
+from data.readers import is_telemetry_file
+from prophet_folder.model_backends import BACKENDS, get_backend
+
+PARAMS = {"changepoint_prior_scale": 0.01,
+          "changepoint_range": 0.8,
+          "daily_seasonality": True,
+          "weekly_seasonality": True,
+          }
+
+
+def load_vehicles(paths):
+    """
+    Returns the training data of every vehicle of the telemetry files, the
+    entries with both temperatures, with Prophet nomenclature.
+    """
+    dfs = [ProcessingData(path, None).df for path in paths]
+    df = pd.concat(dfs, ignore_index=True).rename(columns={"temp1": "y", "date": "ds"})
+    df = df.dropna(subset=["y", "temp2"]).sort_values("ds", kind="stable")
+
+    return {plate: df_veh_plate[["ds", "y", "temp2"]].reset_index(drop=True)
+            for plate, df_veh_plate in df.groupby("vehicle_plate")}
+
+
+def get_hidden_blocks(df, n_blocks, block_hours, seed):
+    """
+    Returns a mask of the entries of 'n_blocks' random blocks of 'block_hours'
+    that do not overlap the first and the last 10% of the period.
+    """
+    rng = np.random.default_rng(seed)
+    first, last = df["ds"].iloc[0], df["ds"].iloc[-1]
+    duration = last - first
+    hidden = np.zeros(len(df), dtype=bool)
+    for _ in range(n_blocks):
+        start = first + duration * rng.uniform(0.1, 0.9) - pd.Timedelta(hours=block_hours)
+        hidden |= ((df["ds"] >= start) & (df["ds"] < start + pd.Timedelta(hours=block_hours))).to_numpy()
+
+    return hidden
+
+
+def rmse(y, yhat):
+    """
+    Returns the root mean squared error of some predictions.
+    """
+    return float(np.sqrt(np.mean((np.asarray(y) - np.asarray(yhat)) ** 2)))
+
+
+def evaluate_backend(backend, df, hidden, repeat):
+    """
+    Fits the model of a vehicle without the hidden entries and predicts them.
+
+    Returns:
+        dict : best fit time and RMSE of the hidden entries without and with temp2.
+    """
+    df_train = df[~hidden]
+    df_hidden = df[hidden]
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model = backend.fit(df_train, PARAMS)
+        timings.append(time.perf_counter() - start)
+    without_temp2 = model.predict(df_hidden[["ds"]].assign(temp2=np.nan))
+    with_temp2 = model.predict(df_hidden[["ds", "temp2"]])
+
+    return {"fit_s": min(timings),
+            "rmse": rmse(df_hidden["y"], without_temp2["yhat"]),
+            "rmse_temp2": rmse(df_hidden["y"], with_temp2["yhat"])}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Model backends benchmark.")
+    arg_parser.add_argument("--input", default="data/json_folder",
+                            help="folder with the telemetry files.")
+    arg_parser.add_argument("--synthetic", action="store_true",
+                            help="uses the files of a synthetic fleet instead.")
+    arg_parser.add_argument("--vehicles", type=int, default=3)
+    arg_parser.add_argument("--days", type=float, default=7)
+    arg_parser.add_argument("--sampling-seconds", type=float, default=300,
+                            help="mean time between the entries of the synthetic vehicles.")
+    arg_parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    arg_parser.add_argument("--blocks", type=int, default=5,
+                            help="blocks of entries hidden from the training data of every vehicle.")
+    arg_parser.add_argument("--block-hours", type=float, default=2)
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+    logging.getLogger("cmdstanpy").setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as folder:
+        input_folder = Path(args.input)
+        if args.synthetic:
+            input_folder = Path(folder) / "json_folder"
+            input_folder.mkdir()
+            FleetGenerator(args.vehicles, args.days, args.sampling_seconds).write(input_folder)
+        vehicles = load_vehicles(sorted(filter(is_telemetry_file, input_folder.iterdir())))
+
+    results = []
+    for seed, (vehicle_plate, df) in enumerate(vehicles.items()):
+        hidden = get_hidden_blocks(df, args.blocks, args.block_hours, seed)
+        for name in args.backends:
+            result = evaluate_backend(get_backend(name), df, hidden, args.repeat)
+            results.append({"vehicle_plate": vehicle_plate, "backend": name,
+                            "entries": len(df), "hidden": int(hidden.sum()), **result})
+            print(f"{vehicle_plate} {name:<14}{result['fit_s']:>9.3f} s{result['rmse']:>9.3f}"
+                  f"{result['rmse_temp2']:>9.3f}")
+
+    summary = pd.DataFrame(results).groupby("backend").agg(vehicles=("vehicle_plate", "count"),
+                                                           fit_s=("fit_s", "mean"),
+                                                           rmse=("rmse", "mean"),
+                                                           rmse_temp2=("rmse_temp2", "mean"))
+    summary["fits_per_s"] = 1 / summary["fit_s"]
+    print(f"{'backend':<14}{'vehicles':>9}{'fit (s)':>10}{'fits/s':>9}{'rmse':>8}{'rmse temp2':>12}")
+    for name, row in summary.iterrows():
+        print(f"{name:<14}{row['vehicles']:>9}{row['fit_s']:>10.3f}{row['fits_per_s']:>9.1f}"
+              f"{row['rmse']:>8.3f}{row['rmse_temp2']:>12.3f}")
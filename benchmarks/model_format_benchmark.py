@@ -0,0 +1,70 @@
+"""
+model_format_benchmark.py
+This source code is part of temp-monitoring program.
+It compares the file size and the load time of the saved prophet models in
+the .json format and in the .npz format, with and without training history.
+Run it from the root folder of the project once the models have been created:
+
+    (venv) $ python -m benchmarks.model_format_benchmark
+"""
+
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from prophet_folder.model_serializer import ModelSerializer
+
+
+def time_load(path, repeat):
+    """
+    Loads a model file several times and returns the best time in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ModelSerializer.load_file(path)
+        timings.append(time.perf_counter() - start)
+
+    return min(timings) * 1000
+
+
+def run_benchmark(repeat=5):
+    """
+    Converts every saved model of the fleet to the .npz format and measures
+    the size and load time of every variant.
+
+    Returns:
+        pd.Dataframe : one row per vehicle plate and format.
+    """
+    serializer = ModelSerializer()
+    models_folder = Path(serializer.get_path("x")).parent
+    model_files = sorted(models_folder.glob("*.json")) + sorted(models_folder.glob("*.npz"))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        for model_path in model_files:
+            model = ModelSerializer.load_file(str(model_path))
+            variants = {model_path.suffix[1:]: str(model_path)}
+            for keep_history in (True, False):
+                name = "npz" if keep_history else "npz_no_history"
+                variants[name] = str(Path(tmp_folder) / f"{model_path.stem}_{name}.npz")
+                ModelSerializer.save_npz(model, variants[name], keep_history)
+            for name, path in variants.items():
+                results.append({"model": model_path.stem,
+                                "format": name,
+                                "size_kb": round(Path(path).stat().st_size / 1024, 1),
+                                "load_ms": round(time_load(path, repeat), 2),
+                                })
+
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    results = run_benchmark()
+    if results.empty:
+        print("No saved models were found.")
+    else:
+        print(results.to_string(index=False))
+        print("\nTotal by format:")
+        print(results.groupby("format")[["size_kb", "load_ms"]].sum())
@@ -0,0 +1,100 @@
+"""
+reader_benchmark.py
+This source code is part of temp-monitoring program.
+It writes the same telemetry in every format supported by data/readers.py and
+compares the size of the files and the time to read them. The entries are the
+ones of a telemetry file, by default the sample of data/json_folder, or those
+of a synthetic vehicle. Run it from the root folder of the project:
+
+    (venv) $ python -m benchmarks.reader_benchmark
+    (venv) $ python -m benchmarks.reader_benchmark --synthetic --days 30
+"""
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from benchmarks.synthetic_fleet import FleetGenerator
+from data.readers import read_telemetry, write_telemetry
+
+FORMATS = ["json", "json.gz", "json.zst", "ndjson", "ndjson.gz", "ndjson.zst"]
+
+
+def write_formats(entries, folder):
+    """
+    Writes the entries in every format. The plain .json file is pretty-printed,
+    as the files exported by the telemetry platform. The zstd formats are left
+    out if the zstandard package is not installed.
+
+    Returns:
+        dict : path of the file of every format.
+    """
+    paths = {}
+    for file_format in FORMATS:
+        path = Path(folder) / f"telemetry.{file_format}"
+        if file_format == "json":
+            with open(path, "w") as json_file:
+                json.dump(entries, json_file, indent=4)
+        else:
+            try:
+                write_telemetry(entries, path)
+            except ImportError:
+                print(f"zstandard is not installed, .{file_format} is skipped.")
+                continue
+        paths[file_format] = path
+
+    return paths
+
+
+def measure(path, repeat):
+    """
+    Reads a file several times.
+
+    Returns:
+        tuple : (dataframe read, best time in seconds).
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = read_telemetry(path)
+        timings.append(time.perf_counter() - start)
+
+    return df, min(timings)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Telemetry reader benchmark.")
+    arg_parser.add_argument("--input", default="data/json_folder/0001AAA.json",
+                            help="telemetry file whose entries are written in every format.")
+    arg_parser.add_argument("--synthetic", action="store_true",
+                            help="uses the entries of a synthetic vehicle instead.")
+    arg_parser.add_argument("--days", type=float, default=7,
+                            help="days of telemetry of the synthetic vehicle.")
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    if args.synthetic:
+        entries = FleetGenerator(days=args.days).generate_vehicle(0)
+    else:
+        with open(args.input) as json_file:
+            entries = json.load(json_file)
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths = write_formats(entries, folder)
+        base_size = paths["json"].stat().st_size
+        reference = None
+        print(f"{len(entries)} entries.")
+        print(f"{'format':<12}{'size (MB)':>10}{'ratio':>8}{'read (s)':>10}{'entries/s':>12}{'MB/s':>8}")
+        for file_format, path in paths.items():
+            df, elapsed = measure(path, args.repeat)
+            if reference is None:
+                reference = df
+            else:
+                pd.testing.assert_frame_equal(df, reference, check_dtype=False)
+            size = path.stat().st_size
+            print(f"{file_format:<12}{size / 2**20:>10.2f}{base_size / size:>8.1f}{elapsed:>10.3f}"
+                  f"{len(df) / elapsed:>12.0f}{size / 2**20 / elapsed:>8.1f}")
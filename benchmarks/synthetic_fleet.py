@@ -0,0 +1,235 @@
+"""
+synthetic_fleet.py
+This source code is part of temp-monitoring program.
+It generates synthetic telemetry of a fleet of refrigerated vehicles, one .json
+file per vehicle with the same 'out_*' schema as the files in data/json_folder,
+so the pipeline and the dashboard can be measured with any number of vehicles.
+The same seed always generates the same files:
+
+    (venv) $ python -m benchmarks.synthetic_fleet --vehicles 50 --days 7 --output data/json_folder
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+LOCATIONS = ["28053 Madrid (Madrid), Spain",
+             "Avenida de Severo Ochoa, 28850 Torrejón de Ardoz (Madrid), Spain",
+             "Calle de Alcalá, 28014 Madrid (Madrid), Spain",
+             "Autovía del Nordeste, 19200 Azuqueca de Henares (Guadalajara), Spain",
+             "Carretera de Toledo, 28905 Getafe (Madrid), Spain",
+             ]
+
+PROFILES = ["reefer", "ambient"]
+GAP_DISTRIBUTIONS = ["exponential", "lognormal", "fixed"]
+
+
+class FleetGenerator:
+    """
+    Generates the telemetry of every vehicle of the fleet.
+
+    Args:
+        int (optional) : number of vehicles.
+        float (optional) : days of telemetry per vehicle.
+        float (optional) : mean time between entries, in seconds.
+        float (optional) : mean number of transmission gaps per day.
+        float (optional) : mean duration of a gap, in minutes.
+        str (optional) : 'exponential', 'lognormal' or 'fixed' duration of the gaps.
+        float (optional) : probability of an entry without temperatures.
+        str (optional) : 'reefer', temperature held around a setpoint with door
+                        openings and defrost cycles, or 'ambient', a daily cycle.
+        float (optional) : setpoint (reefer) or mean temperature (ambient).
+        float (optional) : standard deviation of the sensor noise.
+        str (optional) : first day of the telemetry.
+        int (optional) : seed of the random generator.
+    """
+    def __init__(self, vehicles=10, days=2, sampling_seconds=15, gaps_per_day=4,
+                 gap_minutes=30, gap_distribution="exponential", missing_rate=0.01,
+                 profile="reefer", setpoint=4, noise=0.3, start="2022-09-20", seed=0):
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown temperature profile '{profile}'. Use one of {PROFILES}.")
+        if gap_distribution not in GAP_DISTRIBUTIONS:
+            raise ValueError(f"Unknown gap distribution '{gap_distribution}'. Use one of {GAP_DISTRIBUTIONS}.")
+        self.vehicles = vehicles
+        self.days = days
+        self.sampling_seconds = sampling_seconds
+        self.gaps_per_day = gaps_per_day
+        self.gap_minutes = gap_minutes
+        self.gap_distribution = gap_distribution
+        self.missing_rate = missing_rate
+        self.profile = profile
+        self.setpoint = setpoint
+        self.noise = noise
+        self.start = pd.Timestamp(start)
+        self.seed = seed
+
+
+    @staticmethod
+    def get_plate(index):
+        """
+        Returns the vehicle plate of the vehicle number 'index'.
+        """
+        return f"{index:04d}AAA"
+
+
+    def get_timestamps(self, rng):
+        """
+        Returns the seconds since the start of the entries of a vehicle, without
+        the ones that fall inside a transmission gap.
+        """
+        total_seconds = self.days * 86400
+        intervals = rng.exponential(self.sampling_seconds, int(total_seconds / self.sampling_seconds * 1.2) + 1)
+        seconds = np.cumsum(np.maximum(np.round(intervals), 1))
+        seconds = seconds[seconds < total_seconds]
+
+        gaps = rng.poisson(self.gaps_per_day * self.days)
+        gap_starts = rng.uniform(0, total_seconds, gaps)
+        if self.gap_distribution == "exponential":
+            gap_lengths = rng.exponential(self.gap_minutes, gaps)
+        elif self.gap_distribution == "lognormal":
+            gap_lengths = rng.lognormal(np.log(self.gap_minutes), 0.75, gaps)
+        else:
+            gap_lengths = np.full(gaps, float(self.gap_minutes))
+        in_gap = np.zeros(len(seconds), dtype=bool)
+        for gap_start, gap_length in zip(gap_starts, gap_lengths * 60):
+            in_gap |= (seconds >= gap_start) & (seconds < gap_start + gap_length)
+
+        return seconds[~in_gap]
+
+
+    def get_temperatures(self, seconds, ignition, rng):
+        """
+        Returns the temperature of the main probe at every entry of a vehicle.
+        """
+        hours = seconds / 3600
+        if self.profile == "ambient":
+            daily_cycle = 6 * np.sin(2 * np.pi * (hours - 9) / 24)
+            return self.setpoint + daily_cycle + rng.normal(0, self.noise, len(seconds))
+
+        temps = self.setpoint + rng.normal(0, self.noise, len(seconds))
+        # Defrost cycles every 6 hours, 20 minutes long.
+        defrost = (hours % 6) < 1 / 3
+        temps[defrost] += 6 * np.sin(np.pi * (hours[defrost] % 6) * 3)
+        # Door openings while the vehicle is delivering, decaying in 15 minutes.
+        openings = rng.uniform(0, hours[-1], int(rng.poisson(8 * self.days))) if len(hours) else []
+        for opening in openings:
+            after = hours - opening
+            warming = (after >= 0) & (after < 0.25) & (ignition == 1)
+            temps[warming] += 10 * np.exp(-after[warming] * 12)
+
+        return temps
+
+
+    def generate_vehicle(self, index):
+        """
+        Generates the entries of a vehicle.
+
+        Args:
+            int : number of the vehicle.
+
+        Returns:
+            list : entries with the 'out_*' schema of the telemetry files.
+        """
+        rng = np.random.default_rng([self.seed, index])
+        seconds = self.get_timestamps(rng)
+        hours = (seconds / 3600 + self.start.hour) % 24
+        ignition = ((hours >= 6) & (hours < 20)).astype(int)
+        temp1 = self.get_temperatures(seconds, ignition, rng).round(1)
+        temp2 = (temp1 + rng.normal(-0.2, 0.1, len(seconds))).round(1)
+        missing = rng.random(len(seconds)) < self.missing_rate
+        speeds = np.where(ignition == 1, rng.integers(0, 90, len(seconds)), 0)
+        odometer = 174703355 + np.cumsum(speeds * 4)
+        locations = rng.integers(0, len(LOCATIONS), len(seconds))
+        dates = (self.start + pd.to_timedelta(seconds, unit="s")).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+        entries = []
+        for i in range(len(seconds)):
+            entries.append({"out_vehicle_id": str(32714525 + index),
+                            "out_registration": self.get_plate(index),
+                            "out_event_ts": dates[i],
+                            "out_driver": None,
+                            "out_longitude": f"{-3.65 + rng.normal(0, 0.2):.6f}",
+                            "out_speed": str(speeds[i]),
+                            "out_event_description": LOCATIONS[locations[i]],
+                            "out_event_odo": str(odometer[i]),
+                            "out_terminal_serial": f"CD{138882 + index}",
+                            "ignition": None if missing[i] else ("t" if ignition[i] else "f"),
+                            "temp1": None if missing[i] else str(temp1[i]),
+                            "temp2": None if missing[i] else str(temp2[i]),
+                            "temp3": None,
+                            "temp4": None,
+                            "door1_status": None,
+                            "door2_status": None,
+                            })
+
+        return entries
+
+
+    def write(self, folder):
+        """
+        Writes a .json file per vehicle in the folder.
+
+        Returns:
+            list : paths of the written files.
+        """
+        Path(folder).mkdir(parents=True, exist_ok=True)
+        paths = []
+        for index in range(self.vehicles):
+            path = Path(folder) / f"{self.get_plate(index)}.json"
+            with open(path, "w") as json_file:
+                json.dump(self.generate_vehicle(index), json_file)
+            paths.append(path)
+
+        return paths
+
+
+def add_arguments(arg_parser):
+    """
+    Adds the options of the generator to a command line parser.
+    """
+    arg_parser.add_argument("--vehicles", type=int, default=10)
+    arg_parser.add_argument("--days", type=float, default=2)
+    arg_parser.add_argument("--sampling-seconds", type=float, default=15,
+                            help="mean time between entries.")
+    arg_parser.add_argument("--gaps-per-day", type=float, default=4)
+    arg_parser.add_argument("--gap-minutes", type=float, default=30,
+                            help="mean duration of the gaps.")
+    arg_parser.add_argument("--gap-distribution", choices=GAP_DISTRIBUTIONS, default="exponential")
+    arg_parser.add_argument("--missing-rate", type=float, default=0.01,
+                            help="probability of an entry without temperatures.")
+    arg_parser.add_argument("--profile", choices=PROFILES, default="reefer")
+    arg_parser.add_argument("--setpoint", type=float, default=4)
+    arg_parser.add_argument("--noise", type=float, default=0.3)
+    arg_parser.add_argument("--start", default="2022-09-20")
+    arg_parser.add_argument("--seed", type=int, default=0)
+
+
+def get_generator(args):
+    """
+    Returns the generator configured with the parsed command line options.
+    """
+    return FleetGenerator(vehicles=args.vehicles,
+                          days=args.days,
+                          sampling_seconds=args.sampling_seconds,
+                          gaps_per_day=args.gaps_per_day,
+                          gap_minutes=args.gap_minutes,
+                          gap_distribution=args.gap_distribution,
+                          missing_rate=args.missing_rate,
+                          profile=args.profile,
+                          setpoint=args.setpoint,
+                          noise=args.noise,
+                          start=args.start,
+                          seed=args.seed)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Synthetic fleet telemetry generator.")
+    add_arguments(arg_parser)
+    arg_parser.add_argument("--output", default="synthetic_fleet",
+                            help="folder where the .json files are written.")
+    args = arg_parser.parse_args()
+    paths = get_generator(args).write(args.output)
+    print(f"{len(paths)} vehicles written in {args.output}.")
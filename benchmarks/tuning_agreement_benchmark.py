@@ -0,0 +1,141 @@
+"""
+tuning_agreement_benchmark.py
+This source code is part of temp-monitoring program.
+It checks that the 'decimated' tuning mode of the [tuning] section of
+config.ini chooses the same hyperparameters as the tuning at full
+resolution. For every vehicle, or cluster, every combination is evaluated in
+both modes and the report shows the time of each, whether both choose the
+same combination and, if not, the rank and the extra RMSE of the decimated
+choice in the full resolution tuning. The entries are the ones of
+main_dataset.csv, or those of a synthetic fleet. The cross validation runs
+are saved in the cache, so the tuning of the pipeline reuses them. Run it from
+the root folder of the project:
+
+    (venv) $ python -m benchmarks.tuning_agreement_benchmark
+    (venv) $ python -m benchmarks.tuning_agreement_benchmark --synthetic --vehicles 3 --days 14 --backend fourier_ridge
+"""
+
+import argparse
+import logging
+import tempfile
+import time
+from configparser import ConfigParser
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic_fleet import FleetGenerator
+from data.merge_engine import SortedMerger
+from data.preprocessing import ProcessingData
+from prophet_folder.model_backends import BACKENDS, get_backend
+from prophet_folder.modelo_main import ProphetModel
+
+parser = ConfigParser()
+parser.read("config.ini")
+
+
+def load_main_df(args):
+    """
+    Returns the entries of the saved main dataset, or of a synthetic fleet,
+    with Prophet nomenclature.
+    """
+    if not args.synthetic:
+        main_dataset_path = str(Path.cwd())+parser.get("path_folder", "main_dataset")+"/main_dataset.csv"
+        main_df = pd.read_csv(main_dataset_path, parse_dates=["date"])
+    else:
+        with tempfile.TemporaryDirectory() as folder:
+            paths = FleetGenerator(args.vehicles, args.days, args.sampling_seconds).write(folder)
+            main_df = SortedMerger([ProcessingData(path, None).df for path in paths]).merge()
+
+    return main_df.rename(columns={"temp1": "y", "date": "ds"})
+
+
+def tune(model, veh_plate, tuning_mode):
+    """
+    Evaluates every combination of hyperparameters of a vehicle in a tuning mode.
+
+    Returns:
+        dict : entries used, RMSE of every combination, runs read from the cache and time.
+    """
+    start = time.perf_counter()
+    df_veh_plate, cv_kwargs = model.get_tuning_data(veh_plate, tuning_mode)
+    _, rmses, _, cache_hits = model.evaluate_params(veh_plate, df_veh_plate, cv_kwargs)
+
+    return {"entries": len(df_veh_plate),
+            "rmses": np.array(rmses, dtype="float64"),
+            "cache_hits": cache_hits,
+            "time_s": time.perf_counter() - start}
+
+
+def compare(veh_plate, full, decimated, all_params):
+    """
+    Compares the combination chosen in each mode.
+
+    Returns:
+        dict : row of the report.
+    """
+    full_best = int(np.argmin(full["rmses"]))
+    decimated_best = int(np.argmin(decimated["rmses"]))
+    # Position of the decimated choice among the full resolution results, 1 being the best.
+    rank = int((full["rmses"] < full["rmses"][decimated_best]).sum()) + 1
+
+    return {"model": veh_plate,
+            "entries": full["entries"],
+            "decimated_entries": decimated["entries"],
+            "full_s": full["time_s"],
+            "decimated_s": decimated["time_s"],
+            "cache_hits": full["cache_hits"] + decimated["cache_hits"],
+            "agree": all_params[full_best] == all_params[decimated_best],
+            "rank": rank,
+            "extra_rmse_pct": 100 * (full["rmses"][decimated_best] / full["rmses"][full_best] - 1),
+            "full_params": all_params[full_best],
+            "decimated_params": all_params[decimated_best]}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Agreement of the decimated and the full resolution tuning.")
+    arg_parser.add_argument("--synthetic", action="store_true",
+                            help="uses the entries of a synthetic fleet instead of main_dataset.csv.")
+    arg_parser.add_argument("--vehicles", type=int, default=3)
+    arg_parser.add_argument("--days", type=float, default=14)
+    arg_parser.add_argument("--sampling-seconds", type=float, default=60,
+                            help="mean time between the entries of the synthetic vehicles.")
+    arg_parser.add_argument("--plates", nargs="+", default=None,
+                            help="vehicle plates tuned. Defaults to all of them.")
+    arg_parser.add_argument("--backend", default=None, choices=list(BACKENDS),
+                            help="model backend. Defaults to the one in config.ini.")
+    arg_parser.add_argument("--output", default=None, help="saves the report in this .csv file.")
+    args = arg_parser.parse_args()
+    logging.getLogger("cmdstanpy").setLevel(logging.WARNING)
+
+    main_df = load_main_df(args)
+    model = ProphetModel(main_df)
+    if args.backend is not None:
+        model.backend = get_backend(args.backend)
+    all_params = model.get_param_combinations()
+    plates = args.plates or main_df["vehicle_plate"].dropna().unique()
+
+    rows = []
+    for veh_plate in model.get_model_keys(plates):
+        full = tune(model, veh_plate, "full")
+        decimated = tune(model, veh_plate, "decimated")
+        rows.append(compare(veh_plate, full, decimated, all_params))
+
+    report = pd.DataFrame(rows)
+    print(f"backend {model.backend.name}, decimated to {parser.get('tuning', 'frequency', fallback='15min')} "
+          f"means with at most {parser.getint('tuning', 'max_folds', fallback=3)} folds.")
+    print(f"{'model':<12}{'entries':>9}{'decimated':>11}{'full (s)':>10}{'decim. (s)':>12}"
+          f"{'cached':>8}{'agree':>7}{'rank':>6}{'extra rmse':>12}")
+    for row in rows:
+        print(f"{row['model']:<12}{row['entries']:>9}{row['decimated_entries']:>11}{row['full_s']:>10.2f}"
+              f"{row['decimated_s']:>12.2f}{row['cache_hits']:>8}{str(row['agree']):>7}{row['rank']:>6}"
+              f"{row['extra_rmse_pct']:>11.1f}%")
+    print(f"Same hyperparameters in {int(report['agree'].sum())} of {len(report)} models, "
+          f"{report['extra_rmse_pct'].mean():.1f}% extra RMSE on average, "
+          f"{report['full_s'].sum() / report['decimated_s'].sum():.1f}x faster.")
+    for row in rows:
+        if not row["agree"]:
+            print(f"{row['model']}: full {row['full_params']}, decimated {row['decimated_params']}")
+    if args.output:
+        report.to_csv(args.output, index=False)
@@ -0,0 +1,380 @@
+"""
+api.py
+This source code is part of temp-monitoring program.
+It contains the read-only HTTP API served by the Flask server of the
+dashboard, for the programs that poll the imputed temperatures:
+
+    /api/v1/vehicles                          vehicle plates and their dates.
+    /api/v1/vehicles/<plate>/temperatures     real and predicted temperatures.
+    /api/v1/vehicles/<plate>/gaps             gaps of the temperatures.
+    /api/v1/vehicles/<plate>/model            model used to predict them.
+
+The temperatures are sent in pages: the 'next' link of a page continues from
+its last date, so every page is a query of its own and no page is kept by the
+server. Every answer carries an ETag made from the version of the dataset, or
+of the model files, and the request, so a client repeating a request with
+'If-None-Match' receives '304 Not Modified' without the dataset being queried
+while nothing changes. The answers are JSON, or an Arrow IPC stream with
+'format=arrow', and are compressed with gzip for the clients accepting it.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+from pathlib import Path
+from urllib.parse import urlencode
+
+import flask
+import numpy as np
+import pandas as pd
+from configparser import ConfigParser
+
+from prophet_folder.channel_imputer import PREDICTED_COLUMNS
+
+parser = ConfigParser()
+parser.read("config.ini")
+my_path = Path.cwd()
+
+API_FORMATS = {"json": "application/json",
+               "arrow": "application/vnd.apache.arrow.stream",
+               }
+TEMPERATURE_COLUMNS = (["date", "vehicle_plate", "date_flag"]
+                       + list(PREDICTED_COLUMNS) + list(PREDICTED_COLUMNS.values()))
+
+
+def api_enabled():
+    """
+    Checks if the API is enabled in config.ini.
+    """
+    return parser.getboolean("api", "enabled", fallback=True)
+
+
+def get_etag(*parts):
+    """
+    Returns the ETag of an answer, a hash of everything it depends on.
+    """
+    return hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def get_file_version(*paths):
+    """
+    Returns the version of some files, their modification times in ns. The
+    missing files count as 0, so creating them changes the version.
+    """
+    return "-".join(str(os.stat(path).st_mtime_ns) if path and os.path.exists(path) else "0"
+                    for path in paths)
+
+
+def to_arrow(df):
+    """
+    Returns a dataframe as an Arrow IPC stream.
+    """
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue().to_pybytes()
+
+
+def take_page(chunks, page_size):
+    """
+    Takes the entries of a page from the chunks of a query, sorted by date.
+    The page is extended with the entries of the date of its last entry, as the
+    next page starts after that date.
+
+    Args:
+        iterator : dataframes with the entries of the query.
+        int : number of entries of the page.
+
+    Returns:
+        tuple : (entries of the page, True if there are entries after it).
+    """
+    taken = []
+    entries = 0
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        taken.append(chunk)
+        entries += len(chunk)
+        if entries > page_size:
+            page = pd.concat(taken, ignore_index=True)
+            taken = [page]
+            if page["date"].iloc[-1] > page["date"].iloc[page_size-1]:
+                break
+    if not taken:
+        return None, False
+    page = pd.concat(taken, ignore_index=True)
+    if len(page) <= page_size:
+        return page, False
+    page = page[page["date"] <= page["date"].iloc[page_size-1]]
+
+    return page, len(page) < entries
+
+
+def get_gap_summaries(df, channel="temp1"):
+    """
+    Summarizes the gaps of a channel: the blocks of contiguous entries added by
+    the upsampler ('date_flag' True) without its real temperature, as NaNFinder
+    finds them for the dashboard.
+
+    Args:
+        pd.Dataframe : entries of a vehicle, sorted by date.
+        str (optional) : temperature channel.
+
+    Returns:
+        pd.Dataframe : one row per gap, with its first and last dates, its
+                      entries and the ones with a predicted temperature.
+    """
+    missing = (df[channel].isna() & (df["date_flag"] == True)).to_numpy()
+    # Number of the block of every entry, which changes where the gaps start or end.
+    blocks = np.cumsum(np.r_[True, missing[1:] != missing[:-1]])
+    gaps = pd.DataFrame({"date": df["date"].to_numpy()[missing],
+                         "predicted": df[PREDICTED_COLUMNS[channel]].notna().to_numpy()[missing],
+                         "block": blocks[missing]})
+    gaps = gaps.groupby("block").agg(start=("date", "first"),
+                                     end=("date", "last"),
+                                     entries=("date", "size"),
+                                     predicted_entries=("predicted", "sum"))
+    gaps["duration_seconds"] = (gaps["end"] - gaps["start"]).dt.total_seconds()
+
+    return gaps.reset_index(drop=True)
+
+
+def get_model_info(vehicle_plate):
+    """
+    Returns the files the temperatures of a vehicle are predicted with: the
+    model, with the cluster it is shared with, its best hyperparameters and
+    its cross validation metrics.
+    """
+    from prophet_folder.model_serializer import ModelSerializer
+    from prophet_folder.vehicle_clusters import get_cluster_path, get_model_route
+
+    model_key, offset = get_model_route(vehicle_plate)
+
+    return {"model_key": model_key,
+            "offset": offset,
+            "model": ModelSerializer().find_path(model_key),
+            "best_params": str(my_path)+parser.get("path_folder", "best_params").format(model_key),
+            "perf_metrics": str(my_path)+parser.get("path_folder", "perf_metrics").format(model_key),
+            "clusters": get_cluster_path()}
+
+
+def get_model_metadata(vehicle_plate, model_info):
+    """
+    Returns the metadata of the model of a vehicle, read from its files.
+    """
+    metadata = {"vehicle_plate": vehicle_plate,
+                "model_key": model_info["model_key"],
+                "offset": model_info["offset"],
+                "trained": model_info["model"] is not None}
+    if model_info["model"] is not None:
+        model_path = Path(model_info["model"])
+        backend = "prophet"
+        if model_path.suffix == ".npz":
+            with np.load(model_path, allow_pickle=False) as bundle:
+                backend = json.loads(str(bundle["meta"])).get("backend", "prophet")
+        metadata.update({"backend": backend,
+                         "model_format": model_path.suffix[1:],
+                         "trained_at": pd.Timestamp(model_path.stat().st_mtime_ns).isoformat()})
+    if os.path.exists(model_info["best_params"]):
+        with open(model_info["best_params"], "r") as params_file:
+            metadata["best_params"] = json.load(params_file)
+    if os.path.exists(model_info["perf_metrics"]):
+        df_perf = pd.read_csv(model_info["perf_metrics"])
+        if "rmse" in df_perf.columns and not df_perf.empty:
+            metadata["cv_rmse"] = float(df_perf["rmse"].min())
+
+    return metadata
+
+
+def register_api_routes(server, dataset):
+    """
+    Adds the /api/v1 routes to the Flask server of the dashboard. The dates
+    of the temperatures and the gaps are passed as the 'start' and 'end'
+    arguments of the URL, both included, and default to all the dates of the
+    vehicle.
+
+    Args:
+        flask.Flask : server of the dash app.
+        InMemoryDataset or SharedDataset : dataset queried by the dashboard.
+    """
+    page_size = parser.getint("api", "page_size", fallback=5000)
+    max_page_size = parser.getint("api", "max_page_size", fallback=50000)
+    compress_level = parser.getint("api", "compress_level", fallback=6)
+
+    def get_format():
+        """
+        Returns the format of the answer, from the 'format' argument or the
+        Accept header.
+        """
+        api_format = flask.request.args.get("format")
+        if api_format is None:
+            mimetype = flask.request.accept_mimetypes.best_match(list(API_FORMATS.values()),
+                                                                 default=API_FORMATS["json"])
+            api_format = next(name for name, value in API_FORMATS.items() if value == mimetype)
+        if api_format not in API_FORMATS:
+            flask.abort(400)
+
+        return api_format
+
+
+    def use_gzip():
+        """
+        Checks if the client accepts answers compressed with gzip.
+        """
+        return flask.request.accept_encodings["gzip"] > 0
+
+
+    def get_cached_response(version):
+        """
+        Returns the ETag of the request for a version, and the '304 Not
+        Modified' answer if the client already has it.
+        """
+        etag = get_etag(version, flask.request.full_path, get_format(), use_gzip())
+        if flask.request.if_none_match.contains(etag):
+            return etag, make_response(b"", None, etag, status=304)
+
+        return etag, None
+
+
+    def make_response(body, mimetype, etag, headers=None, status=200):
+        """
+        Returns an answer with its ETag, compressed if the client accepts it.
+        The clients must revalidate the answers before using them again.
+        """
+        response = flask.Response(body, status=status, mimetype=mimetype, headers=headers)
+        if status == 200 and use_gzip():
+            response.set_data(gzip.compress(response.get_data(), compresslevel=compress_level))
+            response.headers["Content-Encoding"] = "gzip"
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["Vary"] = "Accept, Accept-Encoding"
+
+        return response
+
+
+    def make_table_response(df, etag, fields, headers=None):
+        """
+        Returns the entries of an answer as an Arrow stream, or as JSON under
+        'entries' with the rest of the fields.
+        """
+        if get_format() == "arrow":
+            return make_response(to_arrow(df), API_FORMATS["arrow"], etag, headers)
+        entries = df.to_json(orient="records", date_format="iso")
+        body = json.dumps(fields, default=str)[:-1] + f', "entries": {entries}}}'
+
+        return make_response(body, API_FORMATS["json"], etag, headers)
+
+
+    def get_plate_dates(vehicle_plate):
+        """
+        Returns the dates of the request for a vehicle: the query starts after
+        the first one, so the first date is included.
+        """
+        if vehicle_plate not in dataset.get_plates():
+            flask.abort(404)
+        first_date, last_date = dataset.get_date_range(vehicle_plate)
+        try:
+            start_date = pd.Timestamp(flask.request.args.get("start", first_date))
+            end_date = flask.request.args.get("end")
+            if end_date is None:
+                end_date = pd.Timestamp(last_date)
+            elif len(end_date) == 10:
+                end_date = pd.Timestamp(end_date) + pd.Timedelta(days=1) - pd.Timedelta(1, "ns")
+            else:
+                end_date = pd.Timestamp(end_date)
+        except ValueError:
+            flask.abort(400)
+
+        return str(start_date - pd.Timedelta(1, "ns")), str(end_date)
+
+
+    def get_vehicles():
+        etag, cached = get_cached_response(dataset.get_version())
+        if cached is not None:
+            return cached
+        vehicles = []
+        for vehicle_plate in dataset.get_plates():
+            first_date, last_date = dataset.get_date_range(vehicle_plate)
+            vehicles.append({"vehicle_plate": vehicle_plate,
+                             "first_date": pd.Timestamp(first_date),
+                             "last_date": pd.Timestamp(last_date)})
+
+        return make_table_response(pd.DataFrame(vehicles, columns=["vehicle_plate", "first_date", "last_date"]),
+                                   etag, {"vehicles": len(vehicles)})
+
+
+    def get_temperatures(vehicle_plate):
+        etag, cached = get_cached_response(dataset.get_version())
+        if cached is not None:
+            return cached
+        start_date, end_date = get_plate_dates(vehicle_plate)
+        try:
+            size = min(int(flask.request.args.get("page_size", page_size)), max_page_size)
+            after = flask.request.args.get("after")
+            if after is not None:
+                start_date = str(max(pd.Timestamp(after), pd.Timestamp(start_date)))
+        except ValueError:
+            flask.abort(400)
+        if size < 1:
+            flask.abort(400)
+
+        page, more = take_page(dataset.iter_query(vehicle_plate, start_date, end_date, chunksize=size + 1), size)
+        if page is None:
+            page = pd.DataFrame(columns=TEMPERATURE_COLUMNS)
+        page = page.reindex(columns=TEMPERATURE_COLUMNS)
+
+        next_url = None
+        headers = {}
+        if more:
+            args = flask.request.args.to_dict()
+            args["after"] = str(page["date"].iloc[-1])
+            next_url = f"{flask.request.path}?{urlencode(args)}"
+            headers["Link"] = f'<{next_url}>; rel="next"'
+
+        return make_table_response(page, etag, {"vehicle_plate": vehicle_plate,
+                                                "entries_count": len(page),
+                                                "next": next_url},
+                                   headers)
+
+
+    def get_gaps(vehicle_plate):
+        etag, cached = get_cached_response(dataset.get_version())
+        if cached is not None:
+            return cached
+        channel = flask.request.args.get("channel", "temp1")
+        if channel not in PREDICTED_COLUMNS:
+            flask.abort(400)
+        start_date, end_date = get_plate_dates(vehicle_plate)
+        df = dataset.query(vehicle_plate, start_date, end_date)
+        df = df.reindex(columns=["date", "date_flag", channel, PREDICTED_COLUMNS[channel]])
+        gaps = get_gap_summaries(df.sort_values("date", kind="stable"), channel)
+
+        return make_table_response(gaps, etag, {"vehicle_plate": vehicle_plate,
+                                                "channel": channel,
+                                                "gaps": len(gaps),
+                                                "missing_entries": int(gaps["entries"].sum())})
+
+
+    def get_model(vehicle_plate):
+        if vehicle_plate not in dataset.get_plates():
+            flask.abort(404)
+        model_info = get_model_info(vehicle_plate)
+        etag, cached = get_cached_response(get_file_version(model_info["model"], model_info["best_params"],
+                                                            model_info["perf_metrics"], model_info["clusters"]))
+        if cached is not None:
+            return cached
+        if get_format() != "json":
+            flask.abort(400)
+
+        return make_response(json.dumps(get_model_metadata(vehicle_plate, model_info), default=str),
+                             API_FORMATS["json"], etag)
+
+    server.add_url_rule("/api/v1/vehicles", "api_vehicles", get_vehicles)
+    server.add_url_rule("/api/v1/vehicles/<vehicle_plate>/temperatures", "api_temperatures", get_temperatures)
+    server.add_url_rule("/api/v1/vehicles/<vehicle_plate>/gaps", "api_gaps", get_gaps)
+    server.add_url_rule("/api/v1/vehicles/<vehicle_plate>/model", "api_model", get_model)
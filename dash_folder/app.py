@@ -8,34 +8,118 @@ all this elements as a new tab in a browser.
 
 import webbrowser
 import sys
+from functools import wraps
 from pathlib import Path
 from threading import Timer
+from configparser import ConfigParser
 
 import dash
-from dash import dcc, Output, Input, html
+from dash import dcc, dash_table, Output, Input, State, html, ClientsideFunction
 import dash_bootstrap_components as dbc
 import dash_daq as daq
 import dash_loading_spinners as dls
 
 sys.path.append(str(Path.cwd()))
 from data.dataloader import MainDataset
-from dash_folder.dash_elements import dash_elements
+from data.dataset_store import InMemoryDataset, SharedDataset
+from data.excursions import ExcursionScanner
+from data.retention import TieredDataset, retention_enabled
+from dash_folder.dash_elements import TEMPERATURE_CHANNELS, dash_elements
+from dash_folder.api import api_enabled, register_api_routes
+from dash_folder.export import EXPORT_FORMATS, get_export_url, register_export_route
+from dash_folder.metrics import DashMetrics, InstrumentedDataset, record_cache
+
+parser = ConfigParser()
+parser.read("config.ini")
+
+# In 'mmap' mode, the dataset published by the pipeline is memory-mapped and
+# shared by every dash worker. Otherwise, an instance of the MainDataset class
+# is called to retrieve main_dataset and, with virtual gaps, its gap store.
+if parser.get("dashboard", "data_mode", fallback="memory") == "mmap":
+    dataset = SharedDataset()
+else:
+    object = MainDataset()
+    dataset = InMemoryDataset(object.main_dataset, object.gap_store)
+
+# With retention, the periods compacted by 'python -m data.retention' are read
+# from its tier, and the long periods are summarized.
+if retention_enabled():
+    dataset = TieredDataset(dataset)
+
+# The entries returned by every query are recorded for the /metrics endpoint.
+metrics_enabled = parser.getboolean("metrics", "enabled", fallback=True)
+if metrics_enabled:
+    dataset = InstrumentedDataset(dataset)
+
+# With background callbacks, the heavy callbacks are queued in a disk cache and
+# run by worker processes, so they don't block the web workers. Their results
+# are cached by the version of the dataset: the hash of its entries in memory
+# mode, or the time it was published in mmap mode, so the disk cache is not
+# reused by a dashboard started again with other entries.
+background_callback_manager = None
+if parser.getboolean("dashboard", "background_callbacks", fallback=False):
+    import diskcache
+    cache = diskcache.Cache(str(Path.cwd())+parser.get("dashboard", "background_cache",
+                                                       fallback="/data/callback_cache"))
+    background_callback_manager = dash.DiskcacheManager(
+                                    cache,
+                                    cache_by=[dataset.get_version],
+                                    expire=parser.getint("dashboard", "background_expire",
+                                                         fallback=3600))
+background_interval = parser.getint("dashboard", "background_interval", fallback=250)
+# Queries with up to this number of entries run inline even with background
+# callbacks, as a background job adds a process and a polling interval.
+background_min_entries = parser.getint("dashboard", "background_min_entries", fallback=200000)
+
+# The progress of a background job and its Cancel button are shown over the
+# spinner of its figure, which hides the rest of its contents while it runs.
+PROGRESS_HIDDEN = {"display": "none"}
+PROGRESS_SHOWN = {"display": "block",
+                  "visibility": "visible",
+                  "position": "absolute",
+                  "top": "60%",
+                  "width": "100%",
+                  "textAlign": "center",
+                  "zIndex": 100}
+
+
+def get_job_stores(name):
+    """
+    Returns the stores of a heavy callback: the results computed inline, the
+    queries sent to the background jobs and the results of the jobs. They are
+    placed inside the spinner of the figure, so it spins while any of them is
+    being computed.
+    """
+    return [dcc.Store(id=f"{name}_inline"),
+            dcc.Store(id=f"{name}_job"),
+            dcc.Store(id=f"{name}_background")]
 
 
-# Calling an instance of the MainDataset class to retrieve main_dataset.
-object = MainDataset()
-main_dataset = object.main_dataset
-main_dataset = main_dataset.sort_values(["vehicle_plate", "date"])
+# Options of the temperature graph.
+graph_options = {"render_mode": parser.get("dashboard", "render_mode", fallback="auto"),
+                 "webgl_threshold": parser.getint("dashboard", "webgl_threshold", fallback=5000),
+                 "decimals": parser.getint("dashboard", "graph_decimals", fallback=2),
+                 }
 
 FONT_AWESOME = "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/4.7.0/css/font-awesome.min.css"
 external_stylesheets = [dbc.themes.SUPERHERO, FONT_AWESOME]
 
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets,
                 meta_tags=[{"name": "viewport",
-                            "content": "width=device-width, initial-scale=1.0"}]
+                            "content": "width=device-width, initial-scale=1.0"}],
+                background_callback_manager=background_callback_manager,
                 )
-
-app.layout = dbc.Container([
+# Flask server, used to run the dashboard under a WSGI server such as gunicorn.
+server = app.server
+if metrics_enabled:
+    DashMetrics(app)
+# Exports of the selected vehicle and dates, streamed by the server.
+register_export_route(server, dataset)
+# Read-only API of the temperatures, the gaps and the models, under /api/v1.
+if api_enabled():
+    register_api_routes(server, dataset)
+
+monitoring_page = dbc.Container([
                         dbc.Row([
                             dbc.Col(html.H1("Temperature monitoring",
                                             id = "Title", 
@@ -70,7 +154,7 @@ app.layout = dbc.Container([
                                                         multi=False, 
                                                         value="0001AAA",   
                                                         options=[{"label":x, "value":x}
-                                                        for x in sorted(main_dataset["vehicle_plate"].unique())
+                                                        for x in dataset.get_plates()
                                                                 ],
                                                         ),
                                                     ], width=3),
@@ -89,39 +173,74 @@ app.layout = dbc.Container([
                                                     ], width=6),
 
                                             dbc.Col([
-                                                dbc.Button(
-                                                        id="csv-button",
-                                                        children=[html.I(className = "fa fa-download mr-1"), "Download"],
-                                                        n_clicks=0, 
-                                                        style={"font-size": "12px", 
+                                                dbc.DropdownMenu(
+                                                        id="export_menu",
+                                                        label="Download",
+                                                        children=[dbc.DropdownMenuItem(f".{export_format}",
+                                                                        id=f"export_{export_format.replace('.', '_')}",
+                                                                        external_link=True)
+                                                                  for export_format in EXPORT_FORMATS],
+                                                        toggle_style={"font-size": "12px", 
                                                                 "width": "130px", 
                                                                 "margin-bottom": "10px",  
                                                                 "height": "37px", 
                                                                 "verticalAlign": "top"},
                                                             ),
-                                                dcc.Download(id="download-dataframe-csv"),
                                                     ], width=2, className="mr-6"),
                                             ]),
 
                                     dbc.Row([
+                                        dbc.Col([
                                         html.H5("Temperature Prediction", 
                                                 id="titulo grafico", 
                                                 style={"color": "white", 
                                                         "fontSize": 16, 
                                                         "text-align": "left"},                           
                                                 ),
-                                            ]),
+                                                ], width=9),
+
+                                        # Temperature probe shown by the graphs and the gauges.
+                                        dbc.Col([
+                                        dcc.Dropdown(id="channel_dropdown",
+                                                    multi=False,
+                                                    clearable=False,
+                                                    value="temp1",
+                                                    options=[{"label": x, "value": x}
+                                                    for x in TEMPERATURE_CHANNELS
+                                                            ],
+                                                    style={"color": "black",
+                                                            "fontSize": 12},
+                                                    ),
+                                                ], width=3),
+                                            ], align="center"),
                                             
                                     dbc.Row([
                                         dbc.Col([ 
-                                            dls.Fade(
+                                            dls.Fade([
                                                 dcc.Graph(id="temperature_graphics"),
+                                                # Figure drawn by the server, without the limit lines.
+                                                dcc.Store(id="temperature_figure"),
+                                                *get_job_stores("temperature"),
+                                                html.Div([
+                                                    html.Span(id="temperature_progress",
+                                                            style={"fontSize": 12}),
+                                                    dbc.Button("Cancel",
+                                                            id="temperature_cancel",
+                                                            n_clicks=0,
+                                                            size="sm",
+                                                            style={"font-size": "11px",
+                                                                    "margin-left": "10px"}),
+                                                        ],
+                                                        id="temperature_running",
+                                                        style=PROGRESS_HIDDEN),
+                                                    ],
                                                 color="#FFFFFF",
                                                 speed_multiplier=1,
                                                 width=20,
                                                 thickness=5),
                                                 ]),
                                             ]),
+
                                     ], className="divBorder"),
 
                                 html.Div([
@@ -321,8 +440,22 @@ app.layout = dbc.Container([
 
                                 dbc.Row([
                                     dbc.Col([
-                                        dls.Fade(
+                                        dls.Fade([
                                                 dcc.Graph(id="missing_data_pct_graph"),
+                                                *get_job_stores("gaps"),
+                                                html.Div([
+                                                    html.Span(id="gaps_progress",
+                                                            style={"fontSize": 12}),
+                                                    dbc.Button("Cancel",
+                                                            id="gaps_cancel",
+                                                            n_clicks=0,
+                                                            size="sm",
+                                                            style={"font-size": "11px",
+                                                                    "margin-left": "10px"}),
+                                                        ],
+                                                        id="gaps_running",
+                                                        style=PROGRESS_HIDDEN),
+                                                    ],
                                                 color="#FFFFFF",
                                                 speed_multiplier=1,
                                                 width=20,
@@ -399,7 +532,174 @@ app.layout = dbc.Container([
                                 ], 
                                 width=6),
                             ]),
-                        ])
+                        ], id="monitoring_page")
+
+excursions_page = dbc.Container([
+                        dbc.Row([
+                            dbc.Col(html.H1("Temperature excursions",
+                                            id="title_excursions",
+                                            style={"text-align":"center",
+                                                    "marginBottom": "20px"}),
+                                            width=12),
+                                ]),
+
+                        html.Div([
+                            dbc.Row([
+                                dbc.Col([html.H5("Select limit temperatures",
+                                                id="text_select_excursion_limits",
+                                                style={"color": "white",
+                                                        "fontSize": 16,
+                                                        "text-align": "left"},
+                                                )
+                                        ],
+                                        width=6),
+
+                                dbc.Col([html.H6(id="excursions_summary",
+                                                style={"color": "white",
+                                                        "fontSize": 14,
+                                                        "text-align": "right"},
+                                                )
+                                        ],
+                                        width=6),
+                                ],
+                                align="center"),
+
+                            dbc.Row([
+                                    dcc.RangeSlider(-10, 40, value=[0,30],
+                                    allowCross=False,
+                                    id="excursion_range_slider",
+                                    tooltip={"placement": "bottom",
+                                            "always_visible": True}
+                                                    ),
+                                    ]),
+                                ],
+                                className="divBorder"),
+
+                        html.Div([
+                            dls.Fade(
+                                dash_table.DataTable(
+                                    id="excursions_table",
+                                    columns=[{"name": "Vehicle plate", "id": "vehicle_plate"},
+                                             {"name": "Start", "id": "start"},
+                                             {"name": "End", "id": "end"},
+                                             {"name": "Duration (min)", "id": "duration", "type": "numeric"},
+                                             {"name": "Peak (ºC)", "id": "peak", "type": "numeric"},
+                                             {"name": "Entries", "id": "entries", "type": "numeric"},
+                                             {"name": "Predicted", "id": "predicted"},
+                                             ],
+                                    sort_action="native",
+                                    filter_action="native",
+                                    page_size=20,
+                                    style_header={"backgroundColor": "#4e5d6c",
+                                                  "fontWeight": "bold"},
+                                    style_cell={"backgroundColor": "#2b3e50",
+                                                "color": "white",
+                                                "fontSize": 12,
+                                                "textAlign": "center"},
+                                    ),
+                                color="#FFFFFF",
+                                speed_multiplier=1,
+                                width=20,
+                                thickness=5),
+                                ],
+                                className="divBorder"),
+                        ], id="excursions_page", style={"display": "none"})
+
+app.layout = html.Div([
+                dcc.Location(id="url"),
+                dbc.Nav([
+                    dbc.NavLink("Monitoring", href="/", active="exact"),
+                    dbc.NavLink("Excursions", href="/excursions", active="exact"),
+                    ],
+                    pills=True,
+                    style={"marginBottom": "10px"}),
+                monitoring_page,
+                excursions_page,
+                ])
+
+# The excursion scanner is built on the first visit to the excursions page and
+# again when the dataset changes.
+excursion_scanner = None
+
+
+def get_excursion_scanner():
+    """
+    Returns the excursion scanner of the current version of the dataset.
+    """
+    global excursion_scanner
+    outdated = excursion_scanner is None or excursion_scanner.version != dataset.get_version()
+    record_cache("excursion_scanner", not outdated)
+    if outdated:
+        excursion_scanner = ExcursionScanner.from_dataset(dataset)
+
+    return excursion_scanner
+
+
+def get_query_size(vehicle_plate, start_date, end_date, *_):
+    """
+    Returns the number of entries of the query of a heavy callback.
+    """
+    if not vehicle_plate or not start_date or not end_date:
+        return 0
+
+    return dataset.count(vehicle_plate, start_date, end_date + " 23:59:59")
+
+
+def heavy_callback(name, outputs, inputs, progress, running, cancel):
+    """
+    Registers a callback that can take long. With background callbacks, the
+    queries of more than 'background_min_entries' entries run as background
+    jobs: the progress messages are written to the 'progress' output, the
+    'running' outputs are set while the job runs and it is cancelled by the
+    'cancel' inputs or when a shorter query is answered inline. The rest run
+    inline, as they do without background callbacks, and their progress
+    messages are discarded. Both write their results in the stores of
+    'get_job_stores', and the browser copies the last one to the outputs.
+    The decorated function receives the function that sets the progress
+    as its first argument, and returns the list of values of the outputs.
+    """
+    def decorator(func):
+        @wraps(func)
+        def run_inline(*values):
+            return func(lambda *_: None, *values)
+
+        if background_callback_manager is None:
+            app.callback(outputs, inputs)(run_inline)
+            return func
+
+        @app.callback(Output(f"{name}_inline", "data"),
+                      Output(f"{name}_job", "data"),
+                      inputs)
+        def run_or_queue(*values):
+            if get_query_size(*values) <= background_min_entries:
+                return run_inline(*values), dash.no_update
+
+            return dash.no_update, list(values)
+
+        @app.callback(Output(f"{name}_background", "data"),
+                      Input(f"{name}_job", "data"),
+                      background=True,
+                      progress=progress,
+                      running=running,
+                      cancel=cancel + [Input(f"{name}_inline", "data")],
+                      interval=background_interval,
+                      prevent_initial_call=True)
+        # Dash tells the jobs, and their cached results, apart by the source of
+        # the function, which is the one of 'func' through 'wraps'.
+        @wraps(func)
+        def run_job(set_progress, values):
+            return func(set_progress, *values)
+
+        app.clientside_callback(
+            ClientsideFunction(namespace="background", function_name="select_result"),
+            outputs,
+            Input(f"{name}_inline", "data"),
+            Input(f"{name}_background", "data"))
+
+        return func
+
+    return decorator
+
 
 @app.callback(           
         Output("calendar", "min_date_allowed"),
@@ -413,40 +713,40 @@ def min_max_date_by_plate(vehicle_plate):
     the maximum and minimum dates are detected and used as start and end points
     for the calendar.
     """
-    df_plate_sel = main_dataset[main_dataset["vehicle_plate"] == vehicle_plate]
-    start_date = df_plate_sel["date"].min().date()
-    end_date = df_plate_sel["date"].max().date()
+    first_date, last_date = dataset.get_date_range(vehicle_plate)
+    start_date = first_date.date()
+    end_date = last_date.date()
 
     return [start_date, end_date, start_date, end_date]  
 
 
-@app.callback(
-    [Output("temperature_graphics", "figure")],  
+@heavy_callback(
+    "temperature",
+    [Output("temperature_figure", "data")],
         [Input("veh_plate_dropdown", "value"),
-        Input("temp_range_slider", "value"),
         Input("calendar", "start_date"),
         Input("calendar", "end_date"),
-        Input("radio_show_t_crit", "value")])
-def get_temperature_graph(vehicle_plate, limit_selection, start_date, end_date, show_limits):
+        Input("channel_dropdown", "value")],
+    progress=Output("temperature_progress", "children"),
+    running=[(Output("temperature_running", "style"), PROGRESS_SHOWN, PROGRESS_HIDDEN)],
+    cancel=[Input("temperature_cancel", "n_clicks")])
+def get_temperature_graph(set_progress, vehicle_plate, start_date, end_date, channel):
     """
-    The vehicle, temperature limits, whether the limits are shown, start and end 
-    dates are chosen on the dashboard and stored in the callback. 
-    The graph is updated with these data. 
+    The vehicle, start and end dates and the temperature probe are chosen on
+    the dashboard and stored in the callback. The figure is drawn with these
+    data and saved in the browser, where the temperature limits are added to it.
     """
     end_date = end_date + " 23:59:59"
-    mask = (
-        (main_dataset["vehicle_plate"] == vehicle_plate)
-         & (main_dataset["date"] > start_date)
-         & (main_dataset["date"] <= end_date)
-        )
     # Applies the date and vehicle filter
-    global filtered_data
-    filtered_data = main_dataset.loc[mask, :]
+    set_progress("Filtering entries...")
+    filtered_data = dataset.query(vehicle_plate, start_date, end_date)
+
+    set_progress(f"Drawing {len(filtered_data)} entries...")
 
     # Creates instance from dash_elements class
     elements = dash_elements(**{"filtered_df": filtered_data, 
-                                "limit_selection": limit_selection,
-                                "show_limits": show_limits,
+                                **graph_options,
+                                "channel": channel,
                                 })
 
     # Generates variables from class objects
@@ -454,31 +754,38 @@ def get_temperature_graph(vehicle_plate, limit_selection, start_date, end_date,
     return [temp_graph]
 
 
+# The temperature limits only move two lines of the figure, so they are added
+# in the browser (assets/clientside.js) without calling the server.
+app.clientside_callback(
+    ClientsideFunction(namespace="temperature", function_name="overlay_limits"),
+    Output("temperature_graphics", "figure"),
+    Input("temperature_figure", "data"),
+    Input("temp_range_slider", "value"),
+    Input("radio_show_t_crit", "value"))
+
+
 @app.callback(
     [Output("regnumber_graphics", "figure")],
         [Input("veh_plate_dropdown", "value"),
         Input("calendar", "start_date"),
         Input("calendar", "end_date"),
-        Input("hour-day_radio_item", "value")],
+        Input("hour-day_radio_item", "value"),
+        Input("channel_dropdown", "value")],
                 )
-def get_regnumber_graph(vehicle_plate, start_date, end_date, graf_bins):
+def get_regnumber_graph(vehicle_plate, start_date, end_date, graf_bins, channel):
     """
     The vehicle, start and end dates, whether data are shown by day or by hour
-    are chosen on the dashboard and stored in the callback. The graph is updated 
-    with these data.
+    and the temperature probe are chosen on the dashboard and stored in the
+    callback. The graph is updated with these data.
     """
     end_date = end_date + " 23:59:59"
-    mask = (
-        (main_dataset["vehicle_plate"] == vehicle_plate)
-         & (main_dataset["date"] > start_date)
-         & (main_dataset["date"] <= end_date)
-        )
     # Applies the date and vehicle filter
-    filtered_data = main_dataset.loc[mask, :]
+    filtered_data = dataset.query(vehicle_plate, start_date, end_date)
 
     # Creates instance from dash_elements class
     elements = dash_elements(**{"filtered_df":filtered_data,
-                                "bins_interval": graf_bins})
+                                "bins_interval": graf_bins,
+                                "channel": channel})
 
     # Generates variables from class objects
     regnumber_graph = elements.regnumber_graph
@@ -486,7 +793,8 @@ def get_regnumber_graph(vehicle_plate, start_date, end_date, graf_bins):
     return [regnumber_graph]
 
 
-@app.callback(
+@heavy_callback(
+    "gaps",
     [Output("gauge_min", "value"),
     Output("gauge_media", "value"),
     Output("gauge_max", "value"),
@@ -496,30 +804,28 @@ def get_regnumber_graph(vehicle_plate, start_date, end_date, graf_bins):
     Output("avg_stdev_graph", "figure"),],
         [Input("veh_plate_dropdown", "value"),
         Input("calendar", "start_date"),
-        Input("calendar", "end_date")]
-                )
-def dibujar_grafica(vehicle_plate, start_date, end_date):
+        Input("calendar", "end_date"),
+        Input("channel_dropdown", "value")],
+    progress=Output("gaps_progress", "children"),
+    running=[(Output("gaps_running", "style"), PROGRESS_SHOWN, PROGRESS_HIDDEN)],
+    cancel=[Input("gaps_cancel", "n_clicks")])
+def dibujar_grafica(set_progress, vehicle_plate, start_date, end_date, channel):
     """
-    The vehicle, start and end dates are chosen on the dashboard and stored 
-    in the callback. This information is used to display graphs with 
-    information on missing data. 
-    It modifies a global variable.
+    The vehicle, start and end dates and the temperature probe are chosen on
+    the dashboard and stored in the callback. This information is used to
+    display graphs with information on missing data. 
 
     Returns: 
         list : list with graphics.
     """
     end_date = end_date + " 23:59:59"
-    mask = (
-        (main_dataset["vehicle_plate"] == vehicle_plate)
-         & (main_dataset["date"] > start_date)
-         & (main_dataset["date"] <= end_date)
-        )
     # Applies the date and vehicle filter
-    global filtered_data
-    filtered_data = main_dataset.loc[mask, :]
+    set_progress("Filtering entries...")
+    filtered_data = dataset.query(vehicle_plate, start_date, end_date)
+    set_progress(f"Computing gap statistics of {len(filtered_data)} entries...")
     
     # Creates instance from dash_elements class
-    elements = dash_elements(filtered_data)
+    elements = dash_elements(filtered_data, channel=channel)
     
     # Generates variables from class objects
     g_min, g_mean, g_max = elements.temp_gauges
@@ -532,15 +838,61 @@ def dibujar_grafica(vehicle_plate, start_date, end_date):
 
 
 @app.callback(
-        Output("download-dataframe-csv", "data"),
-        Input("csv-button", "n_clicks"),
-        prevent_initial_call=True) 
-def download_file(n_clicks):
+        [Output(f"export_{export_format.replace('.', '_')}", "href") for export_format in EXPORT_FORMATS],
+        Input("veh_plate_dropdown", "value"),
+        Input("calendar", "start_date"),
+        Input("calendar", "end_date"))
+def get_export_links(vehicle_plate, start_date, end_date):
+    """
+    Points the download links to the export of the selected vehicle and dates.
+    The file is streamed by the server when the link is opened, so the export
+    doesn't pass through the callbacks.
+    """
+    if not vehicle_plate or not start_date or not end_date:
+        return [None] * len(EXPORT_FORMATS)
+
+    return [get_export_url(export_format, vehicle_plate, start_date, end_date)
+            for export_format in EXPORT_FORMATS]
+
+
+@app.callback(
+        Output("monitoring_page", "style"),
+        Output("excursions_page", "style"),
+        Input("url", "pathname"))
+def display_page(pathname):
+    """
+    Shows the excursions page on its path and the monitoring page on any other.
+    """
+    if pathname == "/excursions":
+        return [{"display": "none"}, {"display": "block"}]
+
+    return [{"display": "block"}, {"display": "none"}]
+
+
+@app.callback(
+        Output("excursions_table", "data"),
+        Output("excursions_summary", "children"),
+        Input("url", "pathname"),
+        Input("excursion_range_slider", "value"))
+def get_excursions_table(pathname, limit_selection):
     """
-    If the download button is pressed the data pertaining to the selected
-    vehicle and dates is selected for download.
+    Lists the excursions of the whole fleet out of the selected temperature
+    limits. It only runs on the excursions page.
     """
-    return dcc.send_data_frame(filtered_data.to_csv, "dataframe.csv", index=False)
+    if pathname != "/excursions":
+        raise dash.exceptions.PreventUpdate
+    scanner = get_excursion_scanner()
+    record_cache("excursion_scans", scanner.is_cached(*limit_selection))
+    excursions = scanner.scan(*limit_selection)
+
+    table = excursions.assign(start=excursions["start"].dt.strftime("%d-%m-%Y %H:%M"),
+                              end=excursions["end"].dt.strftime("%d-%m-%Y %H:%M"),
+                              duration=excursions["duration"].round(1),
+                              predicted=excursions["predicted"].map({True: "Yes", False: "No"}))
+    summary = (f"{len(excursions)} excursions in "
+               f"{excursions['vehicle_plate'].nunique()} of {len(dataset.get_plates())} vehicles")
+
+    return [table.to_dict("records"), summary]
 
 
 def open_browser():
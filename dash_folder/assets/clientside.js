@@ -0,0 +1,58 @@
+/*
+clientside.js
+This source code is part of temp-monitoring program.
+It contains the callbacks of the dashboard that run in the browser, for the
+controls that only change how a figure is displayed, and the one that shows
+the results of the heavy callbacks, computed inline or as background jobs.
+*/
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    temperature: {
+        /*
+        Adds the lines of the minimum and maximum temperature limits to the
+        temperature figure drawn by the server, when they are shown.
+        */
+        overlay_limits: function(figure, limit_selection, show_limits) {
+            if (!figure) {
+                return window.dash_clientside.no_update;
+            }
+            const shapes = [];
+            if (show_limits === true) {
+                [["max", limit_selection[1]], ["min", limit_selection[0]]].forEach(function([name, value]) {
+                    shapes.push({type: "line",
+                                 name: name,
+                                 xref: "x domain",
+                                 x0: 0,
+                                 x1: 1,
+                                 yref: "y",
+                                 y0: value,
+                                 y1: value,
+                                 line: {width: 1, color: "orange"}});
+                });
+            }
+
+            return Object.assign({}, figure, {layout: Object.assign({}, figure.layout, {shapes: shapes})});
+        }
+    },
+    background: {
+        /*
+        Returns the values of the outputs of a heavy callback from the result
+        that has just arrived: the one computed inline or the one of the
+        background job.
+        */
+        select_result: function(inline_result, background_result) {
+            const triggered = window.dash_clientside.callback_context.triggered.map(function(trigger) {
+                return trigger.prop_id;
+            });
+            const from_job = triggered.some(function(prop_id) {
+                return prop_id.endsWith("_background.data");
+            });
+            const result = from_job ? background_result : inline_result;
+            if (!result) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+
+            return result;
+        }
+    }
+});
@@ -7,11 +7,49 @@ in the dashboard.
 
 import datetime as dt
 
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go 
 import plotly.express as px 
 
 from dash_folder.dash_elements_functions import GapDeleter, NaNFinder
+from prophet_folder.channel_imputer import PREDICTED_COLUMNS
+
+RENDER_MODES = ["auto", "svg", "webgl"]
+# Temperature probes that can be shown, with the column of their predictions.
+TEMPERATURE_CHANNELS = list(PREDICTED_COLUMNS)
+# Colors of the real, predicted and connecting traces, the first ones of the plotly template.
+TEMPERATURE_COLORS = ["#636efa", "#EF553B", "#00cc96"]
+
+
+def get_epoch_ms(dates):
+    """
+    Returns the dates as milliseconds since the epoch, which plotly draws on a
+    date axis like the dates themselves and which take less space in the JSON
+    of a figure than ISO strings.
+    """
+    return dates.to_numpy().astype("datetime64[ms]").astype(np.int64)
+
+
+def get_trace_points(x, y):
+    """
+    Returns the points of a line, leaving out the missing values except the
+    first one after a real value, which is kept to break the line there. The
+    predicted temperatures are missing in most entries, so most of their
+    points are not sent.
+
+    Args:
+        np.array : x values.
+        np.array : y values.
+
+    Returns:
+        tuple : (x values, y values).
+    """
+    present = ~np.isnan(y)
+    keep = present.copy()
+    keep[1:] |= present[:-1]
+
+    return x[keep], y[keep]
 
 
 class dash_elements:
@@ -26,13 +64,32 @@ class dash_elements:
         list : two-element corresponding to min and max temp limits.
         bool : capability of show the temperature limits.
         str : 'D'/'H' change the bins parameters for the graph object.
+        str (optional) : 'svg', 'webgl' or 'auto', which draws the temperature
+                        graph with WebGL when it has more than 'webgl_threshold' points.
+        int (optional) : number of points from which 'auto' uses WebGL.
+        int (optional) : decimals of the temperatures sent to the browser.
+        str (optional) : temperature probe shown, 'temp1' to 'temp4'.
     """
     def __init__(self, filtered_df, limit_selection=[5,20], 
-                 show_limits=False, bins_interval="D"):
+                 show_limits=False, bins_interval="D", render_mode="auto",
+                 webgl_threshold=5000, decimals=2, channel="temp1"):
+        if render_mode not in RENDER_MODES:
+            raise ValueError(f"Unknown render mode '{render_mode}'. Use one of {RENDER_MODES}.")
+        if channel not in TEMPERATURE_CHANNELS:
+            raise ValueError(f"Unknown temperature channel '{channel}'. Use one of {TEMPERATURE_CHANNELS}.")
+        self.channel = channel
+        self.predicted_column = PREDICTED_COLUMNS[channel]
+        # The datasets saved before the other probes were imputed don't have their columns.
+        for column in [self.channel, self.predicted_column]:
+            if column not in filtered_df.columns:
+                filtered_df[column] = np.nan
         self.selected_min = limit_selection[0]
         self.selected_max = limit_selection[1]
         self.show_limits = show_limits
         self.bins_interval = bins_interval
+        self.render_mode = render_mode
+        self.webgl_threshold = webgl_threshold
+        self.decimals = decimals
         self.filtered_df = filtered_df
         self.temperature_graph = self.get_temperature_graph() 
         self.regnumber_graph = self.get_regnumber_graph()
@@ -47,22 +104,39 @@ class dash_elements:
         Taking the atributes defined in the class, creates the different figures
         that will be displayed in Dash and returns each of them.
 
+        The real temperatures are drawn as a line with markers, and the dates and
+        temperatures are sent as epoch milliseconds and rounded numbers. Above
+        'webgl_threshold' points the traces are drawn with WebGL (Scattergl),
+        unless the render mode is 'svg'.
+
         Return: 
             figure : figure that includes all line plots with temperature (predicted/real/new created)
         """
-        gap_finder = GapDeleter(self.filtered_df)
+        gap_finder = GapDeleter(self.filtered_df, self.channel, self.predicted_column)
         graph_list = gap_finder.get_new_list()
         self.filtered_df["new_predicted"] = graph_list
-        fig1 = px.line(self.filtered_df, 
-                        x="date", 
-                        y=["temp1", "predicted_temp", "new_predicted"],
-                        )
-        fig2 = px.scatter(self.filtered_df, 
-                        x="date",
-                        y="temp1",
-                        )
-        fig2.update_traces(mode="markers", marker_size=4)
-        all_figs = go.Figure(data= fig1.data + fig2.data, layout=fig1.layout)
+        dates = get_epoch_ms(self.filtered_df["date"])
+        columns = [self.channel, self.predicted_column, "new_predicted"]
+        traces = []
+        for column in columns:
+            temps = self.filtered_df[column].to_numpy(dtype=float).round(self.decimals)
+            traces.append(get_trace_points(dates, temps))
+        points = sum(len(x) for x, _ in traces)
+        use_webgl = self.render_mode == "webgl" or (self.render_mode == "auto"
+                                                    and points > self.webgl_threshold)
+        scatter = go.Scattergl if use_webgl else go.Scatter
+
+        all_figs = go.Figure()
+        for column, color, (x, y) in zip(columns, TEMPERATURE_COLORS, traces):
+            all_figs.add_trace(scatter(x=x, 
+                                        y=y,
+                                        name=column,
+                                        mode="lines+markers" if column == self.channel else "lines",
+                                        marker_size=4,
+                                        line_color=color,
+                                        hovertemplate=f"variable={column}<br>date=%{{x}}<br>value=%{{y}}<extra></extra>",
+                                        ))
+        all_figs.update_xaxes(type="date")
         if self.show_limits is True:
             all_figs.add_hline(y=self.selected_max, 
                                 line_width=1, 
@@ -111,7 +185,7 @@ class dash_elements:
         """
         # Counts the number of entries of the filtered dataframe.
         resampled = self.filtered_df.resample(self.bins_interval, 
-                                        on="date", )["temp1"].count()
+                                        on="date", )[self.channel].count()
         # Checks if the interval button has been selected to H(hour) or D(day)
         if self.bins_interval == "H":
             tick_lab_mode="period"
@@ -162,9 +236,9 @@ class dash_elements:
             list : list with figures.
         """
         # Obtains the maximum, minumum and average from the filtered dataframe.
-        min_temp = self.filtered_df["temp1"].min()
-        mean_temp = self.filtered_df["temp1"].mean()
-        max_temp = self.filtered_df["temp1"].max()
+        min_temp = self.filtered_df[self.channel].min()
+        mean_temp = self.filtered_df[self.channel].mean()
+        max_temp = self.filtered_df[self.channel].max()
 
         return [min_temp, mean_temp, max_temp]
 
@@ -179,11 +253,11 @@ class dash_elements:
         """
         # Counts the number of entries with real temperature data and entries
         # where the data is predicted.
-        regs_temp1 = self.filtered_df['temp1'].count()
-        regs_predict = self.filtered_df['predicted_temp'].count()
+        regs_temp1 = self.filtered_df[self.channel].count()
+        regs_predict = self.filtered_df[self.predicted_column].count()
 
-        # Sum of real and predicted entries.
-        regs_total = regs_temp1 + regs_predict
+        # Sum of real and predicted entries. A probe the vehicle doesn't have has none.
+        regs_total = max(regs_temp1 + regs_predict, 1)
 
         # Generates the pie chart with the right values and formats it.
         fig_pie = px.pie(values=[regs_temp1/regs_total, (regs_predict/regs_total)], 
@@ -214,7 +288,7 @@ class dash_elements:
             list : list with figures with gap information. 
         """
         # Generates a list with all the entries that have gaps in the temperature data.
-        new_list = NaNFinder(self.filtered_df).get_grouped_index()
+        new_list = NaNFinder(self.filtered_df, self.channel).get_grouped_index()
         block_duration = []
         output_frmt = "%Y-%m-%d %H:%M:%S"
 
@@ -231,7 +305,7 @@ class dash_elements:
         # Ensures correct time format is displayed
         t_min = int(total_duration/60)
         t_hour, t_min = divmod(t_min,60)
-        avg_duration = int(total_duration/len(new_list))
+        avg_duration = int(total_duration/len(new_list)) if new_list else 0
         m_min, m_sec = divmod(avg_duration,60)   
         avg_duration = f"{m_min}m:{m_sec}s"
         total_duration = f"{t_hour}h:{t_min}m"
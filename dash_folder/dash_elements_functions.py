@@ -19,8 +19,12 @@ class GapDeleter:
 
     Args:
         pd.Dataframe : dataset with all registered data.
+        str (optional) : column of the real temperatures.
+        str (optional) : column of their predictions.
     """
-    def __init__(self, df):
+    def __init__(self, df, real_column="temp1", predicted_column="predicted_temp"):
+        self.real_column = real_column
+        self.predicted_column = predicted_column
         self.gap_list = self.set_list(df)
         
     
@@ -29,28 +33,30 @@ class GapDeleter:
         Taking the dataframe called by the class, extracts each entry that has 
         a prediction of missing data which will be displayed graphically.
         The method iterates for every row and detect if the previous and the 
-        following row in 'predicted_temp' exists, copying the value to connect 
+        following row in the predicted column exists, copying the value to connect 
         the graph-line.
         
         Returns:
             list : list with modified values need to draw the graph.
         """
+        predicted = df[self.predicted_column]
+        real = df[self.real_column]
         new_list = []
-        new_list.append(df["predicted_temp"].iloc[0])
+        new_list.append(predicted.iloc[0])
         for i in range(0, len(df)):
             if 0 < i < (len(df)-1):
-                if pd.isna(df["predicted_temp"].iloc[i]):
-                    if pd.isna(df["predicted_temp"].iloc[i-1]) is False:
-                        new_list.append(df["temp1"].iloc[i])
+                if pd.isna(predicted.iloc[i]):
+                    if pd.isna(predicted.iloc[i-1]) is False:
+                        new_list.append(real.iloc[i])
                     else:
-                        if pd.isna(df["predicted_temp"].iloc[i+1]) is False:
-                            new_list.append(df["temp1"].iloc[i])
+                        if pd.isna(predicted.iloc[i+1]) is False:
+                            new_list.append(real.iloc[i])
                         else:
-                            new_list.append(df["predicted_temp"].iloc[i])
+                            new_list.append(predicted.iloc[i])
                 else:
-                    new_list.append(df["predicted_temp"].iloc[i])
+                    new_list.append(predicted.iloc[i])
                     
-        new_list.append(df["predicted_temp"].iloc[-1])        
+        new_list.append(predicted.iloc[-1])        
         
         return new_list
 
@@ -68,14 +74,15 @@ class NaNFinder:
 
     Args:
         pd.Dataframe : dataframe with all entries needed.
+        str (optional) : column of the temperatures whose gaps are found.
     """
 
-    def __init__(self, fichero):
-        self.grouped_list = self.set_grouped_list(fichero)
+    def __init__(self, fichero, real_column="temp1"):
+        self.grouped_list = self.set_grouped_list(fichero, real_column)
         
         
     @staticmethod
-    def set_grouped_list(df):
+    def set_grouped_list(df, real_column="temp1"):
         """
         Taking the dataframe called by the class, extracts blocks of contiguous
         dates where temp register is empty and 'data_flag' value is True, 
@@ -83,14 +90,15 @@ class NaNFinder:
 
         Args: 
             pd.Dataframe : dataframe with all the entries.
+            str (optional) : column of the temperatures.
 
         Returns:
             list : list with arrays.
         """
         df_sort = df.reset_index().sort_values(by="date")
 
-        # Filters gaps in temp1 and synthesised dates from upsampler.
-        mask1 = df_sort["temp1"].isna()        
+        # Filters gaps in the temperatures and synthesised dates from upsampler.
+        mask1 = df_sort[real_column].isna()        
         mask2 = df_sort["date_flag"] == True   
         df_new = df_sort[mask1 & mask2]   
         
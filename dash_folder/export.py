@@ -0,0 +1,168 @@
+"""
+export.py
+This source code is part of temp-monitoring program.
+It contains the Flask route that exports the entries of a vehicle between two
+dates as .csv, .csv.gz or .parquet. The file is built and sent chunk by chunk
+while it is being downloaded, so exporting a long period doesn't hold the
+whole file in memory, and the selection travels in the URL of every request,
+so each user receives the data they selected.
+"""
+
+import io
+import zlib
+from urllib.parse import urlencode
+
+import flask
+import pandas as pd
+from configparser import ConfigParser
+
+parser = ConfigParser()
+parser.read("config.ini")
+
+EXPORT_FORMATS = {"csv": "text/csv",
+                  "csv.gz": "application/gzip",
+                  "parquet": "application/vnd.apache.parquet",
+                  }
+
+
+class StreamBuffer(io.RawIOBase):
+    """
+    Write-only file that keeps what is written until it is drained, used as
+    the sink of the Parquet writer so the file can be sent while it is written.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+
+    def writable(self):
+        return True
+
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+
+        return len(data)
+
+
+    def tell(self):
+        return self.position
+
+
+    def drain(self):
+        """
+        Returns, and forgets, everything written since the last call.
+        """
+        data = b"".join(self.chunks)
+        self.chunks = []
+
+        return data
+
+
+def iter_csv(chunks, columns):
+    """
+    Yields a .csv file, header first, from an iterator of dataframes. The header
+    is built from the columns of the dataset, so an export without entries
+    still has it.
+    """
+    yield pd.DataFrame(columns=columns).to_csv(index=False).encode()
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=False, columns=columns).encode()
+
+
+def iter_gzip(blocks):
+    """
+    Compresses a stream of bytes as a .gz file.
+    """
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for block in blocks:
+        compressed = compressor.compress(block)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def iter_parquet(chunks, schema):
+    """
+    Yields a .parquet file from an iterator of dataframes, one row group per
+    dataframe. The schema is the one of the whole dataset, as a chunk alone
+    can't tell the type of a column without values.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = schema.remove_metadata()
+    sink = StreamBuffer()
+    writer = pq.ParquetWriter(sink, schema)
+    for chunk in chunks:
+        writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def iter_export(chunks, export_format, schema):
+    """
+    Yields the exported file in the selected format.
+
+    Args:
+        iterator : dataframes with the entries to export.
+        str : 'csv', 'csv.gz' or 'parquet'.
+        pyarrow.Schema : schema of the entries.
+    """
+    if export_format == "csv":
+        return iter_csv(chunks, schema.names)
+    if export_format == "csv.gz":
+        return iter_gzip(iter_csv(chunks, schema.names))
+
+    return iter_parquet(chunks, schema)
+
+
+def get_export_url(export_format, vehicle_plate, start_date, end_date):
+    """
+    Returns the URL of the export of a vehicle between two dates, both included.
+    """
+    query = urlencode({"plate": vehicle_plate,
+                       "start": str(start_date)[:10],
+                       "end": str(end_date)[:10]})
+
+    return f"/export/{export_format}?{query}"
+
+
+def register_export_route(server, dataset):
+    """
+    Adds the /export/<format> route to the Flask server of the dashboard. The
+    vehicle plate and the dates are passed as the 'plate', 'start' and 'end'
+    arguments of the URL.
+
+    Args:
+        flask.Flask : server of the dash app.
+        InMemoryDataset or SharedDataset : dataset queried by the dashboard.
+    """
+    chunksize = parser.getint("dashboard", "export_chunksize", fallback=50000)
+
+    def export_data(export_format):
+        if export_format not in EXPORT_FORMATS:
+            flask.abort(404)
+        vehicle_plate = flask.request.args.get("plate", "")
+        if vehicle_plate not in dataset.get_plates():
+            flask.abort(404)
+        try:
+            start_date = pd.Timestamp(flask.request.args["start"])
+            end_date = pd.Timestamp(flask.request.args["end"])
+        except (KeyError, ValueError):
+            flask.abort(400)
+
+        chunks = dataset.iter_query(vehicle_plate,
+                                    start_date.strftime("%Y-%m-%d"),
+                                    end_date.strftime("%Y-%m-%d") + " 23:59:59",
+                                    chunksize=chunksize)
+        file_name = f"{vehicle_plate}_{start_date:%Y%m%d}_{end_date:%Y%m%d}.{export_format}"
+
+        return flask.Response(flask.stream_with_context(iter_export(chunks, export_format,
+                                                                    dataset.get_schema())),
+                              mimetype=EXPORT_FORMATS[export_format],
+                              headers={"Content-Disposition": f"attachment; filename={file_name}"})
+
+    server.add_url_rule("/export/<export_format>", "export_data", export_data)
@@ -0,0 +1,210 @@
+"""
+metrics.py
+This source code is part of temp-monitoring program.
+It contains the instrumentation of the requests that the dashboard answers:
+the time and the size of the response of every callback, the entries returned
+by the dataset queries and the hits of the caches. The metrics are exposed in
+the Prometheus text format on the /metrics endpoint of the dash server, and
+the callbacks slower than a threshold are logged with their inputs.
+"""
+
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+import flask
+from configparser import ConfigParser
+from prometheus_client import (CollectorRegistry, Counter, Histogram, CONTENT_TYPE_LATEST,
+                               generate_latest)
+
+parser = ConfigParser()
+parser.read("config.ini")
+my_path = Path.cwd()
+
+registry = CollectorRegistry()
+
+CALLBACK_DURATION = Histogram("dash_callback_duration_seconds",
+                              "Time to answer a callback request, serialization included.",
+                              ["callback"],
+                              buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+                              registry=registry)
+RESPONSE_SIZE = Histogram("dash_callback_response_bytes",
+                          "Size of the serialized response of a callback.",
+                          ["callback"],
+                          buckets=(1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7),
+                          registry=registry)
+ROWS_FILTERED = Histogram("dash_callback_rows_filtered",
+                          "Entries returned by the dataset queries of a callback.",
+                          ["callback"],
+                          buckets=(10, 100, 1e3, 1e4, 5e4, 1e5, 5e5, 1e6),
+                          registry=registry)
+CACHE_REQUESTS = Counter("dash_cache_requests_total",
+                         "Lookups in the caches of the dashboard, by result (hit or miss).",
+                         ["cache", "result"],
+                         registry=registry)
+
+CALLBACK_PATH = "_dash-update-component"
+
+
+def get_callback_name():
+    """
+    Returns the name of the callback answered by the current request, or None
+    outside a callback request.
+    """
+    if not flask.has_request_context():
+        return None
+
+    return flask.g.get("callback_name")
+
+
+def record_rows(rows):
+    """
+    Records the entries returned by a dataset query of the current callback.
+    """
+    callback_name = get_callback_name()
+    if callback_name is not None:
+        ROWS_FILTERED.labels(callback_name).observe(rows)
+
+
+def record_cache(cache, hit):
+    """
+    Records a lookup in one of the caches of the dashboard.
+
+    Args:
+        str : name of the cache.
+        bool : True if the value was found in the cache.
+    """
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+class InstrumentedDataset:
+    """
+    Wraps one of the dataset classes used by the dashboard, recording the
+    entries returned by every query. Any other attribute is the one of the
+    wrapped dataset.
+
+    Args:
+        InMemoryDataset or SharedDataset : dataset to wrap.
+    """
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+
+    def __getattr__(self, name):
+        return getattr(self.dataset, name)
+
+
+    def query(self, *args, **kwargs):
+        """
+        Runs the query of the wrapped dataset and records its entries.
+        """
+        filtered_df = self.dataset.query(*args, **kwargs)
+        record_rows(len(filtered_df))
+
+        return filtered_df
+
+
+class DashMetrics:
+    """
+    Instruments the callback requests of a Dash app and adds the /metrics
+    endpoint to its server. The options are read from the [metrics] section
+    of config.ini.
+
+    When the dashboard is served by several gunicorn workers, setting the
+    PROMETHEUS_MULTIPROC_DIR environment variable makes /metrics aggregate
+    the metrics of all of them.
+
+    Args:
+        dash.Dash : app to instrument.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.slow_seconds = parser.getfloat("metrics", "slow_callback_seconds", fallback=1.0)
+        self.local_only = parser.getboolean("metrics", "local_only", fallback=True)
+        self.slow_logger = self.get_slow_logger(str(my_path)+parser.get("metrics", "slow_callback_log",
+                                                                        fallback="/data/slow_callbacks.log"))
+        app.server.before_request(self.start_request)
+        app.server.after_request(self.end_request)
+        app.server.add_url_rule("/metrics", "metrics", self.expose_metrics)
+
+
+    @staticmethod
+    def get_slow_logger(log_path):
+        """
+        Returns the logger of the slow callbacks, which writes one JSON line
+        per slow callback in the log file.
+        """
+        logger = logging.getLogger("temp_monitoring.slow_callbacks")
+        if not logger.handlers:
+            Path(log_path).parent.mkdir(parents=True, exist_ok=True)
+            handler = logging.FileHandler(log_path)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.WARNING)
+            logger.propagate = False
+
+        return logger
+
+
+    def start_request(self):
+        """
+        Starts the clock of a callback request and finds the name of its callback.
+        """
+        if not flask.request.path.endswith(CALLBACK_PATH):
+            return
+        payload = flask.request.get_json(silent=True) or {}
+        callback = self.app.callback_map.get(payload.get("output"), {}).get("callback")
+        flask.g.callback_name = getattr(callback, "__name__", payload.get("output", "unknown"))
+        flask.g.callback_payload = payload
+        flask.g.callback_start = time.perf_counter()
+
+
+    def end_request(self, response):
+        """
+        Records the duration and the size of the response of a callback request,
+        and logs it if it is slow.
+        """
+        start = flask.g.get("callback_start")
+        if start is None:
+            return response
+        duration = time.perf_counter() - start
+        callback_name = flask.g.callback_name
+        CALLBACK_DURATION.labels(callback_name).observe(duration)
+        size = response.content_length
+        if size is None and not response.is_streamed:
+            size = len(response.get_data())
+        if size is not None:
+            RESPONSE_SIZE.labels(callback_name).observe(size)
+
+        if duration > self.slow_seconds:
+            payload = flask.g.callback_payload
+            inputs = {f"{item['id']}.{item['property']}": item.get("value")
+                      for item in payload.get("inputs", []) + payload.get("state", [])
+                      if isinstance(item, dict) and "id" in item}
+            self.slow_logger.warning(json.dumps({"callback": callback_name,
+                                                 "duration_s": round(duration, 3),
+                                                 "response_bytes": size,
+                                                 "status": response.status_code,
+                                                 "inputs": inputs,
+                                                 }, default=str))
+
+        return response
+
+
+    def expose_metrics(self):
+        """
+        Returns the metrics in the Prometheus text format. Unless 'local_only'
+        is False, only requests from the same machine are answered.
+        """
+        if self.local_only and flask.request.remote_addr not in ("127.0.0.1", "::1"):
+            flask.abort(403)
+        if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+            from prometheus_client import multiprocess
+            metrics_registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(metrics_registry)
+        else:
+            metrics_registry = registry
+
+        return flask.Response(generate_latest(metrics_registry), content_type=CONTENT_TYPE_LATEST)
@@ -12,7 +12,11 @@ from pathlib import Path
 import pandas as pd
 from configparser import ConfigParser
 
+from data.gap_store import get_gap_store_path, load_gap_store, virtual_gaps_enabled
+from data.instrumentation import PipelineTracer
 from data.preprocessing import CheckMainDataset, ProcessingData
+from data.readers import is_telemetry_file
+from prophet_folder.channel_imputer import get_active_channels, get_rows_to_predict
 from prophet_folder.modelo_main import ProphetModel
 from prophet_folder.prediction_maker import PredictTempForNaN, MergePredictions
 
@@ -24,14 +28,27 @@ class MainDataset:
     """
     Using the path defined in the config class, all the json files
     in the json_folder are merged into one dataframe called main_dataset.csv.
+    Every stage, and every vehicle inside a stage, is measured by a PipelineTracer.
+    With virtual gaps, the synthetic entries and their predictions are kept in
+    'self.gap_store' instead of main_dataset.
     """
     def __init__(self):
+        self.tracer = PipelineTracer()
         self.pred_container = pd.DataFrame()
+        self.gap_store = load_gap_store() if virtual_gaps_enabled() else None
         self.main_dataset_path = self.get_main_dataset_path()
-        self.main_dataset = self.set_main_dataset()
-        self.run_prophet_models(self.main_dataset)
-        self.get_predictions()
-        self.main_dataset = self.merge_predictions()
+        with self.tracer.span("ingest") as span:
+            self.main_dataset = self.set_main_dataset()
+            span["rows_out"] = len(self.main_dataset)
+        with self.tracer.span("train", rows_in=len(self.main_dataset)):
+            self.run_prophet_models(self.main_dataset, self.tracer)
+        with self.tracer.span("predict", rows_in=len(self.main_dataset)) as span:
+            self.get_predictions()
+            span["rows_out"] = len(self.pred_container)
+        with self.tracer.span("merge", rows_in=len(self.pred_container)) as span:
+            self.main_dataset = self.merge_predictions()
+            span["rows_out"] = len(self.main_dataset)
+        self.tracer.print_summary()
 
 
     def get_main_dataset_path(self):
@@ -59,22 +76,26 @@ class MainDataset:
         """
         saved_path = parser.get("path_folder", "json_files")
         absolut_path = str(my_path)+saved_path
-        for json_file in Path(absolut_path).iterdir():                    
-            dataset = ProcessingData(json_file, self.main_dataset_path)
-            dataset.merge_data_to_main_df()
+        for json_file in filter(is_telemetry_file, Path(absolut_path).iterdir()):                    
+            with self.tracer.span("ingest.file", file=json_file.name) as span:
+                dataset = ProcessingData(json_file, self.main_dataset_path)
+                dataset.merge_data_to_main_df()
+                span["rows_out"] = len(dataset.df)
         
-        main_dataset = dataset.main_df
+        main_dataset = dataset.load_main_df()
+        if dataset.gap_store is not None:
+            self.gap_store = dataset.gap_store
 
         return main_dataset
 
 
     @staticmethod
-    def run_prophet_models(main_dataset):
+    def run_prophet_models(main_dataset, tracer=None):
         """
         Prepares the content of main_dataset to be passed to the Prophet algorithm, creating model files 
         for each vehicle if it doesn't exist.
         """
-        objeto = ProphetModel(main_dataset)
+        objeto = ProphetModel(main_dataset, tracer)
         objeto.run_model()
 
 
@@ -83,7 +104,9 @@ class MainDataset:
         Iterates for every vehicle plate, creating a new filtered dataframe with all
         the NaN values to be passed to our trained model.
         Collect and concatenate all the predicted data for every vehicle plate into 
-        the new dataframe. 
+        the new dataframe. The synthetic entries of the gap store are predicted
+        too, and their predictions kept in the store. The entries without some
+        of the other temperature probes are predicted too, for those probes.
         Returns a modified instance variable 'self.pred_container' with the results 
         of all the predictions.
         """ 
@@ -93,9 +116,17 @@ class MainDataset:
 
         for v_plate in self.main_dataset["vehicle_plate"].unique():
             df_veh_plate = self.main_dataset[self.main_dataset["vehicle_plate"] == v_plate]
-            mask1 = df_veh_plate["y"].isna()    
+            mask1 = get_rows_to_predict(df_veh_plate, get_active_channels(df_veh_plate))
             df_to_predict = df_veh_plate[mask1]        
-            prediction = PredictTempForNaN(df_to_predict, v_plate).predict_result
+            if self.gap_store is not None:
+                df_to_predict = pd.concat([df_to_predict, self.gap_store.get_entries_to_predict(v_plate)],
+                                          ignore_index=True)
+            with self.tracer.span("predict.vehicle", rows_in=len(df_to_predict),
+                                  vehicle_plate=v_plate) as span:
+                prediction = PredictTempForNaN(df_to_predict, v_plate, df_veh_plate).predict_result
+                span["rows_out"] = len(prediction)
+            if self.gap_store is not None:
+                prediction = self.gap_store.set_predictions(prediction)
             pred_container = pd.concat([pred_container, prediction], 
                                         join='outer',
                                         ignore_index=True,
@@ -113,8 +144,10 @@ class MainDataset:
         """
         merged_df = MergePredictions(self.pred_container, self.main_dataset).df
         merged_df.rename(columns = {'y': 'temp1'}, inplace=True)
-        merged_df.sort_values('date', inplace=True)
+        merged_df.sort_values(['vehicle_plate', 'date'], kind="stable", inplace=True)
         merged_df["date"] = merged_df["date"].dt.floor("T")
         merged_df.to_csv(self.main_dataset_path, index=False)
+        if self.gap_store is not None:
+            self.gap_store.save(get_gap_store_path())
 
         return merged_df
\ No newline at end of file
@@ -0,0 +1,558 @@
+"""
+dataset_store.py
+This source code is part of temp-monitoring program.
+It contains the classes used by the dashboard to query the main dataset, either
+held in memory by the process or memory-mapped from an Arrow IPC (Feather) file
+published by the pipeline, so several dash workers share a single copy of it:
+
+    (venv) $ python -m data.dataset_store             # runs the pipeline and publishes
+    (venv) $ python -m data.dataset_store --from-csv  # publishes the saved main_dataset.csv
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from configparser import ConfigParser
+
+from data.gap_store import GapStore, load_gap_store, virtual_gaps_enabled
+
+parser = ConfigParser()
+parser.read("config.ini")
+my_path = Path.cwd()
+
+
+def get_shared_dataset_path():
+    """
+    Returns the path of the Arrow file defined in the config file.
+    """
+    return str(my_path)+parser.get("dashboard", "shared_dataset",
+                                   fallback="/data/main_dataset.arrow")
+
+
+def get_manifest_path(path):
+    """
+    Returns the path of the manifest of the segments published over an Arrow file.
+    """
+    return path + ".segments.json"
+
+
+def publish_dataset(df, path=None, gap_store=None, schema=None):
+    """
+    Writes the main dataset as an uncompressed Arrow IPC file, sorted by vehicle
+    plate and date, with the first row and the number of rows of every vehicle
+    stored in the metadata of the file. The gap store, if any, is stored in the
+    metadata too, so it is always published with the same entries. The file is
+    replaced atomically, so processes reading the previous version are not affected.
+
+    Args:
+        pd.Dataframe : main dataset.
+        str (optional) : path of the file. Defaults to the one in config.ini.
+        GapStore (optional) : gaps of the dataset, with virtual gaps.
+        pyarrow.Schema (optional) : types of the columns, to publish a segment
+                                    with the ones of the main dataset.
+
+    Returns:
+        str : path of the published file.
+    """
+    import pyarrow as pa
+
+    path = path or get_shared_dataset_path()
+    df = df.sort_values(["vehicle_plate", "date"], kind="stable").reset_index(drop=True)
+    plates, starts, counts = np.unique(df["vehicle_plate"].to_numpy(dtype=str),
+                                       return_index=True, return_counts=True)
+    offsets = {plate: [int(start), int(count)] for plate, start, count in zip(plates, starts, counts)}
+
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"plate_offsets"] = json.dumps(offsets).encode()
+    if gap_store is not None:
+        metadata[b"gap_store"] = gap_store.to_bytes()
+    table = table.replace_schema_metadata(metadata)
+
+    tmp_path = path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+    return path
+
+
+class SegmentPublisher:
+    """
+    Publishes the changes of the main dataset without writing all of it again:
+    the entries of the vehicles that changed are written as a segment, an
+    Arrow file like the published one, and a manifest next to it lists, for
+    every vehicle, the last segment with its entries. The readers take those
+    vehicles from the segments and the rest from the published file. The
+    manifest is bound to the version of the published file, so it is ignored
+    once the dataset is published whole again, and the segments are removed then.
+
+    Args:
+        str (optional) : path of the published file. Defaults to the one in config.ini.
+    """
+    def __init__(self, path=None):
+        self.path = path or get_shared_dataset_path()
+        self.manifest_path = get_manifest_path(self.path)
+        self.base_version = None
+        self.schema = None
+        self.segments = []
+        self.plates = {}
+
+
+    def publish(self, df, gap_store=None):
+        """
+        Publishes the whole dataset and removes the segments.
+
+        Returns:
+            str : path of the published file.
+        """
+        import pyarrow as pa
+
+        path = publish_dataset(df, self.path, gap_store)
+        with pa.memory_map(path, "r") as source:
+            self.schema = pa.ipc.open_file(source).schema.remove_metadata()
+        self.base_version = os.stat(path).st_mtime_ns
+        # The new file has the entries of the segments, which are no longer read.
+        Path(self.manifest_path).unlink(missing_ok=True)
+        for segment in self.segments:
+            Path(segment).unlink(missing_ok=True)
+        self.segments = []
+        self.plates = {}
+
+        return path
+
+
+    def publish_segment(self, df, gap_store=None):
+        """
+        Publishes all the entries of some vehicles as a segment. The segment is
+        only written over a file published by this publisher, as otherwise its
+        other vehicles may be outdated, and with its types.
+
+        Args:
+            pd.Dataframe : all the entries of the vehicles that changed.
+            GapStore (optional) : gaps of the whole dataset, with virtual gaps.
+
+        Returns:
+            bool : False if the dataset has to be published whole instead.
+        """
+        import pyarrow as pa
+
+        if self.base_version is None or not os.path.exists(self.path) \
+                or os.stat(self.path).st_mtime_ns != self.base_version:
+            return False
+        segment = f"{self.path}.{time.time_ns()}.segment"
+        try:
+            publish_dataset(df, segment, gap_store, schema=self.schema)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # A column without values in the published file has no type for new ones.
+            Path(segment + ".tmp").unlink(missing_ok=True)
+            return False
+        self.segments.append(segment)
+        self.plates.update({plate: Path(segment).name for plate in df["vehicle_plate"].dropna().unique()})
+        manifest = {"base_version": self.base_version,
+                    "segments": [Path(segment).name for segment in self.segments],
+                    "plates": self.plates}
+        with open(self.manifest_path + ".tmp", "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
+
+        return True
+
+
+def add_gap_entries(df, gap_store, vehicle_plate, start_date, end_date):
+    """
+    Adds to the entries of a query the synthetic entries of the gaps in its
+    period, expanded from the gap store with the dates rounded to the minute
+    as in the published dataset.
+
+    Args:
+        pd.Dataframe : real entries, sorted by vehicle plate and date.
+        GapStore : gaps of the dataset, or None.
+        str : vehicle plate, or None for all of them.
+        datetime : start of the period, not included.
+        datetime : end of the period, included.
+
+    Returns:
+        pd.Dataframe : the entries sorted by vehicle plate and date.
+    """
+    if gap_store is None or not len(gap_store):
+        return df
+    gap_df = gap_store.expand(vehicle_plate, start_date, end_date, floor="T")
+    if gap_df.empty:
+        return df
+    gap_df = gap_df.reindex(columns=df.columns)
+
+    return pd.concat([df, gap_df], ignore_index=True).sort_values(["vehicle_plate", "date"], kind="stable")
+
+
+def iter_gap_entries(chunks, empty_df, gap_store, vehicle_plate, start_date, end_date):
+    """
+    Adds the synthetic entries of the gaps to the chunks of a query. Every chunk
+    receives the ones between the last date of the previous chunk and its own
+    last date, so only the gaps of one chunk are expanded at a time.
+
+    Args:
+        iterator : real entries of the query, in chunks sorted by date.
+        pd.Dataframe : dataframe without entries, with the columns of the dataset.
+        GapStore : gaps of the dataset, or None.
+
+    Yields:
+        pd.Dataframe : the entries of every chunk with the synthetic ones.
+    """
+    previous = None
+    for chunk in chunks:
+        if previous is not None:
+            upper = previous["date"].iloc[-1]
+            yield add_gap_entries(previous, gap_store, vehicle_plate, start_date, upper)
+            start_date = upper
+        previous = chunk
+    last_chunk = add_gap_entries(empty_df if previous is None else previous,
+                                 gap_store, vehicle_plate, start_date, end_date)
+    if not last_chunk.empty:
+        yield last_chunk
+
+
+class InMemoryDataset:
+    """
+    Queries over a main dataset held by the process.
+
+    Args:
+        pd.Dataframe : main dataset.
+        GapStore (optional) : gaps of the dataset, whose synthetic entries are
+                            added to the queries.
+    """
+    def __init__(self, df, gap_store=None):
+        self.df = df.sort_values(["vehicle_plate", "date"])
+        self.gap_store = gap_store
+        self.version = self.get_hash()
+        self.schema = None
+
+
+    def get_hash(self):
+        """
+        Returns a hash of the entries and the gaps of the dataset, so a process
+        holding the same entries has the same version, and one started with
+        other entries doesn't reuse what was cached for the previous ones.
+        """
+        digest = hashlib.sha1(pd.util.hash_pandas_object(self.df, index=False).to_numpy().tobytes())
+        if self.gap_store is not None:
+            digest.update(self.gap_store.to_bytes())
+
+        return digest.hexdigest()[:16]
+
+
+    def get_version(self):
+        """
+        Returns the version of the dataset, the hash of its entries, which
+        doesn't change while the process lives.
+        """
+        return self.version
+
+
+    def get_columns(self, columns):
+        """
+        Returns the selected columns of the whole dataset, with the synthetic
+        entries of all the gaps.
+        """
+        return add_gap_entries(self.df[columns], self.gap_store, None, None, None)
+
+
+    def get_schema(self):
+        """
+        Returns the Arrow schema of the dataset, inferred from all its entries
+        the first time, so it is the same for every part of it.
+        """
+        import pyarrow as pa
+
+        if self.schema is None:
+            self.schema = pa.Schema.from_pandas(self.df, preserve_index=False)
+
+        return self.schema
+
+
+    def get_plates(self):
+        """
+        Returns the sorted list of vehicle plates.
+        """
+        return sorted(self.df["vehicle_plate"].unique())
+
+
+    def get_date_range(self, vehicle_plate):
+        """
+        Returns the first and the last date of a vehicle plate.
+        """
+        dates = self.df.loc[self.df["vehicle_plate"] == vehicle_plate, "date"]
+
+        return dates.min(), dates.max()
+
+
+    def query(self, vehicle_plate, start_date, end_date):
+        """
+        Returns the entries of a vehicle plate after 'start_date' and until
+        'end_date', both included.
+        """
+        return add_gap_entries(self.df.loc[self.get_mask(vehicle_plate, start_date, end_date), :],
+                               self.gap_store, vehicle_plate, start_date, end_date)
+
+
+    def count(self, vehicle_plate, start_date, end_date):
+        """
+        Returns the number of real entries of a query, without copying them.
+        """
+        return int(self.get_mask(vehicle_plate, start_date, end_date).sum())
+
+
+    def get_mask(self, vehicle_plate, start_date, end_date):
+        """
+        Returns the boolean mask of the entries of a query.
+        """
+        return (
+            (self.df["vehicle_plate"] == vehicle_plate)
+             & (self.df["date"] > start_date)
+             & (self.df["date"] <= end_date)
+            )
+
+
+    def iter_query(self, vehicle_plate, start_date, end_date, chunksize=50000):
+        """
+        Yields the entries of a query in dataframes of 'chunksize' rows, so only
+        one chunk is copied at a time.
+        """
+        positions = np.flatnonzero(self.get_mask(vehicle_plate, start_date, end_date).to_numpy())
+        chunks = (self.df.iloc[positions[first:first+chunksize]]
+                  for first in range(0, len(positions), chunksize))
+        if self.gap_store is None:
+            yield from chunks
+            return
+        yield from iter_gap_entries(chunks, self.df.iloc[:0], self.gap_store,
+                                    vehicle_plate, start_date, end_date)
+
+
+class SharedDataset:
+    """
+    Queries over a main dataset memory-mapped read-only from the Arrow file
+    written by 'publish_dataset'. The data stays in the page cache of the
+    system, shared by all the processes mapping the file, and only the entries
+    of every query are copied into a dataframe. If the file is published again,
+    it is mapped again on the next query. If it was published with a gap store,
+    the synthetic entries of its gaps are added to the queries. The vehicles
+    published since then in segments by SegmentPublisher are read from them.
+
+    Args:
+        str (optional) : path of the file. Defaults to the one in config.ini.
+    """
+    def __init__(self, path=None):
+        self.path = path or get_shared_dataset_path()
+        self.manifest_path = get_manifest_path(self.path)
+        self.version = None
+        self.mapped = None
+        self.table = None
+        self.base_gap_store = None
+        self.segment_tables = {}
+        self.offsets = {}
+        self.segment_plates = set()
+        self.gap_store = None
+        self.refresh()
+
+
+    def refresh(self):
+        """
+        Maps the file and the segments if they have changed since they were
+        mapped. If the segments are removed while they are mapped, because the
+        file was published again, the new file is mapped instead.
+        """
+        for _ in range(3):
+            base_version = os.stat(self.path).st_mtime_ns
+            manifest_version = (os.stat(self.manifest_path).st_mtime_ns
+                                if os.path.exists(self.manifest_path) else None)
+            if (base_version, manifest_version) == self.mapped:
+                return
+            try:
+                self.map(base_version, manifest_version)
+                return
+            except FileNotFoundError:
+                continue
+        raise RuntimeError(f"{self.path} changed while it was mapped.")
+
+
+    def map(self, base_version, manifest_version):
+        """
+        Maps the file and the segments of its manifest, and finds the entries of
+        every vehicle plate: the first row and the number of rows in the table
+        that has them.
+        """
+        import pyarrow as pa
+
+        if self.mapped is None or base_version != self.mapped[0]:
+            self.table = pa.ipc.open_file(pa.memory_map(self.path, "r")).read_all()
+            gap_data = self.table.schema.metadata.get(b"gap_store")
+            self.base_gap_store = GapStore.from_bytes(gap_data) if gap_data else None
+        base_offsets = json.loads(self.table.schema.metadata[b"plate_offsets"])
+        offsets = {plate: (self.table, start, count) for plate, (start, count) in base_offsets.items()}
+        gap_store = self.base_gap_store
+        version = base_version
+
+        manifest = None
+        if manifest_version is not None:
+            with open(self.manifest_path, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+        segment_tables = {}
+        if manifest is not None and manifest["base_version"] == base_version:
+            folder = Path(self.path).parent
+            for name in manifest["segments"]:
+                segment_tables[name] = (self.segment_tables.get(name)
+                                        or pa.ipc.open_file(pa.memory_map(str(folder / name), "r")).read_all())
+            for plate, name in manifest["plates"].items():
+                segment_table = segment_tables[name]
+                start, count = json.loads(segment_table.schema.metadata[b"plate_offsets"]).get(plate, [0, 0])
+                offsets[plate] = (segment_table, start, count)
+            gap_data = segment_tables[manifest["segments"][-1]].schema.metadata.get(b"gap_store")
+            if gap_data:
+                gap_store = GapStore.from_bytes(gap_data)
+            version = f"{base_version}-{manifest_version}"
+
+        self.segment_tables = segment_tables
+        self.segment_plates = set(manifest["plates"]) if segment_tables else set()
+        self.offsets = offsets
+        self.gap_store = gap_store
+        self.version = version
+        self.mapped = (base_version, manifest_version)
+
+
+    def get_version(self):
+        """
+        Returns the version of the mapped file, its modification time in ns, and
+        of the manifest of its segments, if any.
+        """
+        self.refresh()
+
+        return self.version
+
+
+    def get_columns(self, columns):
+        """
+        Returns the selected columns of the whole dataset, the only ones copied
+        out of the mapped files, with the synthetic entries of all the gaps.
+        """
+        import pyarrow as pa
+
+        self.refresh()
+        if not self.segment_plates:
+            table = self.table.select(columns)
+        else:
+            table = pa.concat_tables([self.get_plate_table(plate).select(columns)
+                                      for plate in self.get_plates()])
+
+        return add_gap_entries(table.to_pandas(), self.gap_store, None, None, None)
+
+
+    def get_schema(self):
+        """
+        Returns the Arrow schema of the dataset.
+        """
+        self.refresh()
+
+        return self.table.schema
+
+
+    def get_plate_table(self, vehicle_plate):
+        """
+        Returns a zero-copy slice of the table with the entries of a vehicle plate.
+        """
+        self.refresh()
+        table, start, count = self.offsets.get(vehicle_plate, (self.table, 0, 0))
+
+        return table.slice(start, count)
+
+
+    def get_plates(self):
+        """
+        Returns the sorted list of vehicle plates.
+        """
+        self.refresh()
+
+        return sorted(self.offsets)
+
+
+    def get_date_range(self, vehicle_plate):
+        """
+        Returns the first and the last date of a vehicle plate.
+        """
+        dates = self.get_plate_table(vehicle_plate).column("date")
+        if len(dates) == 0:
+            return pd.NaT, pd.NaT
+
+        return pd.Timestamp(dates[0].as_py()), pd.Timestamp(dates[-1].as_py())
+
+
+    def query(self, vehicle_plate, start_date, end_date):
+        """
+        Returns the entries of a vehicle plate after 'start_date' and until
+        'end_date', both included. As the entries of the vehicle are sorted by
+        date, the limits are found with a binary search.
+        """
+        return add_gap_entries(self.get_query_table(vehicle_plate, start_date, end_date).to_pandas(),
+                               self.gap_store, vehicle_plate, start_date, end_date)
+
+
+    def count(self, vehicle_plate, start_date, end_date):
+        """
+        Returns the number of real entries of a query, found with the binary
+        search of the query, without copying them.
+        """
+        return self.get_query_table(vehicle_plate, start_date, end_date).num_rows
+
+
+    def get_query_table(self, vehicle_plate, start_date, end_date):
+        """
+        Returns a zero-copy slice of the table with the entries of a query.
+        """
+        plate_table = self.get_plate_table(vehicle_plate)
+        dates = plate_table.column("date").to_numpy()
+        first = np.searchsorted(dates, pd.Timestamp(start_date).to_datetime64(), side="right")
+        last = np.searchsorted(dates, pd.Timestamp(end_date).to_datetime64(), side="right")
+
+        return plate_table.slice(first, last - first)
+
+
+    def iter_query(self, vehicle_plate, start_date, end_date, chunksize=50000):
+        """
+        Yields the entries of a query in dataframes of 'chunksize' rows, so only
+        one chunk is copied out of the mapped file at a time.
+        """
+        query_table = self.get_query_table(vehicle_plate, start_date, end_date)
+        chunks = (query_table.slice(first, chunksize).to_pandas()
+                  for first in range(0, query_table.num_rows, chunksize))
+        if self.gap_store is None:
+            yield from chunks
+            return
+        yield from iter_gap_entries(chunks, query_table.slice(0, 0).to_pandas(), self.gap_store,
+                                    vehicle_plate, start_date, end_date)
+
+
+def main(from_csv=False):
+    """
+    Publishes the main dataset for the dashboard workers. The pipeline is run
+    first, unless the saved main_dataset.csv is published as it is.
+    """
+    if from_csv:
+        main_dataset_path = str(my_path)+parser.get("path_folder", "main_dataset")+"/main_dataset.csv"
+        main_df = pd.read_csv(main_dataset_path, parse_dates=["date"])
+        gap_store = load_gap_store() if virtual_gaps_enabled() else None
+    else:
+        from data.dataloader import MainDataset
+        main_dataset = MainDataset()
+        main_df, gap_store = main_dataset.main_dataset, main_dataset.gap_store
+    path = publish_dataset(main_df, gap_store=gap_store)
+    print(f"Main dataset published in {path}.")
+
+
+if __name__ == "__main__":
+    main(from_csv="--from-csv" in sys.argv[1:])
@@ -0,0 +1,198 @@
+"""
+excursions.py
+This source code is part of temp-monitoring program.
+It contains the engine that scans the temperatures of every vehicle of the
+fleet, real and predicted, looking for excursions out of the temperature
+limits selected in the dashboard.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from data.merge_engine import SortedMerger
+
+
+class ExcursionScanner:
+    """
+    Finds, for all the vehicles in one pass, the intervals in which the temperature
+    is out of a pair of limits. The real temperature is used when it exists and the
+    predicted one otherwise. The arrays of the fleet and the minimum and maximum
+    temperature of every vehicle are computed once, so a scan only walks the
+    vehicles that ever leave the limits. The last scans are kept, sorted by
+    vehicle plate, so the excursions of a vehicle are found with a binary search.
+
+    An excursion starts with the first entry out of the limits and ends with the
+    next entry of the vehicle back inside them, or with its last entry if there
+    is none.
+
+    Args:
+        pd.Dataframe : dataset with the columns in 'source_columns'.
+        int (optional) : version of the dataset the scanner was built from.
+        int (optional) : number of scans kept.
+    """
+    source_columns = ["vehicle_plate", "date", "temp1", "predicted_temp"]
+    columns = ["vehicle_plate", "start", "end", "duration", "peak", "entries", "predicted"]
+
+    def __init__(self, df, version=None, max_cached=32):
+        df = df[self.source_columns]
+        if not SortedMerger.is_sorted(df):
+            df = df.sort_values(["vehicle_plate", "date"], kind="stable")
+        self.version = version
+        self.max_cached = max_cached
+        self.scans = OrderedDict()
+
+        plates = df["vehicle_plate"].to_numpy()
+        self.plate_starts = np.flatnonzero(np.concatenate([[len(plates) > 0], plates[1:] != plates[:-1]]))
+        self.plate_counts = np.diff(np.append(self.plate_starts, len(plates)))
+        self.plates = plates[self.plate_starts].astype(str)
+        self.plate_ids = np.repeat(np.arange(len(self.plates)), self.plate_counts)
+        self.dates = df["date"].to_numpy(dtype="datetime64[ns]")
+        real = df["temp1"].to_numpy(dtype=float)
+        predicted = df["predicted_temp"].to_numpy(dtype=float)
+        self.temps = np.where(np.isnan(real), predicted, real)
+        self.is_predicted = np.isnan(real) & ~np.isnan(predicted)
+
+        # Per vehicle index: a vehicle whose temperatures are always inside
+        # the limits is not scanned.
+        if len(self.temps):
+            self.plate_min = np.fmin.reduceat(self.temps, self.plate_starts)
+            self.plate_max = np.fmax.reduceat(self.temps, self.plate_starts)
+        else:
+            self.plate_min = self.plate_max = np.array([], dtype=float)
+
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        """
+        Builds the scanner from one of the dataset classes used by the dashboard.
+        """
+        return cls(dataset.get_columns(cls.source_columns), version=dataset.get_version())
+
+
+    @classmethod
+    def get_empty_frame(cls):
+        """
+        Returns a dataframe without excursions, with the types of a scan.
+        """
+        return pd.DataFrame(columns=cls.columns).astype({"start": "datetime64[ns]",
+                                                         "end": "datetime64[ns]",
+                                                         "duration": float,
+                                                         "peak": float,
+                                                         "entries": int,
+                                                         "predicted": bool})
+
+
+    def is_cached(self, min_limit, max_limit):
+        """
+        Checks if the scan of a pair of limits is kept.
+        """
+        return (float(min_limit), float(max_limit)) in self.scans
+
+
+    def scan(self, min_limit, max_limit):
+        """
+        Returns the excursions of all the vehicles out of the limits.
+
+        Args:
+            float : minimum temperature allowed.
+            float : maximum temperature allowed.
+
+        Returns:
+            pd.Dataframe : one row per excursion, sorted by vehicle plate and start,
+                           with its duration in minutes, its peak temperature, the
+                           number of entries out of the limits and whether any of
+                           them is a predicted temperature.
+        """
+        key = (float(min_limit), float(max_limit))
+        if key in self.scans:
+            self.scans.move_to_end(key)
+            return self.scans[key]
+
+        excursions = self.find_excursions(*key)
+        self.scans[key] = excursions
+        if len(self.scans) > self.max_cached:
+            self.scans.popitem(last=False)
+
+        return excursions
+
+
+    def find_excursions(self, min_limit, max_limit):
+        """
+        Scans the vehicles that leave the limits, without using the kept scans.
+        """
+        with np.errstate(invalid="ignore"):
+            selected_plates = (self.plate_min < min_limit) | (self.plate_max > max_limit)
+        rows = np.flatnonzero(np.repeat(selected_plates, self.plate_counts))
+        if len(rows) == 0:
+            return self.get_empty_frame()
+
+        temps = self.temps[rows]
+        plate_ids = self.plate_ids[rows]
+        with np.errstate(invalid="ignore"):
+            outside = (temps < min_limit) | (temps > max_limit)
+
+        # An excursion starts on an entry out of the limits after one inside them,
+        # or on the first entry of a vehicle, and it ends the same way.
+        plate_change = plate_ids[1:] != plate_ids[:-1]
+        first_of_plate = np.concatenate([[True], plate_change])
+        last_of_plate = np.concatenate([plate_change, [True]])
+        previous_outside = np.concatenate([[False], outside[:-1]])
+        next_outside = np.concatenate([outside[1:], [False]])
+        firsts = np.flatnonzero(outside & (first_of_plate | ~previous_outside))
+        lasts = np.flatnonzero(outside & (last_of_plate | ~next_outside))
+        if len(firsts) == 0:
+            return self.get_empty_frame()
+
+        # The entries between two excursions are inside the limits, so masking them
+        # lets every reduction run over the segments starting at each excursion.
+        out_temps = np.where(outside, temps, np.nan)
+        highest = np.fmax.reduceat(out_temps, firsts)
+        lowest = np.fmin.reduceat(out_temps, firsts)
+        peaks = np.where(highest - max_limit >= min_limit - lowest, highest, lowest)
+        predicted = np.logical_or.reduceat(outside & self.is_predicted[rows], firsts)
+
+        dates = self.dates[rows]
+        ends = np.where(last_of_plate[lasts], lasts, lasts + 1)
+        starts = dates[firsts]
+        end_dates = dates[ends]
+
+        return pd.DataFrame({"vehicle_plate": self.plates[plate_ids[firsts]],
+                             "start": starts,
+                             "end": end_dates,
+                             "duration": (end_dates - starts) / np.timedelta64(1, "m"),
+                             "peak": peaks,
+                             "entries": lasts - firsts + 1,
+                             "predicted": predicted,
+                             })
+
+
+    def get_plate_excursions(self, vehicle_plate, min_limit, max_limit):
+        """
+        Returns the excursions of a single vehicle out of the limits.
+        """
+        excursions = self.scan(min_limit, max_limit)
+        plates = excursions["vehicle_plate"].to_numpy(dtype=str)
+        first = np.searchsorted(plates, vehicle_plate, side="left")
+        last = np.searchsorted(plates, vehicle_plate, side="right")
+
+        return excursions.iloc[first:last]
+
+
+    def summarize(self, min_limit, max_limit):
+        """
+        Returns, for every vehicle with excursions, their number, their total
+        duration in minutes and the peak temperature furthest from the limits.
+        """
+        excursions = self.scan(min_limit, max_limit)
+        if excursions.empty:
+            return pd.DataFrame(columns=["vehicle_plate", "excursions", "duration", "peak"])
+        deviation = np.maximum(excursions["peak"] - max_limit, min_limit - excursions["peak"])
+        worst = excursions.loc[deviation.groupby(excursions["vehicle_plate"]).idxmax(),
+                               ["vehicle_plate", "peak"]].set_index("vehicle_plate")
+
+        summary = excursions.groupby("vehicle_plate").agg(excursions=("start", "size"),
+                                                          duration=("duration", "sum"))
+
+        return summary.join(worst).reset_index()
@@ -0,0 +1,408 @@
+"""
+gap_store.py
+This source code is part of temp-monitoring program.
+It contains the store of the gaps found in the telemetry of the vehicles. When
+'virtual_gaps' is enabled in config.ini, the synthetic entries created every
+'default' minutes inside a gap are not saved in main_dataset.csv: only one
+descriptor per gap (vehicle plate, first and last real dates, number of periods
+and the attributes carried forward from the entry before it) and the predicted
+temperatures of its entries, as a flat array, are stored, with one more array
+for every other probe predicted. The synthetic entries are expanded from them
+when a query asks for their dates.
+"""
+
+import io
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from configparser import ConfigParser
+
+from prophet_folder.channel_imputer import PREDICTED_COLUMNS
+
+parser = ConfigParser()
+parser.read("config.ini")
+my_path = Path.cwd()
+
+# Attributes of the entry before the gap, copied into its synthetic entries.
+CARRIED_COLUMNS = ["vehicle_id", "door1_status", "door2_status", "ignition"]
+# Predictions of the other probes, only stored once one of them is predicted.
+CHANNEL_COLUMNS = [column for column in PREDICTED_COLUMNS.values() if column != "predicted_temp"]
+
+
+def virtual_gaps_enabled():
+    """
+    Checks if the synthetic entries are stored as gap descriptors.
+    """
+    return parser.getboolean("interval_time_config", "virtual_gaps", fallback=False)
+
+
+def get_gap_store_path():
+    """
+    Returns the path of the gap store defined in the config file.
+    """
+    return str(my_path)+parser.get("interval_time_config", "gap_store",
+                                   fallback="/data/gap_store.npz")
+
+
+def load_gap_store(path=None):
+    """
+    Returns the saved gap store, or an empty one if it has not been saved yet.
+    """
+    path = path or get_gap_store_path()
+    if not Path(path).is_file():
+        return GapStore()
+
+    return GapStore.load(path)
+
+
+def to_array(values):
+    """
+    Returns the values of an attribute as a numeric array, or as text if they
+    are not numbers, so they can be saved without pickle.
+    """
+    try:
+        return pd.to_numeric(values).to_numpy()
+    except (ValueError, TypeError):
+        return values.to_numpy(dtype=str)
+
+
+def from_array(values):
+    """
+    Returns the values of an attribute saved by 'to_array'.
+    """
+    if values.dtype.kind != "U":
+        return values
+    series = pd.Series(values, dtype=object).replace({"nan": np.nan, "None": np.nan})
+
+    return pd.to_numeric(series, errors="ignore")
+
+
+def get_entry_positions(rows, offsets, positions):
+    """
+    Returns the positions in the predictions array of the entries of some gaps,
+    given the number of entries of every gap and the position of its first one.
+    """
+    rows = rows[positions]
+    steps = np.arange(rows.sum()) - np.repeat(np.cumsum(rows) - rows, rows)
+
+    return np.repeat(offsets[positions], rows) + steps
+
+
+class GapStore:
+    """
+    Gaps of the vehicles and the predictions of their synthetic entries. The
+    dates of the entries of a gap are the ones created by
+    ProcessingData.run_upsampler: pd.date_range(start, end, periods), without
+    both ends.
+
+    Args:
+        pd.Dataframe (optional) : one row per gap with the columns vehicle_plate,
+                                start, end, periods and the carried attributes.
+        np.array (optional) : predicted temperature of every synthetic entry, in
+                            the order of the gaps. NaN if it is not predicted.
+        dict (optional) : predictions of the other probes, an array like the
+                        previous one per predicted column.
+    """
+    columns = ["vehicle_plate", "start", "end", "periods"] + CARRIED_COLUMNS
+
+    def __init__(self, gaps=None, predictions=None, channel_predictions=None):
+        if gaps is None:
+            gaps = pd.DataFrame({column: pd.Series(dtype=object) for column in self.columns})
+        gaps = gaps.reset_index(drop=True)
+        gaps["start"] = pd.to_datetime(gaps["start"])
+        gaps["end"] = pd.to_datetime(gaps["end"])
+        gaps["periods"] = gaps["periods"].astype("int64")
+        rows = np.maximum(gaps["periods"].to_numpy() - 2, 0)
+        offsets = np.concatenate([[0], np.cumsum(rows)]).astype("int64")
+        if predictions is None:
+            predictions = np.full(offsets[-1], np.nan, dtype="float32")
+
+        # The gaps are sorted by vehicle plate and start, with the first gap and
+        # the number of gaps of every vehicle plate, as the published dataset.
+        plates = gaps["vehicle_plate"].to_numpy(dtype=str)
+        order = np.lexsort((gaps["start"].to_numpy(), plates))
+        entries = get_entry_positions(rows, offsets, order)
+        self.predictions = np.asarray(predictions, dtype="float32")[entries]
+        self.channel_predictions = {column: np.asarray(values, dtype="float32")[entries]
+                                    for column, values in (channel_predictions or {}).items()}
+        self.gaps = gaps.iloc[order].reset_index(drop=True)
+        self.rows = rows[order]
+        self.offsets = np.concatenate([[0], np.cumsum(self.rows)]).astype("int64")
+        self.starts = self.gaps["start"].to_numpy()
+        self.ends = self.gaps["end"].to_numpy()
+        unique_plates, firsts, counts = np.unique(plates[order], return_index=True, return_counts=True)
+        self.plate_ranges = {plate: (int(first), int(first + count))
+                             for plate, first, count in zip(unique_plates, firsts, counts)}
+
+
+    def __len__(self):
+        """
+        Returns the number of synthetic entries of all the gaps.
+        """
+        return int(self.offsets[-1])
+
+
+    @classmethod
+    def from_entries(cls, df, limit_interval, default_interval):
+        """
+        Finds the gaps of the entries of a file, the same ones filled by
+        ProcessingData.run_upsampler.
+
+        Args:
+            pd.Dataframe : entries of the file with 'interval_time' as a timedelta.
+            float : limit in minutes to consider an interval a gap.
+            float : interval in minutes between the synthetic entries.
+
+        Returns:
+            GapStore : gaps of the entries, without predictions.
+        """
+        is_gap = (df["interval_time"] > pd.Timedelta(minutes=limit_interval)).to_numpy()[:-1]
+        positions = np.flatnonzero(is_gap)
+        starts = df["date"].iloc[positions].reset_index(drop=True)
+        ends = df["date"].iloc[positions + 1].reset_index(drop=True)
+        intervals = (ends - starts).dt.total_seconds().to_numpy() / 60
+        gaps = pd.DataFrame({"vehicle_plate": df["vehicle_plate"].iloc[positions].to_numpy(),
+                             "start": starts,
+                             "end": ends,
+                             "periods": np.trunc(intervals / default_interval).astype("int64")})
+        for column in CARRIED_COLUMNS:
+            gaps[column] = df[column].iloc[positions].to_numpy()
+
+        return cls(gaps)
+
+
+    def get_channel_predictions(self, column):
+        """
+        Returns the predictions of another probe, NaN if it has not been predicted.
+        """
+        if column not in self.channel_predictions:
+            return np.full(len(self), np.nan, dtype="float32")
+
+        return self.channel_predictions[column]
+
+
+    def select(self, positions):
+        """
+        Returns a store with some of the gaps and the predictions of their entries.
+        """
+        positions = np.asarray(positions, dtype="int64")
+        entries = get_entry_positions(self.rows, self.offsets, positions)
+
+        return GapStore(self.gaps.iloc[positions], self.predictions[entries],
+                        {column: values[entries] for column, values in self.channel_predictions.items()})
+
+
+    def merge(self, other):
+        """
+        Adds the gaps of another store. The gaps of both stores with the same
+        vehicle plate and start are only kept once, the ones of 'other' taking
+        precedence, as the entries merged into main_dataset.csv.
+
+        Returns:
+            GapStore : store with the gaps of both.
+        """
+        keys = pd.MultiIndex.from_arrays([self.gaps["vehicle_plate"], self.gaps["start"]])
+        other_keys = pd.MultiIndex.from_arrays([other.gaps["vehicle_plate"], other.gaps["start"]])
+        kept = self.select(np.flatnonzero(~keys.isin(other_keys)))
+        gaps = pd.concat([kept.gaps, other.gaps], ignore_index=True)
+        channel_predictions = {column: np.concatenate([kept.get_channel_predictions(column),
+                                                       other.get_channel_predictions(column)])
+                               for column in {**kept.channel_predictions, **other.channel_predictions}}
+
+        return GapStore(gaps, np.concatenate([kept.predictions, other.predictions]), channel_predictions)
+
+
+    def get_dates(self, positions):
+        """
+        Returns the dates of the synthetic entries of some gaps, computed as
+        pd.date_range does it and cast as in ProcessingData.generate_df.
+        """
+        rows = self.rows[positions]
+        periods = self.gaps["periods"].to_numpy()[positions]
+        starts = self.starts[positions].astype("int64")
+        spans = self.ends[positions].astype("int64") - starts
+        steps = np.arange(rows.sum()) - np.repeat(np.cumsum(rows) - rows, rows) + 1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            step_size = spans / (periods - 1)
+        offsets = (steps * np.repeat(step_size, rows)).astype("int64")
+        dates = pd.Series(np.repeat(starts, rows) + offsets, dtype="datetime64[ns]")
+
+        return dates.astype("datetime64[s]").to_numpy()
+
+
+    def get_positions(self, vehicle_plate=None, start_date=None, end_date=None):
+        """
+        Returns the positions of the gaps of a vehicle plate that overlap a period.
+        """
+        first, last = 0, len(self.gaps)
+        if vehicle_plate is not None:
+            first, last = self.plate_ranges.get(vehicle_plate, (0, 0))
+        mask = self.rows[first:last] > 0
+        if start_date is not None:
+            mask &= self.ends[first:last] > pd.Timestamp(start_date).to_datetime64()
+        if end_date is not None:
+            mask &= self.starts[first:last] < pd.Timestamp(end_date).to_datetime64()
+
+        return first + np.flatnonzero(mask)
+
+
+    def expand(self, vehicle_plate=None, start_date=None, end_date=None, floor=None):
+        """
+        Creates the synthetic entries of a vehicle plate after 'start_date' and
+        until 'end_date', both included, as they would be in the main dataset.
+        Only the gaps that overlap the period are expanded.
+
+        Args:
+            str (optional) : vehicle plate. Defaults to all of them.
+            datetime (optional) : start of the period.
+            datetime (optional) : end of the period.
+            str (optional) : frequency the dates are rounded down to, like the
+                            dates of the published dataset.
+
+        Returns:
+            pd.Dataframe : synthetic entries sorted by date.
+        """
+        last_date = end_date
+        if floor is not None and end_date is not None:
+            # A date rounded down into the period can be after its end.
+            last_date = pd.Timestamp(end_date) + pd.tseries.frequencies.to_offset(floor)
+        positions = self.get_positions(vehicle_plate, start_date, last_date)
+        rows = self.rows[positions]
+        dates = self.get_dates(positions)
+        if floor is not None:
+            dates = pd.DatetimeIndex(dates).floor(floor).to_numpy()
+        mask = np.ones(len(dates), dtype=bool)
+        if start_date is not None:
+            mask &= dates > pd.Timestamp(start_date).to_datetime64()
+        if end_date is not None:
+            mask &= dates <= pd.Timestamp(end_date).to_datetime64()
+
+        gap_df = pd.DataFrame({"date": dates,
+                               "vehicle_plate": np.repeat(self.gaps["vehicle_plate"].to_numpy()[positions], rows)})
+        for column in CARRIED_COLUMNS:
+            gap_df[column] = np.repeat(self.gaps[column].to_numpy()[positions], rows)
+        gap_df["date_flag"] = np.full(len(gap_df), True, dtype=object)
+        entries = get_entry_positions(self.rows, self.offsets, positions)
+        # Rounded back to the decimals of the predictions, lost as float32.
+        gap_df["predicted_temp"] = self.predictions[entries].astype("float64").round(6)
+        for column, values in self.channel_predictions.items():
+            gap_df[column] = values[entries].astype("float64").round(6)
+        gap_df = gap_df[mask].sort_values("date", kind="stable").reset_index(drop=True)
+        gap_df["day_of_week"] = gap_df["date"].dt.day_name()
+
+        return gap_df
+
+
+    def get_entries_to_predict(self, vehicle_plate, only_missing=False):
+        """
+        Returns the dates of the synthetic entries of a vehicle plate, with
+        Prophet nomenclature, to be predicted with the real entries.
+
+        Args:
+            str : vehicle plate.
+            bool (optional) : if True, only the entries without a prediction.
+
+        Returns:
+            pd.Dataframe : columns 'ds' and 'vehicle_plate'.
+        """
+        positions = self.get_positions(vehicle_plate)
+        dates = self.get_dates(positions)
+        if only_missing:
+            dates = dates[np.isnan(self.predictions[get_entry_positions(self.rows, self.offsets, positions)])]
+
+        return pd.DataFrame({"ds": dates, "vehicle_plate": vehicle_plate})
+
+
+    def set_predictions(self, predictions):
+        """
+        Stores the predictions of the synthetic entries, located by their vehicle
+        plate and date.
+
+        Args:
+            pd.Dataframe : predictions with the columns date, vehicle_plate, predicted_temp
+                        and optionally the predicted columns of the other probes.
+
+        Returns:
+            pd.Dataframe : the predictions of the entries that are not in a gap.
+        """
+        positions = self.get_positions()
+        rows = self.rows[positions]
+        gap_index = pd.MultiIndex.from_arrays([np.repeat(self.gaps["vehicle_plate"].to_numpy()[positions], rows),
+                                               self.get_dates(positions)])
+        found = gap_index.get_indexer(pd.MultiIndex.from_arrays(
+                    [predictions["vehicle_plate"], pd.to_datetime(predictions["date"])]))
+        in_gap = found >= 0
+        entries = get_entry_positions(self.rows, self.offsets, positions)
+        self.predictions[entries[found[in_gap]]] = predictions["predicted_temp"].to_numpy(dtype="float32")[in_gap]
+        for column in CHANNEL_COLUMNS:
+            if column in predictions.columns:
+                values = self.get_channel_predictions(column).copy()
+                values[entries[found[in_gap]]] = predictions[column].to_numpy(dtype="float32")[in_gap]
+                self.channel_predictions[column] = values
+
+        return predictions[~in_gap]
+
+
+    def to_bytes(self):
+        """
+        Returns the store as an uncompressed .npz file: the columns of the gaps,
+        with every vehicle plate and its number of gaps instead of the plate of
+        every gap, and the predictions arrays.
+        """
+        plates = sorted(self.plate_ranges)
+        arrays = {"plates": np.array(plates, dtype=str),
+                  "plate_counts": np.array([self.plate_ranges[plate][1] - self.plate_ranges[plate][0]
+                                            for plate in plates], dtype="int64"),
+                  "start": self.gaps["start"].to_numpy().astype("int64"),
+                  "end": self.gaps["end"].to_numpy().astype("int64"),
+                  "periods": self.gaps["periods"].to_numpy(),
+                  "predictions": self.predictions}
+        for column in CARRIED_COLUMNS:
+            arrays[column] = to_array(self.gaps[column])
+        arrays.update(self.channel_predictions)
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+
+        return buffer.getvalue()
+
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Reads a store written by 'to_bytes'.
+        """
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            plates = np.repeat(arrays["plates"], arrays["plate_counts"])
+            gaps = pd.DataFrame({"vehicle_plate": plates.astype(object),
+                                 "start": arrays["start"].astype("datetime64[ns]"),
+                                 "end": arrays["end"].astype("datetime64[ns]"),
+                                 "periods": arrays["periods"]})
+            for column in CARRIED_COLUMNS:
+                gaps[column] = from_array(arrays[column])
+            predictions = arrays["predictions"]
+            channel_predictions = {column: arrays[column] for column in CHANNEL_COLUMNS
+                                   if column in arrays.files}
+
+        return cls(gaps, predictions, channel_predictions)
+
+
+    def save(self, path=None):
+        """
+        Saves the store, replacing the file atomically.
+        """
+        path = path or get_gap_store_path()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path + ".tmp", "wb") as gap_file:
+            gap_file.write(self.to_bytes())
+        os.replace(path + ".tmp", path)
+
+
+    @classmethod
+    def load(cls, path=None):
+        """
+        Loads a saved store.
+        """
+        with open(path or get_gap_store_path(), "rb") as gap_file:
+            return cls.from_bytes(gap_file.read())
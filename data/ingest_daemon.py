@@ -0,0 +1,408 @@
+"""
+ingest_daemon.py
+This source code is part of temp-monitoring program.
+It contains the daemon that watches the folder of the .json files and ingests
+the new ones while the dashboard is running. The files that arrive together are
+processed in micro-batches: their entries are merged into the main dataset, the
+missing temperatures of the vehicles in the batch are predicted with their saved
+models and their entries are published for the dashboard (data_mode = mmap) as a
+segment, so a new file is shown in a few seconds. The whole dataset is only
+published again when it is saved:
+
+    (venv) $ python -m data.ingest_daemon
+    (venv) $ python -m data.ingest_daemon --once   # ingests the pending files and exits
+"""
+
+import argparse
+import os
+import signal
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+from configparser import ConfigParser
+
+from data.dataset_store import SegmentPublisher
+from data.gap_store import get_gap_store_path, load_gap_store, virtual_gaps_enabled
+from data.instrumentation import PipelineTracer
+from data.merge_engine import SortedMerger
+from data.pipeline import PipelineState
+from data.preprocessing import CheckMainDataset, ProcessingData
+from data.readers import is_telemetry_file
+from data.retention import drop_compacted, get_compacted_until, get_tier_path, load_tier, retention_enabled
+from prophet_folder.channel_imputer import PREDICTED_COLUMNS, get_active_channels
+from prophet_folder.model_serializer import ModelSerializer
+from prophet_folder.prediction_maker import PredictTempForNaN, MergePredictions
+from prophet_folder.vehicle_clusters import get_model_route
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    # Optional dependency, only available on Linux. The folder is polled instead.
+    INotify = None
+
+parser = ConfigParser()
+parser.read("config.ini")
+my_path = Path.cwd()
+
+WATCHERS = ["auto", "inotify", "polling"]
+
+
+def get_signature(path):
+    """
+    Returns the modification time and the size of a file, which change while
+    it is being written. It is the same fingerprint used by the pipeline state.
+    """
+    file_stat = path.stat()
+
+    return f"{file_stat.st_mtime_ns}-{file_stat.st_size}"
+
+
+class FolderWatcher:
+    """
+    Watches a folder and returns the telemetry files that are new or changed once
+    they have not changed for 'settle_seconds', so files that are still being
+    written are not read. The changes are received from inotify when it is
+    available, or found by listing the folder every 'poll_seconds'.
+
+    Args:
+        str : folder to watch.
+        dict : signature of the files already ingested, by file name.
+        str (optional) : 'inotify', 'polling' or 'auto'.
+        float (optional) : seconds a file must stay unchanged to be read.
+        float (optional) : seconds between two listings of the folder.
+    """
+    def __init__(self, folder, known, watcher="auto", settle_seconds=2, poll_seconds=1):
+        if watcher not in WATCHERS:
+            raise ValueError(f"Unknown watcher '{watcher}'. Use one of {WATCHERS}.")
+        if watcher == "inotify" and INotify is None:
+            raise ImportError("The inotify watcher needs the 'inotify_simple' package.")
+        self.folder = Path(folder)
+        self.known = dict(known)
+        self.settle_seconds = settle_seconds
+        self.poll_seconds = poll_seconds
+        self.pending = {}
+        self.inotify = None
+        if watcher != "polling" and INotify is not None:
+            self.inotify = INotify()
+            self.inotify.add_watch(str(self.folder), flags.CLOSE_WRITE | flags.MOVED_TO | flags.MODIFY)
+        print(f"Watching {self.folder} with {'inotify' if self.inotify else 'polling'}.")
+        # The files that arrived while the daemon was stopped.
+        self.scan()
+
+
+    def scan(self):
+        """
+        Lists the folder and adds the new or changed files to the pending ones.
+        """
+        for path in filter(is_telemetry_file, self.folder.iterdir()):
+            try:
+                signature = get_signature(path)
+            except FileNotFoundError:
+                continue
+            if self.known.get(path.name) != signature and path.name not in self.pending:
+                self.pending[path.name] = (signature, time.monotonic())
+
+
+    def wait(self):
+        """
+        Waits for changes in the folder, at most 'poll_seconds'.
+        """
+        if self.inotify is None:
+            time.sleep(self.poll_seconds)
+            self.scan()
+            return
+        for event in self.inotify.read(timeout=int(self.poll_seconds * 1000)):
+            if is_telemetry_file(event.name):
+                self.pending.pop(event.name, None)
+                self.pending[event.name] = (None, time.monotonic())
+
+
+    def get_ready(self):
+        """
+        Returns the pending files that have not changed for 'settle_seconds'.
+        """
+        ready = []
+        now = time.monotonic()
+        for name, (signature, since) in list(self.pending.items()):
+            path = self.folder / name
+            try:
+                current = get_signature(path)
+            except FileNotFoundError:
+                del self.pending[name]
+                continue
+            if current != signature:
+                self.pending[name] = (current, now)
+            elif now - since >= self.settle_seconds:
+                del self.pending[name]
+                self.known[name] = current
+                ready.append(path)
+
+        return sorted(ready, key=lambda path: path.stat().st_mtime_ns)
+
+
+class IngestDaemon:
+    """
+    Ingests the files returned by a FolderWatcher in micro-batches. The main
+    dataset is kept in memory, one dataframe per vehicle, so a batch only
+    copies the entries of its vehicles: they are published as a segment after
+    every batch, and the whole dataset is saved as main_dataset.csv and
+    published at most every 'checkpoint_seconds', when the ingested files are
+    also recorded in the pipeline state. The files that can't be read are
+    recorded as failed at once, so they are skipped until they change. The
+    options are read from the [ingest_daemon] section of config.ini.
+    """
+    def __init__(self):
+        self.batch_size = parser.getint("ingest_daemon", "batch_size", fallback=50)
+        self.batch_seconds = parser.getfloat("ingest_daemon", "batch_seconds", fallback=1)
+        self.checkpoint_seconds = parser.getfloat("ingest_daemon", "checkpoint_seconds", fallback=60)
+        self.tracer = PipelineTracer()
+        self.state = PipelineState()
+        self.serializer = ModelSerializer()
+        self.main_dataset_path = str(CheckMainDataset(str(my_path)+parser.get("path_folder", "main_dataset")))
+        self.vehicle_dfs = self.load_main_dataset()
+        self.publisher = SegmentPublisher()
+        self.tier_version = None
+        self.compacted_until = {}
+        self.gap_store = load_gap_store() if virtual_gaps_enabled() else None
+        self.watcher = FolderWatcher(str(my_path)+parser.get("path_folder", "json_files"),
+                                     {name: record.get("fingerprint")
+                                      for name, record in self.state.state["ingest"].items()
+                                      if not record.get("skipped_plates")},
+                                     parser.get("ingest_daemon", "watcher", fallback="auto"),
+                                     parser.getfloat("ingest_daemon", "settle_seconds", fallback=2),
+                                     parser.getfloat("ingest_daemon", "poll_seconds", fallback=1))
+        self.batch = []
+        self.batch_start = None
+        self.unsaved = {}
+        self.last_checkpoint = time.monotonic()
+
+
+    def load_main_dataset(self):
+        """
+        Returns the entries of every vehicle of the saved main dataset, with the
+        columns of the merged dataset.
+
+        Returns:
+            dict : dataframe of the entries of every vehicle plate.
+        """
+        main_df = pd.read_csv(self.main_dataset_path, parse_dates=["date"])
+        main_df = main_df.reindex(columns=MergePredictions.columns)
+        main_df["date"] = pd.to_datetime(main_df["date"])
+
+        return {plate: df_veh_plate for plate, df_veh_plate in main_df.groupby("vehicle_plate", sort=False)}
+
+
+    def get_main_df(self):
+        """
+        Returns the whole main dataset.
+        """
+        if not self.vehicle_dfs:
+            return pd.DataFrame(columns=MergePredictions.columns)
+
+        return pd.concat(self.vehicle_dfs.values(), ignore_index=True)
+
+
+    def process_batch(self, paths):
+        """
+        Merges the entries of the files into the main dataset, predicts the new
+        missing temperatures of their vehicles and publishes them. Only the
+        entries of the vehicles in the files are merged and published again.
+
+        Args:
+            list : paths of the files, in order of arrival.
+        """
+        start = time.perf_counter()
+        with self.tracer.span("daemon.batch", files=len(paths)) as span:
+            new_dfs = []
+            read_paths = []
+            for path in paths:
+                try:
+                    dataset = ProcessingData(path, None)
+                    if self.gap_store is not None:
+                        self.gap_store = self.gap_store.merge(dataset.gaps)
+                    new_dfs.append(dataset.df)
+                    read_paths.append(path)
+                except Exception as error:
+                    # A broken file is left out until it changes again, also if
+                    # the daemon is restarted.
+                    print(f"{path.name} could not be read: {type(error).__name__}: {error}")
+                    self.state.mark_failed("ingest", path.name, self.watcher.known[path.name], error)
+            if not new_dfs:
+                return
+            span["rows_in"] = sum(len(df) for df in new_dfs)
+            plates = set().union(*(df["vehicle_plate"].dropna().unique() for df in new_dfs))
+            # The last file received takes precedence.
+            merged_df = SortedMerger(new_dfs[::-1] + [self.vehicle_dfs[plate] for plate in sorted(plates)
+                                                      if plate in self.vehicle_dfs]).merge()
+
+            predictions = [self.predict_vehicle(merged_df, plate) for plate in sorted(plates)]
+            predictions = [prediction for prediction in predictions if prediction is not None]
+            if predictions:
+                merged_df = MergePredictions(pd.concat(predictions, ignore_index=True), merged_df).df
+            merged_df = merged_df.reindex(columns=MergePredictions.columns)
+            compacted = False
+            if retention_enabled():
+                compacted = self.drop_compacted_entries()
+                merged_df = drop_compacted(merged_df, self.compacted_until)
+            vehicle_dfs = dict(list(merged_df.groupby("vehicle_plate", sort=False)))
+            for plate in plates - set(vehicle_dfs):
+                # A vehicle left without entries is only removed by publishing the whole dataset.
+                self.vehicle_dfs.pop(plate, None)
+                compacted = True
+            self.vehicle_dfs.update(vehicle_dfs)
+            span["rows_out"] = len(merged_df)
+
+            with self.tracer.span("daemon.publish", rows_in=len(merged_df)) as publish_span:
+                published = not compacted and self.publisher.publish_segment(
+                    merged_df.assign(date=merged_df["date"].dt.floor("T")), self.gap_store)
+                if not published:
+                    self.publish()
+                    publish_span["rows_in"] = sum(len(df) for df in self.vehicle_dfs.values())
+
+        for path in read_paths:
+            self.unsaved[path.name] = self.watcher.known[path.name]
+        latency = time.time() - min(path.stat().st_mtime for path in read_paths)
+        print(f"{len(read_paths)} files, {span['rows_in']} entries of {len(plates)} vehicles published "
+              f"in {time.perf_counter() - start:.2f} s ({latency:.1f} s since the first file was written).")
+
+
+    def publish(self):
+        """
+        Publishes the whole dataset, which replaces the segments.
+        """
+        main_df = self.get_main_df()
+        self.publisher.publish(main_df.assign(date=main_df["date"].dt.floor("T")), self.gap_store)
+
+
+    def drop_compacted_entries(self):
+        """
+        Removes from the dataset in memory the entries, and the gaps, that the
+        retention job compacted while the daemon was running. The tier is only
+        read again when it changes.
+
+        Returns:
+            bool : True if the tier changed, so all the vehicles may have changed.
+        """
+        tier_path = get_tier_path()
+        tier_version = os.stat(tier_path).st_mtime_ns if os.path.exists(tier_path) else None
+        changed = tier_version != self.tier_version
+        if changed:
+            self.tier_version = tier_version
+            self.compacted_until = get_compacted_until(load_tier(), parser.get("retention", "frequency",
+                                                                               fallback="15min"))
+            self.vehicle_dfs = {plate: drop_compacted(df_veh_plate, self.compacted_until)
+                                for plate, df_veh_plate in self.vehicle_dfs.items()}
+        if self.gap_store is not None:
+            gaps = self.gap_store.gaps
+            self.gap_store = self.gap_store.select(drop_compacted(gaps.assign(date=gaps["end"]),
+                                                                  self.compacted_until).index)
+
+        return changed
+
+
+    def predict_vehicle(self, df, vehicle_plate):
+        """
+        Predicts the missing temperatures of a vehicle that have no prediction yet,
+        of temp1 and of the other probes imputed. With virtual gaps, the synthetic
+        entries without a prediction are predicted too, and their predictions
+        kept in the gap store.
+
+        Returns:
+            pd.Dataframe : predictions, or None if there is nothing to predict or
+                            the vehicle has no model.
+        """
+        df_veh_plate = df[df["vehicle_plate"] == vehicle_plate].rename(columns={"date": "ds", "temp1": "y"})
+        channels = get_active_channels(df_veh_plate)
+        missing = df_veh_plate["y"].isna() & df_veh_plate["predicted_temp"].isna()
+        for channel in channels:
+            predicted = df_veh_plate.get(PREDICTED_COLUMNS[channel], pd.Series(index=df_veh_plate.index,
+                                                                                dtype="float64"))
+            missing |= df_veh_plate[channel].isna() & predicted.isna()
+        df_to_predict = df_veh_plate[missing]
+        if self.gap_store is not None:
+            df_to_predict = pd.concat([df_to_predict,
+                                       self.gap_store.get_entries_to_predict(vehicle_plate, only_missing=True)],
+                                      ignore_index=True)
+        if df_to_predict.empty:
+            return None
+        if not self.serializer.exists(get_model_route(vehicle_plate)[0]):
+            print(f"Vehicle plate {vehicle_plate} has no model. Run 'python -m data.pipeline "
+                  f"all --plates {vehicle_plate}' to train it.")
+            return None
+        with self.tracer.span("predict.vehicle", rows_in=len(df_to_predict),
+                              vehicle_plate=vehicle_plate) as span:
+            prediction = PredictTempForNaN(df_to_predict, vehicle_plate, df_veh_plate).predict_result
+            span["rows_out"] = len(prediction)
+        if self.gap_store is not None:
+            prediction = self.gap_store.set_predictions(prediction)
+
+        return prediction
+
+
+    def checkpoint(self):
+        """
+        Saves the main dataset, and the gap store with virtual gaps, publishes
+        it whole in place of the segments and records the files ingested since
+        the last checkpoint in the pipeline state.
+        """
+        if self.unsaved:
+            main_df = self.get_main_df()
+            with self.tracer.span("daemon.checkpoint", rows_in=len(main_df)):
+                main_df.sort_values(["vehicle_plate", "date"], kind="stable").to_csv(self.main_dataset_path, index=False)
+                if self.gap_store is not None:
+                    self.gap_store.save(get_gap_store_path())
+                if self.publisher.segments:
+                    self.publish()
+            for name, signature in self.unsaved.items():
+                self.state.mark_done("ingest", name, signature, skipped_plates=[])
+            print(f"Main dataset saved in {self.main_dataset_path}.")
+        self.unsaved = {}
+        self.last_checkpoint = time.monotonic()
+
+
+    def step(self):
+        """
+        Waits for files and processes the batch once it is full or its first
+        file has waited 'batch_seconds'.
+        """
+        self.watcher.wait()
+        ready = self.watcher.get_ready()
+        if ready and not self.batch:
+            self.batch_start = time.monotonic()
+        self.batch.extend(ready)
+        if self.batch and (len(self.batch) >= self.batch_size
+                           or time.monotonic() - self.batch_start >= self.batch_seconds):
+            batch, self.batch = self.batch[:self.batch_size], self.batch[self.batch_size:]
+            self.batch_start = time.monotonic()
+            self.process_batch(batch)
+        if time.monotonic() - self.last_checkpoint >= self.checkpoint_seconds:
+            self.checkpoint()
+
+
+    def run(self, once=False):
+        """
+        Runs the daemon until it is interrupted, or, if 'once' is True, until
+        the files waiting in the folder are ingested.
+        """
+        try:
+            while True:
+                self.step()
+                if once and not self.watcher.pending and not self.batch:
+                    break
+        except KeyboardInterrupt:
+            print("Stopping the ingest daemon.")
+        finally:
+            self.checkpoint()
+            self.tracer.print_summary()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Daemon that ingests the new .json files.")
+    arg_parser.add_argument("--once", action="store_true",
+                            help="ingests the files waiting in the folder and exits.")
+    args = arg_parser.parse_args()
+    # Stopping the daemon with SIGTERM saves the main dataset first.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    IngestDaemon().run(args.once)
@@ -0,0 +1,306 @@
+"""
+instrumentation.py
+This source code is part of temp-monitoring program.
+It contains the tracer used to measure every stage of the pipeline, and every
+vehicle inside a stage: wall and CPU time, entries received and returned and
+the peak resident memory inside the stage, sampled by a background thread.
+The spans are appended to a JSON-lines log and summarised in a table at the
+end of every run. A profiler (cProfile or tracemalloc) can be
+attached to a selected stage from the [instrumentation] section of config.ini.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from configparser import ConfigParser
+
+parser = ConfigParser()
+parser.read("config.ini")
+my_path = Path.cwd()
+
+
+def get_memory_mb():
+    """
+    Returns the current resident memory of the process, in MB.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        # Not available outside Linux, where psutil is used instead.
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+
+
+class MemorySampler:
+    """
+    Samples the resident memory of the process from a background thread while
+    any span is open, and keeps the peak of every open span. The peak of the
+    process ('ru_maxrss') can't be used, as it never goes down once a previous
+    stage has reached it.
+
+    Args:
+        float : seconds between two samples.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.peaks = {}
+        self.lock = threading.Lock()
+        self.stopped = None
+
+
+    def start(self, key):
+        """
+        Starts measuring the peak of the span 'key', and the thread if it is not running.
+        """
+        with self.lock:
+            self.peaks[key] = get_memory_mb()
+            if self.stopped is None:
+                self.stopped = threading.Event()
+                threading.Thread(target=self.run, args=(self.stopped,), name="memory-sampler",
+                                 daemon=True).start()
+
+
+    def stop(self, key):
+        """
+        Stops measuring the span 'key'. The thread stops when no span is open.
+
+        Returns:
+            float : peak resident memory of the span, in MB.
+            float : resident memory at the end of the span, in MB.
+        """
+        memory = get_memory_mb()
+        with self.lock:
+            peak = max(self.peaks.pop(key), memory)
+            if not self.peaks and self.stopped is not None:
+                self.stopped.set()
+                self.stopped = None
+
+        return peak, memory
+
+
+    def run(self, stopped):
+        """
+        Loop of the thread: adds a sample to every open span until 'stopped' is set.
+        """
+        while not stopped.wait(self.interval):
+            memory = get_memory_mb()
+            with self.lock:
+                for key, peak in self.peaks.items():
+                    self.peaks[key] = max(peak, memory)
+
+
+class CProfileHook:
+    """
+    Profiles a span with cProfile. The statistics are saved in a .prof file,
+    which can be opened with pstats or snakeviz, and the slowest functions are
+    printed when the span ends.
+
+    Args:
+        str : path of the .prof file, formatted with the name of the span.
+        int (optional) : number of functions printed.
+    """
+    def __init__(self, output_path, top=15):
+        self.output_path = output_path
+        self.top = top
+
+
+    @contextmanager
+    def __call__(self, span):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            path = self.output_path.format(span["name"].replace(".", "_"))
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(path)
+            span["profile"] = path
+            print(f"Profile of '{span['name']}' saved in {path}.")
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(self.top)
+
+
+class TracemallocHook:
+    """
+    Traces the memory allocated by Python inside a span. The peak of the span
+    and the lines that allocated the most memory are added to the span.
+
+    Args:
+        int (optional) : number of lines recorded.
+    """
+    def __init__(self, top=5):
+        self.top = top
+
+
+    @contextmanager
+    def __call__(self, span):
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            statistics = tracemalloc.take_snapshot().statistics("lineno")[:self.top]
+            if started:
+                tracemalloc.stop()
+            span["traced_peak_mb"] = round(peak / 2**20, 3)
+            span["top_allocations"] = [str(statistic) for statistic in statistics]
+
+
+PROFILERS = {"cprofile": CProfileHook, "tracemalloc": TracemallocHook}
+
+
+class PipelineTracer:
+    """
+    Records nested spans. Every span measures, from its start to its end, the
+    wall time, the CPU time of the process, the peak resident memory of the
+    process inside the span ('peak_memory_mb') and the resident memory when it
+    ends ('end_memory_mb'), and it holds the entries received ('rows_in') and returned
+    ('rows_out') plus any other attribute, like the vehicle plate.
+
+    Hooks are context managers called with the span, attached to the spans of
+    a given name, that run around them. They are used to profile a stage.
+
+    Args:
+        bool (optional) : if False, the spans are not measured or recorded.
+        str (optional) : path of the JSON-lines log. Defaults to the one in config.ini.
+    """
+    def __init__(self, enabled=None, log_path=None):
+        if enabled is None:
+            enabled = parser.getboolean("instrumentation", "enabled", fallback=True)
+        self.enabled = enabled
+        self.log_path = log_path or str(my_path)+parser.get("instrumentation", "log_file",
+                                                            fallback="/data/pipeline_trace.jsonl")
+        self.run_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.spans = []
+        self.stack = []
+        self.hooks = {}
+        self.memory = MemorySampler(parser.getfloat("instrumentation", "memory_sample_interval",
+                                                    fallback=0.05))
+
+        profile_stage = parser.get("instrumentation", "profile_stage", fallback="")
+        if self.enabled and profile_stage:
+            profiler = parser.get("instrumentation", "profiler", fallback="cprofile")
+            if profiler not in PROFILERS:
+                raise ValueError(f"Unknown profiler '{profiler}'. Use one of {list(PROFILERS)}.")
+            if profiler == "cprofile":
+                hook = CProfileHook(str(my_path)+parser.get("instrumentation", "profile_file",
+                                                            fallback="/data/profile_{}.prof"))
+            else:
+                hook = TracemallocHook()
+            self.add_hook(profile_stage, hook)
+
+
+    def add_hook(self, name, hook):
+        """
+        Attaches a hook to the spans called 'name'.
+        """
+        self.hooks.setdefault(name, []).append(hook)
+
+
+    @contextmanager
+    def span(self, name, rows_in=None, **attributes):
+        """
+        Measures the code run inside the 'with' block. The span is yielded as a
+        dictionary, so the block can set 'rows_out' or other attributes.
+
+        Args:
+            str : name of the span, like 'train' or 'train.vehicle'.
+            int (optional) : number of entries received.
+            **attributes : other values saved with the span.
+        """
+        span = {"name": name, "rows_in": rows_in, "rows_out": None, **attributes}
+        if not self.enabled:
+            yield span
+            return
+
+        span["parent"] = self.stack[-1]["name"] if self.stack else None
+        self.stack.append(span)
+        hooks = [hook(span) for hook in self.hooks.get(name, [])]
+        for hook in hooks:
+            hook.__enter__()
+        self.memory.start(id(span))
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        span["start"] = datetime.now().isoformat(timespec="milliseconds")
+        try:
+            yield span
+        except BaseException as error:
+            span["error"] = repr(error)
+            raise
+        finally:
+            span["wall_s"] = round(time.perf_counter() - start_wall, 4)
+            span["cpu_s"] = round(time.process_time() - start_cpu, 4)
+            peak_memory, end_memory = self.memory.stop(id(span))
+            span["peak_memory_mb"] = round(peak_memory, 1)
+            span["end_memory_mb"] = round(end_memory, 1)
+            for hook in reversed(hooks):
+                hook.__exit__(None, None, None)
+            self.stack.pop()
+            self.spans.append(span)
+            self.write(span)
+
+
+    def write(self, span):
+        """
+        Appends a span to the JSON-lines log, tagged with the id of the run.
+        """
+        Path(self.log_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.log_path, "a") as log_file:
+            log_file.write(json.dumps({"run_id": self.run_id, "pid": os.getpid(), **span},
+                                      default=str) + "\n")
+
+
+    def summary(self):
+        """
+        Returns the table of the run: one row per span name, with the number of
+        spans, their total wall and CPU time, the entries received and returned,
+        the peak memory and, for spans repeated per vehicle, the slowest one.
+        """
+        rows = []
+        spans_by_start = sorted(self.spans, key=lambda span: span["start"])
+        for name in dict.fromkeys(span["name"] for span in spans_by_start):
+            spans = [span for span in self.spans if span["name"] == name]
+            slowest = max(spans, key=lambda span: span["wall_s"])
+            rows.append({"span": name,
+                         "parent": spans[0]["parent"],
+                         "count": len(spans),
+                         "wall_s": round(sum(span["wall_s"] for span in spans), 3),
+                         "cpu_s": round(sum(span["cpu_s"] for span in spans), 3),
+                         "rows_in": sum(span["rows_in"] or 0 for span in spans),
+                         "rows_out": sum(span["rows_out"] or 0 for span in spans),
+                         "peak_memory_mb": max(span["peak_memory_mb"] for span in spans),
+                         "slowest": slowest.get("vehicle_plate", slowest.get("file", ""))
+                                    if len(spans) > 1 else "",
+                         })
+
+        return rows
+
+
+    def print_summary(self):
+        """
+        Prints the summary table of the run in the terminal.
+        """
+        if not self.enabled or not self.spans:
+            return
+        header = f"{'span':<22}{'count':>6}{'wall (s)':>10}{'cpu (s)':>10}" \
+                 f"{'rows in':>10}{'rows out':>10}{'peak MB':>10}  slowest"
+        print("="*len(header))
+        print(header)
+        for row in self.summary():
+            span_name = ("  " if row["parent"] else "") + row["span"]
+            print(f"{span_name:<22}{row['count']:>6}{row['wall_s']:>10.2f}{row['cpu_s']:>10.2f}"
+                  f"{row['rows_in']:>10}{row['rows_out']:>10}{row['peak_memory_mb']:>10.1f}  {row['slowest']}")
+        print(f"Spans saved in {self.log_path} (run {self.run_id}).")
+        print("="*len(header))
@@ -0,0 +1,273 @@
+"""
+merge_engine.py
+This source code is part of temp-monitoring program.
+It contains the code to combine several datasets, each of them already sorted
+by vehicle plate and date, into a single one without sorting all the data again.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class SortedMerger:
+    """
+    Merges dataframes sorted by the composite key (vehicle_plate, date). The key
+    arrays of the sources are merged two by two, locating the rows of one inside
+    the other with np.searchsorted, so the sorted sources are never sorted again.
+    The rows are then taken from the sources in chunks, so the result can be
+    streamed to a .csv file.
+
+    When several rows share the same vehicle plate and date, only one is kept,
+    following these rules:
+        1. Inside a source, the last row wins.
+        2. A real entry wins over a synthesised one ('date_flag' True).
+        3. Otherwise, the row of the source listed first wins.
+
+    Args:
+        list : dataframes to merge, in priority order.
+        int (optional) : number of rows of every chunk when the result is streamed.
+    """
+    key = ["vehicle_plate", "date"]
+
+    def __init__(self, sources, chunksize=50000):
+        self.columns = self.get_columns(sources)
+        self.chunksize = chunksize
+        sources = [df for df in sources if not df.empty]
+        plates = [pd.factorize(df["vehicle_plate"]) for df in sources]
+        self.plates = self.get_plates([uniques for _, uniques in plates])
+        self.sources, self.keys = [], []
+        for df, (codes, uniques) in zip(sources, plates):
+            # The codes of every source are translated to the positions in 'self.plates'.
+            codes = np.where(codes >= 0, np.searchsorted(self.plates, uniques)[codes], -1)
+            df, keys = self.prepare_source(df, codes)
+            self.sources.append(df)
+            self.keys.append(keys)
+
+
+    @staticmethod
+    def get_columns(sources):
+        """
+        Returns the union of the columns of every source, keeping their order.
+        """
+        columns = []
+        for df in sources:
+            columns.extend(column for column in df.columns if column not in columns)
+
+        return columns
+
+
+    @staticmethod
+    def get_plates(uniques):
+        """
+        Returns the sorted vehicle plates of every source, from the unique plates
+        of each. The position of a plate in this array is the code used to compare it.
+        """
+        if not uniques:
+            return np.empty(0, dtype=object)
+
+        return np.sort(pd.unique(np.concatenate([np.asarray(plates, dtype=object) for plates in uniques])))
+
+
+    def prepare_source(self, df, codes):
+        """
+        Checks that a source is sorted by (vehicle_plate, date) and removes its
+        duplicated keys, keeping the last row of each. Sources that are not sorted,
+        like the datasets saved ordered by date only, are sorted once here.
+
+        Args:
+            pd.Dataframe : source dataframe.
+            np.array : code of the vehicle plate of every row, -1 if it is missing.
+
+        Returns:
+            pd.Dataframe : source ready to be merged.
+            tuple : codes of the vehicle plates, dates as integers and synthetic flags.
+        """
+        dates = df["date"].to_numpy(dtype="datetime64[ns]").view("int64")
+        if not self.is_sorted_keys(codes, dates):
+            # Stable, so the rows of the same key keep their original order.
+            order = np.lexsort((dates, codes))
+            df, codes, dates = df.take(order), codes[order], dates[order]
+        last = np.ones(len(df), dtype=bool)
+        last[:-1] = (codes[1:] != codes[:-1]) | (dates[1:] != dates[:-1])
+        if not last.all():
+            df, codes, dates = df[last], codes[last], dates[last]
+        if "date_flag" in df.columns:
+            synthetic = (df["date_flag"] == True).to_numpy()
+        else:
+            synthetic = np.zeros(len(df), dtype=bool)
+
+        return df, (codes, dates, synthetic)
+
+
+    @staticmethod
+    def is_sorted(df):
+        """
+        Checks if a dataframe is sorted by vehicle plate and date.
+        """
+        plates = df["vehicle_plate"].to_numpy()
+        dates = df["date"].to_numpy(dtype="datetime64[ns]")
+        same_plate = plates[1:] == plates[:-1]
+        in_order = (plates[1:] > plates[:-1]) | (same_plate & (dates[1:] >= dates[:-1]))
+
+        return bool(np.all(in_order))
+
+
+    @staticmethod
+    def is_sorted_keys(codes, dates):
+        """
+        Checks if the codes of the vehicle plates and the dates are sorted, in this order.
+        """
+        same_plate = codes[1:] == codes[:-1]
+        in_order = (codes[1:] > codes[:-1]) | (same_plate & (dates[1:] >= dates[:-1]))
+
+        return bool(np.all(in_order))
+
+
+    def get_positions(self):
+        """
+        Returns, in merged order and without duplicated keys, the position of
+        every row to keep. The sources are merged two by two, each with the
+        next one, until one is left, so every row is moved about log2(k) times,
+        with k the number of sources.
+
+        Returns:
+            np.array : index of the source of every row.
+            np.array : position of every row inside its source.
+        """
+        if not self.sources:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        merged = [(codes, dates, synthetic, np.full(len(codes), source_index), np.arange(len(codes)))
+                  for source_index, (codes, dates, synthetic) in enumerate(self.keys)]
+        while len(merged) > 1:
+            merged = [self.merge_keys(*merged[index:index + 2]) if index + 1 < len(merged)
+                      else merged[index] for index in range(0, len(merged), 2)]
+        _, _, _, source_indexes, positions = merged[0]
+
+        return source_indexes, positions
+
+
+    @staticmethod
+    def merge_keys(first, second):
+        """
+        Merges the keys of two sorted sources without duplicated keys. The rows
+        of 'second' are located inside 'first', one vehicle plate at a time, with
+        np.searchsorted. When both have the same key, the row of 'first' is kept,
+        unless it is synthesised and the one of 'second' is real.
+
+        Args:
+            tuple : codes of the plates, dates, synthetic flags, sources and positions
+                    of the rows of the source with priority.
+            tuple : the same arrays for the other source.
+
+        Returns:
+            tuple : the same arrays for the merged rows.
+        """
+        codes, dates = first[0], first[1]
+        other_codes, other_dates = second[0], second[1]
+        inserts = np.empty(len(other_codes), dtype=np.int64)
+        # Rows of every plate of 'second' and of the same plate in 'first'.
+        starts = np.flatnonzero(np.r_[True, other_codes[1:] != other_codes[:-1]])
+        ends = np.r_[starts[1:], len(other_codes)]
+        plate_starts = np.searchsorted(codes, other_codes[starts], side="left")
+        plate_ends = np.searchsorted(codes, other_codes[starts], side="right")
+        for start, end, plate_start, plate_end in zip(starts, ends, plate_starts, plate_ends):
+            inserts[start:end] = plate_start + np.searchsorted(dates[plate_start:plate_end],
+                                                               other_dates[start:end], side="left")
+
+        found = np.minimum(inserts, len(codes) - 1)
+        same_key = ((inserts < len(codes)) & (codes[found] == other_codes)
+                    & (dates[found] == other_dates))
+        replaced = same_key & first[2][found] & ~second[2]
+        first = tuple(array.copy() for array in first)
+        for array, other_array in zip(first, second):
+            array[inserts[replaced]] = other_array[replaced]
+
+        added = ~same_key
+        inserts = inserts[added]
+        merged_positions = inserts + np.arange(len(inserts))
+        kept_positions = np.arange(len(codes)) + np.searchsorted(inserts, np.arange(len(codes)), side="right")
+        merged = []
+        for array, other_array in zip(first, second):
+            merged_array = np.empty(len(array) + len(inserts), dtype=array.dtype)
+            merged_array[kept_positions] = array
+            merged_array[merged_positions] = other_array[added]
+            merged.append(merged_array)
+
+        return tuple(merged)
+
+
+    def build_chunk(self, source_indexes, positions):
+        """
+        Builds a dataframe with the selected rows, in the given order.
+
+        Args:
+            list : index of the source of every row.
+            list : position of every row inside its source.
+
+        Returns:
+            pd.Dataframe : chunk of the merged dataset.
+        """
+        source_indexes = np.asarray(source_indexes)
+        positions = np.asarray(positions)
+        order = np.empty(len(positions), dtype=np.int64)
+        frames = []
+        offset = 0
+        for source_index, df in enumerate(self.sources):
+            selected = np.flatnonzero(source_indexes == source_index)
+            if len(selected) == 0:
+                continue
+            frames.append(df.iloc[positions[selected]])
+            order[selected] = np.arange(offset, offset + len(selected))
+            offset += len(selected)
+        chunk = pd.concat(frames, ignore_index=True).take(order)
+
+        return chunk.reindex(columns=self.columns).reset_index(drop=True)
+
+
+    def iter_chunks(self):
+        """
+        Yields the merged dataset in chunks of 'self.chunksize' rows.
+        """
+        source_indexes, positions = self.get_positions()
+        for start in range(0, len(positions), self.chunksize):
+            yield self.build_chunk(source_indexes[start:start + self.chunksize],
+                                   positions[start:start + self.chunksize])
+
+
+    def merge(self):
+        """
+        Returns the whole merged dataset.
+
+        Returns:
+            pd.Dataframe : merged dataset sorted by vehicle plate and date.
+        """
+        source_indexes, positions = self.get_positions()
+        if len(positions) == 0:
+            return pd.DataFrame(columns=self.columns)
+
+        return self.build_chunk(source_indexes, positions)
+
+
+    def merge_to_csv(self, path):
+        """
+        Streams the merged dataset to a .csv file chunk by chunk, so the whole
+        result is never held in memory. The file is replaced only once it is
+        complete, so the path can be the one of a source dataset.
+
+        Args:
+            str : path of the .csv file.
+
+        Returns:
+            int : number of rows written.
+        """
+        tmp_path = str(path) + ".tmp"
+        rows = 0
+        pd.DataFrame(columns=self.columns).to_csv(tmp_path, index=False)
+        for chunk in self.iter_chunks():
+            chunk.to_csv(tmp_path, mode="a", header=False, index=False)
+            rows += len(chunk)
+        os.replace(tmp_path, path)
+
+        return rows
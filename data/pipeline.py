@@ -0,0 +1,411 @@
+"""
+pipeline.py
+This source code is part of temp-monitoring program.
+It contains the command line pipeline that runs the stages of the program one
+by one: ingest of the .json files, tuning of the hyperparameters, training of
+the models, prediction of the missing temperatures and merge of the predictions
+into the main dataset. Every finished unit of work (a file, a vehicle or a
+combination of hyperparameters of a vehicle) is recorded in a state file, so if
+the pipeline stops, running it again continues where it stopped:
+
+    (venv) $ python -m data.pipeline all
+    (venv) $ python -m data.pipeline tune --plates 1234ABC 5678DEF
+    (venv) $ python -m data.pipeline predict --since 2022-10-01 --force
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from configparser import ConfigParser
+
+from data.gap_store import get_gap_store_path, load_gap_store, virtual_gaps_enabled
+from data.instrumentation import PipelineTracer
+from data.preprocessing import CheckMainDataset, ProcessingData
+from data.readers import is_telemetry_file
+
+parser = ConfigParser()
+parser.read("config.ini")
+my_path = Path.cwd()
+
+STAGES = ["ingest", "tune", "train", "predict", "merge"]
+
+
+def get_fingerprint(df, columns):
+    """
+    Returns a hash of the selected columns of a dataframe, used to know if the
+    data of a unit of work changed since it was done.
+    """
+    frame_hash = pd.util.hash_pandas_object(df[columns], index=False).values
+
+    return hashlib.sha256(frame_hash.tobytes()).hexdigest()
+
+
+class PipelineState:
+    """
+    State of the units of work done by every stage, saved as a .json file. The
+    file is rewritten after every unit, through a temporary file, so a killed
+    process never leaves it broken.
+
+    Args:
+        str (optional) : path of the state file. Defaults to the one in config.ini.
+    """
+    def __init__(self, path=None):
+        self.path = path or str(my_path)+parser.get("pipeline", "state_file",
+                                                    fallback="/data/pipeline_state.json")
+        self.state = {stage: {} for stage in STAGES}
+        if Path(self.path).is_file():
+            with open(self.path, "r") as state_file:
+                self.state.update(json.load(state_file))
+
+
+    def get(self, stage, unit):
+        """
+        Returns the record of a unit of work, or an empty one.
+        """
+        return self.state[stage].get(unit, {})
+
+
+    def is_done(self, stage, unit, fingerprint):
+        """
+        Checks if a unit of work was done with the same data.
+        """
+        record = self.get(stage, unit)
+
+        return record.get("done") is not None and record.get("fingerprint") == fingerprint
+
+
+    def update(self, stage, unit, **values):
+        """
+        Updates the record of a unit of work and saves the state.
+        """
+        self.state[stage].setdefault(unit, {}).update(values)
+        self.save()
+
+
+    def mark_done(self, stage, unit, fingerprint, **values):
+        """
+        Records a unit of work as done with the data of the fingerprint.
+        """
+        self.state[stage].get(unit, {}).pop("failed", None)
+        self.update(stage, unit, fingerprint=fingerprint,
+                    done=datetime.now().isoformat(timespec="seconds"), **values)
+
+
+    def mark_failed(self, stage, unit, fingerprint, error):
+        """
+        Records a unit of work that failed with the data of the fingerprint, so
+        it is not tried again until its data changes.
+        """
+        self.update(stage, unit, fingerprint=fingerprint, done=None, failed=str(error))
+
+
+    def save(self):
+        """
+        Writes the state file.
+        """
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path + ".tmp", "w") as state_file:
+            json.dump(self.state, state_file, indent=1, default=str)
+        os.replace(self.path + ".tmp", self.path)
+
+
+class Pipeline:
+    """
+    Runs the stages of the program, skipping the units of work already done
+    with the same data, unless 'force' is True.
+
+    Args:
+        list (optional) : vehicle plates processed. Defaults to all of them.
+        str (optional) : only the files modified and the entries recorded from
+                        this date on are processed, and only the vehicles with
+                        entries from this date on.
+        bool (optional) : if True, the units of work are done again.
+        str (optional) : path of the state file. Defaults to the one in config.ini.
+    """
+    def __init__(self, plates=None, since=None, force=False, state_path=None):
+        self.plates = set(plates) if plates else None
+        self.since = pd.Timestamp(since) if since else None
+        self.force = force
+        self.state = PipelineState(state_path)
+        self.tracer = PipelineTracer()
+        self.json_folder = str(my_path)+parser.get("path_folder", "json_files")
+        self.main_dataset_path = str(CheckMainDataset(str(my_path)+parser.get("path_folder", "main_dataset")))
+        self.predictions_path = str(my_path)+parser.get("pipeline", "predictions",
+                                                        fallback="/data/predictions/predictions_{}.csv")
+
+
+    def is_done(self, stage, unit, fingerprint):
+        return not self.force and self.state.is_done(stage, unit, fingerprint)
+
+
+    def load_main_dataset(self):
+        """
+        Returns the saved main dataset, with Prophet nomenclature.
+        """
+        main_df = pd.read_csv(self.main_dataset_path, parse_dates=["date"])
+
+        return main_df.rename(columns={"temp1": "y", "date": "ds"})
+
+
+    def get_plates(self, main_df):
+        """
+        Returns the vehicle plates of the dataset selected by 'plates' and 'since'.
+        """
+        if self.since is not None:
+            main_df = main_df[main_df["ds"] >= self.since]
+        plates = main_df["vehicle_plate"].dropna().unique()
+
+        return [plate for plate in plates if self.plates is None or plate in self.plates]
+
+
+    @staticmethod
+    def get_training_fingerprint(model, veh_plate):
+        """
+        Returns the fingerprint of the training data of a model. The backend and
+        the tuning mode are added when they are not the default ones, so
+        changing them tunes and trains again.
+        """
+        fingerprint = get_fingerprint(model.get_vehicle_df(veh_plate), ["ds", "y", "temp2"])
+        if model.backend.name != "prophet":
+            fingerprint += f"-{model.backend.name}"
+        if model.tuning_mode != "full":
+            fingerprint += f"-{model.tuning_mode}"
+
+        return fingerprint
+
+
+    def ingest(self):
+        """
+        Processes every .json file that is new or changed since it was ingested
+        and merges it into the main dataset, which is saved after every file.
+        With 'plates', only the entries of those vehicles are merged, and the
+        other plates of the file are recorded as skipped, so a later run that
+        selects them ingests the file again.
+        """
+        with self.tracer.span("ingest") as span:
+            span["rows_out"] = 0
+            for json_file in sorted(filter(is_telemetry_file, Path(self.json_folder).iterdir())):
+                file_stat = json_file.stat()
+                if self.since is not None and pd.Timestamp(file_stat.st_mtime, unit="s") < self.since:
+                    continue
+                fingerprint = f"{file_stat.st_mtime_ns}-{file_stat.st_size}"
+                record = self.state.get("ingest", json_file.name)
+                ingested_plates = set()
+                if self.is_done("ingest", json_file.name, fingerprint):
+                    skipped_plates = set(record.get("skipped_plates", []))
+                    if self.plates is not None:
+                        skipped_plates &= self.plates
+                    if not skipped_plates:
+                        continue
+                    ingested_plates = set(record.get("plates", []))
+                with self.tracer.span("ingest.file", file=json_file.name) as file_span:
+                    dataset = ProcessingData(json_file, self.main_dataset_path)
+                    file_plates = set(dataset.df["vehicle_plate"].dropna().unique())
+                    if self.plates is not None:
+                        if not file_plates & self.plates:
+                            continue
+                        self.select_plates(dataset)
+                    dataset.merge_data_to_main_df()
+                    file_span["rows_out"] = len(dataset.df)
+                span["rows_out"] += len(dataset.df)
+                ingested_plates |= set(dataset.df["vehicle_plate"].dropna().unique())
+                self.state.mark_done("ingest", json_file.name, fingerprint,
+                                     plates=sorted(ingested_plates), rows=len(dataset.df),
+                                     skipped_plates=sorted(file_plates - ingested_plates))
+                print(f"Ingested {json_file.name}.")
+
+
+    def select_plates(self, dataset):
+        """
+        Keeps only the entries, and the gaps, of the vehicles selected by 'plates'
+        in a processed file.
+
+        Args:
+            ProcessingData : processed .json file.
+        """
+        dataset.df = dataset.df[dataset.df["vehicle_plate"].isin(self.plates)].reset_index(drop=True)
+        dataset.gaps = dataset.gaps.select(np.flatnonzero(dataset.gaps.gaps["vehicle_plate"].isin(self.plates)))
+
+
+    def tune(self):
+        """
+        Tunes the hyperparameters of every vehicle, or cluster of vehicles,
+        whose training data changed since it was tuned. Every finished
+        combination of hyperparameters is recorded, and its cross validation
+        results are reused when the tuning of the vehicle starts again.
+        """
+        from prophet_folder.modelo_main import ProphetModel
+
+        main_df = self.load_main_dataset()
+        with self.tracer.span("tune", rows_in=len(main_df)):
+            model = ProphetModel(main_df, self.tracer)
+            for veh_plate in model.get_model_keys(self.get_plates(main_df)):
+                fingerprint = self.get_training_fingerprint(model, veh_plate)
+                if self.is_done("tune", veh_plate, fingerprint):
+                    continue
+                record = self.state.get("tune", veh_plate)
+                resumed = not self.force and record.get("fingerprint") == fingerprint
+                combos = record.get("combos", {}) if resumed else {}
+                if combos:
+                    print(f"Resuming the tuning of {veh_plate}: {len(combos)} runs already done.")
+                self.state.update("tune", veh_plate, fingerprint=fingerprint, done=None, combos=combos)
+
+                def on_params_done(params, rmse):
+                    combos[json.dumps(params, sort_keys=True)] = rmse
+                    self.state.update("tune", veh_plate, combos=combos)
+
+                best_params = model.tune_vehicle(veh_plate, on_params_done)
+                self.state.mark_done("tune", veh_plate, fingerprint, best_params=best_params)
+
+
+    def train(self):
+        """
+        Trains the model of every tuned vehicle, or cluster of vehicles, whose
+        training data changed since it was trained.
+        """
+        from prophet_folder.modelo_main import ProphetModel
+
+        main_df = self.load_main_dataset()
+        with self.tracer.span("train", rows_in=len(main_df)):
+            model = ProphetModel(main_df, self.tracer)
+            for veh_plate in model.get_model_keys(self.get_plates(main_df)):
+                fingerprint = self.get_training_fingerprint(model, veh_plate)
+                if self.is_done("train", veh_plate, fingerprint):
+                    continue
+                if not Path(model.p_best_params.format(veh_plate)).is_file():
+                    print(f"Vehicle plate {veh_plate} has not been tuned. Run the 'tune' stage first.")
+                    continue
+                with self.tracer.span("train.vehicle", vehicle_plate=veh_plate):
+                    model.train_vehicle(veh_plate)
+                self.state.mark_done("train", veh_plate, fingerprint)
+            with self.tracer.span("train.figures"):
+                model.plotter.wait()
+
+
+    def predict(self):
+        """
+        Predicts the missing temperatures of every trained vehicle whose model
+        or missing entries changed since they were predicted. The predictions
+        of every vehicle are saved in their own .csv file. With virtual gaps,
+        the synthetic entries of the gap store are predicted too. With clusters,
+        a vehicle is predicted once the model of its cluster is trained. The
+        other temperature probes of the vehicle are imputed with temp1, and
+        their real entries are part of the fingerprint.
+        """
+        from prophet_folder.channel_imputer import get_active_channels, get_rows_to_predict
+        from prophet_folder.prediction_maker import PredictTempForNaN
+        from prophet_folder.vehicle_clusters import get_model_route
+
+        main_df = self.load_main_dataset()
+        gap_store = load_gap_store() if virtual_gaps_enabled() else None
+        with self.tracer.span("predict", rows_in=len(main_df)) as span:
+            span["rows_out"] = 0
+            for veh_plate in self.get_plates(main_df):
+                model_key, offset = get_model_route(veh_plate)
+                trained = self.state.get("train", model_key).get("done")
+                if trained is None:
+                    print(f"Model {model_key} of vehicle plate {veh_plate} has not been trained. "
+                          f"Run the 'train' stage first.")
+                    continue
+                df_veh_plate = main_df[main_df["vehicle_plate"] == veh_plate]
+                channels = get_active_channels(df_veh_plate)
+                df_to_predict = df_veh_plate[get_rows_to_predict(df_veh_plate, channels)]
+                if gap_store is not None:
+                    df_to_predict = pd.concat([df_to_predict, gap_store.get_entries_to_predict(veh_plate)],
+                                              ignore_index=True)
+                if self.since is not None:
+                    df_to_predict = df_to_predict[df_to_predict["ds"] >= self.since]
+                fingerprint = get_fingerprint(df_to_predict, ["ds"]) + f"-{trained}-{offset}"
+                if channels:
+                    fingerprint += "-" + get_fingerprint(df_veh_plate, ["ds"] + channels)
+                if self.is_done("predict", veh_plate, fingerprint) or df_to_predict.empty:
+                    continue
+                with self.tracer.span("predict.vehicle", rows_in=len(df_to_predict),
+                                      vehicle_plate=veh_plate) as vehicle_span:
+                    prediction = PredictTempForNaN(df_to_predict, veh_plate, df_veh_plate).predict_result
+                    vehicle_span["rows_out"] = len(prediction)
+                span["rows_out"] += len(prediction)
+                predictions_path = Path(self.predictions_path.format(veh_plate))
+                predictions_path.parent.mkdir(parents=True, exist_ok=True)
+                prediction.to_csv(predictions_path, index=False)
+                self.state.mark_done("predict", veh_plate, fingerprint,
+                                     file=str(predictions_path), rows=len(prediction))
+
+
+    def merge(self, publish=False):
+        """
+        Merges the saved predictions of the selected vehicles into the main
+        dataset, and publishes it for the dashboard if 'publish' is True. The
+        dates are only rounded to the minute in the published dataset, so the
+        saved one keeps one entry per vehicle and date and the next runs find
+        the same training data. With virtual gaps, the predictions of the
+        synthetic entries are saved in the gap store instead.
+        """
+        from prophet_folder.prediction_maker import MergePredictions
+
+        main_df = self.load_main_dataset()
+        records = {plate: record for plate, record in self.state.state["predict"].items()
+                   if record.get("done") and (self.plates is None or plate in self.plates)}
+        fingerprint = hashlib.sha256(json.dumps(records, sort_keys=True).encode()).hexdigest()
+        if self.is_done("merge", "main_dataset", fingerprint) or not records:
+            return
+        with self.tracer.span("merge", rows_in=len(main_df)) as span:
+            predictions = pd.concat([pd.read_csv(record["file"], parse_dates=["date"])
+                                     for record in records.values()], ignore_index=True)
+            gap_store = load_gap_store() if virtual_gaps_enabled() else None
+            if gap_store is not None:
+                predictions = gap_store.set_predictions(predictions)
+                gap_store.save(get_gap_store_path())
+            merged_df = MergePredictions(predictions, main_df).df
+            merged_df.sort_values(["vehicle_plate", "date"], kind="stable", inplace=True)
+            merged_df.to_csv(self.main_dataset_path, index=False)
+            span["rows_out"] = len(merged_df)
+        self.state.mark_done("merge", "main_dataset", fingerprint, plates=sorted(records))
+        if publish:
+            from data.dataset_store import publish_dataset
+            merged_df["date"] = merged_df["date"].dt.floor("T")
+            print(f"Main dataset published in {publish_dataset(merged_df, gap_store=gap_store)}.")
+
+
+    def run(self, stages, publish=False):
+        """
+        Runs the stages in the order of the program.
+        """
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            if stage == "merge":
+                self.merge(publish)
+            else:
+                getattr(self, stage)()
+        self.tracer.print_summary()
+
+
+if __name__ == "__main__":
+    options = argparse.ArgumentParser(add_help=False)
+    options.add_argument("--plates", nargs="+", default=None,
+                         help="vehicle plates processed. Defaults to all of them.")
+    options.add_argument("--since", default=None,
+                         help="only the files modified and the entries recorded from this date on.")
+    options.add_argument("--force", action="store_true",
+                         help="does the units of work again, even if they are done.")
+    options.add_argument("--state-file", default=None,
+                         help="path of the state file. Defaults to the one in config.ini.")
+    options.add_argument("--publish", action="store_true",
+                         help="publishes the merged dataset for the dashboard (mmap mode).")
+
+    arg_parser = argparse.ArgumentParser(description="Resumable pipeline of the temp-monitoring program.")
+    subparsers = arg_parser.add_subparsers(dest="stage", required=True)
+    for stage in STAGES + ["all"]:
+        subparsers.add_parser(stage, parents=[options],
+                              help="runs every stage." if stage == "all" else f"runs the {stage} stage.")
+    args = arg_parser.parse_args()
+
+    stages = STAGES if args.stage == "all" else [args.stage]
+    Pipeline(args.plates, args.since, args.force, args.state_file).run(stages, args.publish)
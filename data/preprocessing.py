@@ -11,6 +11,11 @@ from datetime import timedelta
 import pandas as pd
 from configparser import ConfigParser
 
+from data.gap_store import GapStore, get_gap_store_path, load_gap_store, virtual_gaps_enabled
+from data.merge_engine import SortedMerger
+from data.readers import read_telemetry
+from data.retention import drop_compacted, get_compacted_until, load_tier, retention_enabled
+
 parser = ConfigParser()
 parser.read("config.ini")
 
@@ -32,7 +37,7 @@ class CheckMainDataset:
                         'terminal_serial', 'ignition', 'temp1', 'temp2', 'temp3', 
                         'temp4', 'door1_status', 'door2_status', 't_longitude', 
                         'day_of_week', 'interval_time', 'hour', 'predicted_temp', 
-                        'predicted_temp2']
+                        'predicted_temp2', 'predicted_temp3', 'predicted_temp4']
         self.path_file = str(self.pathfolder) + "/" + str(self.filename)
         self.create_file()
 
@@ -59,19 +64,27 @@ class ProcessingData:
     from the main_dataset.
     
     Args:
-        json_pathfile (str) : path where the .json is located.
+        json_pathfile (str) : path where the .json is located. It can also be
+                            line-delimited (.ndjson) and compressed (.gz, .zst).
         main_dataset_path (str) : path where the main_dataset will be saved. 
         limit_interval (float) : interval time that triggers uppsampler function. 
         default_interval (float) : interval time created between new entries out of limit interval.  
+        virtual_gaps (bool, optional) : if True, the gaps are kept in 'self.gaps' instead
+                            of adding their synthetic entries to the dataframe.
+                            Defaults to the value in config.ini.
     """
-    def __init__(self, json_pathfile, main_dataset_path):
+    def __init__(self, json_pathfile, main_dataset_path, virtual_gaps=None):
         self.pathfile = json_pathfile
-        self.main_df = pd.DataFrame()
-        self.df = pd.read_json(json_pathfile)   
+        self.df = read_telemetry(json_pathfile)   
         self.main_dataset_path = main_dataset_path
         self.limit_interval = parser.getint("interval_time_config", "limit")  
         self.default_interval = parser.getint("interval_time_config", "default")
+        self.virtual_gaps = virtual_gaps_enabled() if virtual_gaps is None else virtual_gaps
+        self.gaps = GapStore()
+        self.gap_store = None
         self.df = self.feature_engineering(self.df)
+        if retention_enabled():
+            self.drop_compacted_entries()
 
 
     def feature_engineering(self, df):
@@ -98,8 +111,8 @@ class ProcessingData:
         # Rename columns
         df.rename(columns=column_names, inplace=True)
 
-        # Drop duplicates 
-        df.drop_duplicates(subset="date", keep="last", inplace=True)  
+        # Drop duplicates of the same vehicle
+        df.drop_duplicates(subset=["vehicle_plate", "date"], keep="last", inplace=True)  
 
         # Cast 'date' attribute into a datatime format.
         df["date"] = pd.to_datetime(df["date"]).dt.tz_localize(None)
@@ -109,30 +122,68 @@ class ProcessingData:
         df["interval_time"] = df["date"].diff()
         df["hour"] = df["date"].dt.hour          
         df["ignition"] = df["ignition"].map({"t":1, "f":0})
-        new_df = self.generate_df(df)
+        if self.virtual_gaps:
+            # Only the descriptors of the gaps are kept, their entries are created when read.
+            self.gaps = GapStore.from_entries(df, self.limit_interval, self.default_interval)
+            new_df = df.iloc[:0]
+        else:
+            new_df = self.generate_df(df)
         df["interval_time"] = df["interval_time"].dt.total_seconds()
 
-        # Merge the modified dataframe with the previous data.        
-        df = new_df.merge(df, how="outer").sort_values(by="date").reset_index(drop=True)
+        # Merge the synthesised entries with the real data. Both are sorted by date,
+        # so they are merged without sorting the result again.
+        df = SortedMerger([new_df, df]).merge()
           
         return df
 
 
+    def drop_compacted_entries(self):
+        """
+        Removes the entries, and the gaps, of the periods already compacted by
+        the retention job, which are kept in its tier instead. It modifies the
+        instance variables 'self.df' and 'self.gaps'.
+        """
+        compacted_until = get_compacted_until(load_tier(), parser.get("retention", "frequency",
+                                                                      fallback="15min"))
+        self.df = drop_compacted(self.df, compacted_until)
+        gaps = self.gaps.gaps
+        self.gaps = self.gaps.select(drop_compacted(gaps.assign(date=gaps["end"]), compacted_until).index)
+
+
     def merge_data_to_main_df(self):
         """
-        Merge the resulting dataframe information to main_dataset.
-        It modifies the instance variable 'self.main_df'.
+        Merge the resulting dataframe information to main_dataset. Entries of the
+        same vehicle and date are only kept once, the new ones taking precedence.
+        The result is streamed to the file in chunks, sorted by vehicle plate and
+        date, so the merged dataset is never held in memory; it can be read with
+        'load_main_df'. With virtual gaps, the gaps of the file are merged into
+        the saved gap store ('self.gap_store').
+
+        Returns:
+            int : number of entries of the main dataset.
+        """
+        rows = SortedMerger([self.df, self.load_main_df()]).merge_to_csv(self.main_dataset_path)
+        if self.virtual_gaps:
+            self.gap_store = load_gap_store().merge(self.gaps)
+            self.gap_store.save(get_gap_store_path())
+
+        return rows
+
+
+    def load_main_df(self):
+        """
+        Reads the saved main_dataset.
+
+        Returns:
+            pd.Dataframe : main dataset.
         """
         main_df = pd.read_csv(self.main_dataset_path)
         main_df["date"] = pd.to_datetime(main_df["date"])               
         main_df["interval_time"] = pd.to_timedelta(main_df["interval_time"]).dt.total_seconds()      
-        main_df = self.df.merge(main_df, how="outer").sort_values(by="date").reset_index(drop=True)       
-        main_df.drop_duplicates(subset="date", keep="first", inplace=True) 
-        main_df.reset_index(drop=True, inplace=True)
-        main_df.to_csv(self.main_dataset_path, index=False)
-        
-        self.main_df = main_df
-        
+
+        return main_df
+
+
     @staticmethod
     def run_upsampler(df, limit_interval, default_interval):
         """
@@ -199,6 +250,8 @@ class ProcessingData:
         new_df = pd.DataFrame(self.run_upsampler(df, self.limit_interval, 
                                                  self.default_interval), 
                                                  columns=columns)
+        # A vehicle without long intervals has no new entries.
+        new_df["date"] = pd.to_datetime(new_df["date"])
         
         # Generates new attribute capable of being used as regressors 
         new_df["day_of_week"] = new_df["date"].dt.day_name()
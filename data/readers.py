@@ -0,0 +1,135 @@
+"""
+readers.py
+This source code is part of temp-monitoring program.
+It contains the readers of the telemetry files: JSON arrays, as exported by the
+telemetry platform, and line-delimited JSON (NDJSON), one entry per line, both
+of them plain or compressed with gzip or zstd. The compression is detected from
+the first bytes of the file and the format from its extension and its first
+character, and the compressed files are decompressed while they are read.
+"""
+
+import gzip
+import io
+import json
+from pathlib import Path
+
+import pandas as pd
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+NDJSON_SUFFIXES = [".ndjson", ".jsonl"]
+COMPRESSED_SUFFIXES = [".gz", ".zst"]
+
+
+def is_telemetry_file(path):
+    """
+    Checks, by its extension, if a file is a telemetry file: .json, .ndjson or
+    .jsonl, optionally followed by .gz or .zst.
+    """
+    suffixes = Path(path).suffixes
+    if suffixes and suffixes[-1] in COMPRESSED_SUFFIXES:
+        suffixes = suffixes[:-1]
+
+    return bool(suffixes) and suffixes[-1] in [".json"] + NDJSON_SUFFIXES
+
+
+def get_compression(path):
+    """
+    Returns the compression of a file, 'gzip', 'zstd' or None, from its first bytes.
+    """
+    with open(path, "rb") as raw_file:
+        magic = raw_file.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return "gzip"
+    if magic == ZSTD_MAGIC:
+        return "zstd"
+
+    return None
+
+
+def open_telemetry(path):
+    """
+    Opens a telemetry file for reading as text, decompressing it while it is read.
+    """
+    compression = get_compression(path)
+    if compression == "gzip":
+        return gzip.open(path, "rt", encoding="utf-8")
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(f"{Path(path).name} is compressed with zstd, which needs "
+                              "the 'zstandard' package.") from None
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return io.TextIOWrapper(reader, encoding="utf-8")
+
+    return open(path, "r", encoding="utf-8")
+
+
+def is_ndjson(path):
+    """
+    Checks if a file is line-delimited JSON, from its extension or, if it is
+    .json, from its first character: '[' opens an array and '{' an entry.
+    Compressed streams can't go back, so the start of the file is read apart.
+    """
+    suffixes = Path(path).suffixes
+    if any(suffix in NDJSON_SUFFIXES for suffix in suffixes):
+        return True
+    with open_telemetry(path) as text_file:
+        head = text_file.read(4096)
+        while head and not head.strip():
+            head = text_file.read(4096)
+
+    return head.lstrip().startswith("{")
+
+
+def read_telemetry(path, chunksize=100000):
+    """
+    Reads a telemetry file in any of the supported formats.
+
+    Args:
+        str : path of the file.
+        int (optional) : entries parsed at once from line-delimited files.
+
+    Returns:
+        pd.Dataframe : one row per entry.
+    """
+    ndjson = is_ndjson(path)
+    with open_telemetry(path) as text_file:
+        if not ndjson:
+            return pd.read_json(text_file)
+        chunks = list(pd.read_json(text_file, lines=True, chunksize=chunksize))
+
+    if not chunks:
+        return pd.DataFrame()
+
+    return pd.concat(chunks, ignore_index=True)
+
+
+def write_telemetry(entries, path, level=None):
+    """
+    Writes telemetry entries in the format given by the extension of the path,
+    like 'vehicle.ndjson.gz' or 'vehicle.json.zst'. It is used to compress the
+    archived files.
+
+    Args:
+        list : entries with the 'out_*' schema.
+        str : path of the file.
+        int (optional) : compression level.
+    """
+    path = Path(path)
+    suffixes = path.suffixes
+    compression = suffixes[-1] if suffixes and suffixes[-1] in COMPRESSED_SUFFIXES else None
+    if any(suffix in NDJSON_SUFFIXES for suffix in suffixes):
+        text = "".join(json.dumps(entry) + "\n" for entry in entries)
+    else:
+        text = json.dumps(entries)
+    data = text.encode("utf-8")
+
+    if compression == ".gz":
+        data = gzip.compress(data, compresslevel=6 if level is None else level)
+    elif compression == ".zst":
+        import zstandard
+        data = zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+    with open(path, "wb") as telemetry_file:
+        telemetry_file.write(data)
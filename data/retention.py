@@ -0,0 +1,404 @@
+"""
+retention.py
+This source code is part of temp-monitoring program.
+It contains the retention job that keeps main_dataset.csv bounded: the entries
+older than 'full_resolution_days' are removed from it and summarized in a tier
+of 'frequency' buckets per vehicle, with the minimum, mean and maximum of the
+real and predicted temperatures and the number of each, and optionally saved
+in a compressed cold archive. It also contains the dataset wrapper that reads
+the tier for the compacted periods and for long queries. The options are read
+from the [retention] section of config.ini:
+
+    (venv) $ python -m data.retention            # compacts main_dataset.csv
+    (venv) $ python -m data.retention --publish  # and publishes it (data_mode = mmap)
+"""
+
+import argparse
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from configparser import ConfigParser
+
+from data.gap_store import get_gap_store_path, load_gap_store, virtual_gaps_enabled
+from data.instrumentation import PipelineTracer
+
+parser = ConfigParser()
+parser.read("config.ini")
+my_path = Path.cwd()
+
+TIER_COLUMNS = ["vehicle_plate", "date",
+                "temp1_min", "temp1_mean", "temp1_max",
+                "predicted_temp_min", "predicted_temp_mean", "predicted_temp_max",
+                "real_count", "predicted_count"]
+
+
+def retention_enabled():
+    """
+    Checks if the compacted periods are read from the tier.
+    """
+    return parser.getboolean("retention", "enabled", fallback=False)
+
+
+def get_tier_path():
+    """
+    Returns the path of the tier file defined in the config file.
+    """
+    return str(my_path)+parser.get("retention", "tier_file", fallback="/data/main_dataset_tier.csv")
+
+
+def load_tier(path=None):
+    """
+    Returns the saved tier, or an empty one if nothing has been compacted yet.
+    """
+    path = path or get_tier_path()
+    if not Path(path).is_file():
+        return pd.DataFrame(columns=TIER_COLUMNS).astype({"date": "datetime64[ns]"})
+
+    return pd.read_csv(path, parse_dates=["date"])
+
+
+def get_compacted_until(tier_df, frequency):
+    """
+    Returns, for every vehicle plate, the date until which its entries are
+    compacted: the end of its last bucket in the tier.
+    """
+    last_buckets = tier_df.groupby("vehicle_plate")["date"].max()
+
+    return (last_buckets + pd.tseries.frequencies.to_offset(frequency)).to_dict()
+
+
+def drop_compacted(df, compacted_until):
+    """
+    Removes the entries of the periods already compacted, so a file ingested
+    again doesn't bring them back to main_dataset.csv.
+
+    Args:
+        pd.Dataframe : entries with the columns vehicle_plate and date.
+        dict : date until which every vehicle plate is compacted.
+
+    Returns:
+        pd.Dataframe : the entries after the compacted periods.
+    """
+    if not compacted_until or df.empty:
+        return df
+    limits = df["vehicle_plate"].map(compacted_until)
+
+    return df[limits.isna() | (df["date"] >= limits)]
+
+
+def downsample(df, frequency):
+    """
+    Summarizes the entries of every vehicle in buckets of 'frequency'. The real
+    temperatures are the ones in temp1 and the predicted ones those of the
+    entries without temp1. The temperatures are rounded to 2 decimals.
+
+    Args:
+        pd.Dataframe : entries with the columns vehicle_plate, date, temp1 and predicted_temp.
+        str : length of the buckets, like '15min'.
+
+    Returns:
+        pd.Dataframe : one row per vehicle plate and bucket, with the TIER_COLUMNS.
+    """
+    predicted = df["predicted_temp"].where(df["temp1"].isna())
+    groups = (pd.DataFrame({"temp1": df["temp1"].astype("float64"),
+                            "predicted_temp": predicted.astype("float64")})
+              .groupby([df["vehicle_plate"], df["date"].dt.floor(frequency)]))
+    tier_df = groups.agg(["min", "mean", "max", "count"]).round(2)
+    tier_df.columns = [f"{column}_{function}" for column, function in tier_df.columns]
+    tier_df = tier_df.rename(columns={"temp1_count": "real_count",
+                                      "predicted_temp_count": "predicted_count"})
+
+    return tier_df.reset_index()[TIER_COLUMNS]
+
+
+def get_tier_entries(tier_df, columns):
+    """
+    Converts the buckets of the tier into entries of the main dataset, dated
+    at the start of the bucket, with the mean temperatures. The buckets without
+    real temperatures are flagged as gaps.
+
+    Args:
+        pd.Dataframe : buckets of the tier.
+        list : columns of the main dataset.
+
+    Returns:
+        pd.Dataframe : one entry per bucket.
+    """
+    entries = pd.DataFrame({"date": tier_df["date"].to_numpy(),
+                            "vehicle_plate": tier_df["vehicle_plate"].to_numpy(),
+                            "temp1": tier_df["temp1_mean"].to_numpy(),
+                            "predicted_temp": tier_df["predicted_temp_mean"].to_numpy(),
+                            "date_flag": np.where(tier_df["real_count"] == 0, True, None)})
+    if "day_of_week" in columns:
+        entries["day_of_week"] = entries["date"].dt.day_name()
+    if "hour" in columns:
+        entries["hour"] = entries["date"].dt.hour
+
+    return entries.reindex(columns=columns)
+
+
+def write_csv(df, path):
+    """
+    Writes a dataframe as .csv through a temporary file, so a killed process
+    never leaves the file broken.
+    """
+    df.to_csv(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+
+
+class RetentionJob:
+    """
+    Compacts the entries of main_dataset.csv older than 'full_resolution_days',
+    counted back from its last entry. With virtual gaps, the gaps that end
+    before that date are compacted with them and removed from the gap store.
+
+    Args:
+        float (optional) : days kept at full resolution. Defaults to config.ini.
+        str (optional) : length of the buckets of the tier. Defaults to config.ini.
+        bool (optional) : if True, the compacted entries are archived. Defaults to config.ini.
+    """
+    def __init__(self, full_resolution_days=None, frequency=None, archive=None):
+        self.full_resolution_days = (parser.getfloat("retention", "full_resolution_days", fallback=30)
+                                     if full_resolution_days is None else full_resolution_days)
+        self.frequency = frequency or parser.get("retention", "frequency", fallback="15min")
+        self.archive = parser.getboolean("retention", "archive", fallback=False) if archive is None else archive
+        self.archive_folder = str(my_path)+parser.get("retention", "archive_folder", fallback="/data/archive")
+        self.main_dataset_path = str(my_path)+parser.get("path_folder", "main_dataset")+"/main_dataset.csv"
+        self.tier_path = get_tier_path()
+        self.tracer = PipelineTracer()
+
+
+    def get_cutoff(self, main_df, gap_store=None):
+        """
+        Returns the date before which the entries are compacted, rounded down
+        to the start of a bucket, so a bucket is never split between two runs.
+        With virtual gaps, it is moved back before the gaps that would be cut
+        by it, as a gap is compacted as a whole.
+        """
+        cutoff = (main_df["date"].max() - pd.Timedelta(days=self.full_resolution_days)).floor(self.frequency)
+        while gap_store is not None:
+            cut = (gap_store.starts < cutoff.to_datetime64()) & (gap_store.ends >= cutoff.to_datetime64())
+            if not cut.any():
+                break
+            cutoff = pd.Timestamp(gap_store.starts[cut].min()).floor(self.frequency)
+
+        return cutoff
+
+
+    def save_archive(self, old_df, cutoff):
+        """
+        Saves the compacted entries in a compressed .csv file of the archive.
+
+        Returns:
+            Path : path of the file.
+        """
+        archive_path = Path(self.archive_folder) / (f"main_dataset_{old_df['date'].min():%Y%m%d}"
+                                                   f"_{cutoff:%Y%m%d}.csv.gz")
+        archive_path.parent.mkdir(parents=True, exist_ok=True)
+        old_df.to_csv(archive_path, index=False, compression="gzip")
+
+        return archive_path
+
+
+    def run(self, publish=False):
+        """
+        Compacts the old entries: the tier and main_dataset.csv are rewritten,
+        and the dataset is published for the dashboard if 'publish' is True.
+        """
+        main_df = pd.read_csv(self.main_dataset_path, parse_dates=["date"])
+        gap_store = load_gap_store() if virtual_gaps_enabled() else None
+        if main_df.empty:
+            print("The main dataset is empty, there is nothing to compact.")
+            return
+        cutoff = self.get_cutoff(main_df, gap_store)
+        old = (main_df["date"] < cutoff).to_numpy()
+        old_gaps = np.array([], dtype="int64")
+        if gap_store is not None:
+            old_gaps = np.flatnonzero(gap_store.ends < cutoff.to_datetime64())
+        if not old.any() and not len(old_gaps):
+            print(f"There are no entries before {cutoff} to compact.")
+            return
+
+        with self.tracer.span("retention", rows_in=len(main_df)) as span:
+            old_df = main_df[old]
+            if gap_store is not None:
+                old_df = pd.concat([old_df, gap_store.select(old_gaps).expand().reindex(columns=main_df.columns)],
+                                   ignore_index=True).sort_values(["vehicle_plate", "date"], kind="stable")
+                gap_store = gap_store.select(np.setdiff1d(np.arange(len(gap_store.gaps)), old_gaps))
+            with self.tracer.span("retention.downsample", rows_in=len(old_df)) as tier_span:
+                tier_df = pd.concat([load_tier(self.tier_path), downsample(old_df, self.frequency)],
+                                    ignore_index=True)
+                tier_df = (tier_df.drop_duplicates(["vehicle_plate", "date"], keep="last")
+                                  .sort_values(["vehicle_plate", "date"], kind="stable"))
+                tier_span["rows_out"] = len(tier_df)
+            if self.archive:
+                with self.tracer.span("retention.archive", rows_in=len(old_df)):
+                    print(f"{len(old_df)} entries archived in {self.save_archive(old_df, cutoff)}.")
+            main_df = main_df[~old]
+            write_csv(tier_df, self.tier_path)
+            write_csv(main_df, self.main_dataset_path)
+            if gap_store is not None:
+                gap_store.save(get_gap_store_path())
+            span["rows_out"] = len(main_df)
+
+        print(f"{len(old_df)} entries before {cutoff} compacted into {len(tier_df)} buckets of "
+              f"{self.frequency}, {len(main_df)} entries kept at full resolution.")
+        if publish:
+            from data.dataset_store import publish_dataset
+            main_df = main_df.assign(date=main_df["date"].dt.floor("T"))
+            print(f"Main dataset published in {publish_dataset(main_df, gap_store=gap_store)}.")
+        self.tracer.print_summary()
+
+
+class TieredDataset:
+    """
+    Wraps one of the dataset classes used by the dashboard, adding the buckets
+    of the tier to the queries, as entries dated at the start of every bucket,
+    for the periods of every vehicle before its first entry at full
+    resolution. The queries longer than 'tier_range_days' are summarized in
+    buckets as well, so a long period returns a bounded number of entries.
+    The tier is read again when the file changes. Any other attribute is the
+    one of the wrapped dataset.
+
+    Args:
+        InMemoryDataset or SharedDataset : dataset to wrap.
+        str (optional) : path of the tier. Defaults to the one in config.ini.
+    """
+    def __init__(self, dataset, path=None):
+        self.dataset = dataset
+        self.path = path or get_tier_path()
+        self.frequency = parser.get("retention", "frequency", fallback="15min")
+        self.tier_range = pd.Timedelta(days=parser.getfloat("retention", "tier_range_days", fallback=31))
+        self.tier_version = -1
+        self.tier_df = None
+        self.refresh()
+
+
+    def __getattr__(self, name):
+        return getattr(self.dataset, name)
+
+
+    def refresh(self):
+        """
+        Reads the tier if it has changed since it was read.
+        """
+        tier_version = os.stat(self.path).st_mtime_ns if Path(self.path).is_file() else None
+        if tier_version != self.tier_version:
+            self.tier_df = load_tier(self.path)
+            self.tier_version = tier_version
+
+
+    def get_version(self):
+        """
+        Returns the version of the wrapped dataset and of the tier.
+        """
+        self.refresh()
+
+        return f"{self.dataset.get_version()}-{self.tier_version}"
+
+
+    def get_plates(self):
+        """
+        Returns the sorted list of vehicle plates, of the dataset and of the tier.
+        """
+        self.refresh()
+
+        return sorted(set(self.dataset.get_plates()) | set(self.tier_df["vehicle_plate"].unique()))
+
+
+    def get_plate_tier(self, vehicle_plate):
+        """
+        Returns the buckets of a vehicle plate before its first entry at full
+        resolution, so no period is returned twice.
+        """
+        self.refresh()
+        plate_tier = self.tier_df[self.tier_df["vehicle_plate"] == vehicle_plate]
+        first_date, _ = self.dataset.get_date_range(vehicle_plate)
+        if not pd.isna(first_date):
+            plate_tier = plate_tier[plate_tier["date"] < first_date]
+
+        return plate_tier
+
+
+    def get_date_range(self, vehicle_plate):
+        """
+        Returns the first and the last date of a vehicle plate.
+        """
+        plate_tier = self.get_plate_tier(vehicle_plate)
+        first_date, last_date = self.dataset.get_date_range(vehicle_plate)
+        if plate_tier.empty:
+            return first_date, last_date
+        if pd.isna(last_date):
+            last_date = plate_tier["date"].iloc[-1]
+
+        return plate_tier["date"].iloc[0], last_date
+
+
+    def get_columns(self, columns):
+        """
+        Returns the selected columns of the whole dataset, with the entries of the tier.
+        """
+        tier_entries = [get_tier_entries(self.get_plate_tier(plate), columns)
+                        for plate in self.tier_df["vehicle_plate"].unique()]
+
+        return pd.concat(tier_entries + [self.dataset.get_columns(columns)], ignore_index=True)
+
+
+    def get_query_tier(self, vehicle_plate, start_date, end_date):
+        """
+        Returns the entries of the tier of a query.
+        """
+        plate_tier = self.get_plate_tier(vehicle_plate)
+        in_query = (plate_tier["date"] > pd.Timestamp(start_date)) & (plate_tier["date"] <= pd.Timestamp(end_date))
+
+        return get_tier_entries(plate_tier[in_query], self.dataset.get_schema().names)
+
+
+    def query(self, vehicle_plate, start_date, end_date):
+        """
+        Returns the entries of a vehicle plate after 'start_date' and until
+        'end_date', both included, from the tier and from the dataset, whose
+        entries are also summarized if the query is longer than 'tier_range_days'.
+        """
+        filtered_df = self.dataset.query(vehicle_plate, start_date, end_date)
+        if pd.Timestamp(end_date) - pd.Timestamp(start_date) > self.tier_range and not filtered_df.empty:
+            filtered_df = get_tier_entries(downsample(filtered_df, self.frequency), filtered_df.columns)
+        tier_entries = self.get_query_tier(vehicle_plate, start_date, end_date)
+        if tier_entries.empty:
+            return filtered_df
+
+        return pd.concat([tier_entries.reindex(columns=filtered_df.columns), filtered_df], ignore_index=True)
+
+
+    def count(self, vehicle_plate, start_date, end_date):
+        """
+        Returns the number of entries of a query read from the tier and from
+        the dataset, before they are summarized.
+        """
+        return (len(self.get_query_tier(vehicle_plate, start_date, end_date))
+                + self.dataset.count(vehicle_plate, start_date, end_date))
+
+
+    def iter_query(self, vehicle_plate, start_date, end_date, chunksize=50000):
+        """
+        Yields the entries of a query in dataframes of 'chunksize' rows: the
+        ones of the tier and then the ones of the dataset, at full resolution.
+        """
+        tier_entries = self.get_query_tier(vehicle_plate, start_date, end_date)
+        for first in range(0, len(tier_entries), chunksize):
+            yield tier_entries.iloc[first:first+chunksize]
+        yield from self.dataset.iter_query(vehicle_plate, start_date, end_date, chunksize)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Compacts the old entries of the main dataset.")
+    arg_parser.add_argument("--days", type=float, default=None,
+                            help="days kept at full resolution, counted back from the last entry.")
+    arg_parser.add_argument("--archive", action="store_true", default=None,
+                            help="saves the compacted entries in the archive folder.")
+    arg_parser.add_argument("--publish", action="store_true",
+                            help="publishes the compacted dataset for the dashboard (mmap mode).")
+    args = arg_parser.parse_args()
+    RetentionJob(args.days, archive=args.archive).run(args.publish)
@@ -0,0 +1,150 @@
+"""
+channel_imputer.py
+This source code is part of temp-monitoring program.
+It contains the imputation of the other temperature probes of the vehicles:
+the missing entries of temp2, temp3 and temp4 are predicted as
+predicted_temp2, predicted_temp3 and predicted_temp4, while temp1 keeps the
+model tuned for it. All the probes of a vehicle are fitted in one pass: the
+design matrix of the trend and the daily and weekly seasonalities of
+fourier_ridge.py is built once for the dates of the vehicle, the probes
+recorded in the same entries share its Gram matrix, and every probe only adds
+its own ridge solve. The probes imputed are read from the [channels] section
+of config.ini, and a vehicle only has a probe imputed if it has enough real
+temperatures of it, so the probes it doesn't have are left empty.
+"""
+
+import numpy as np
+import pandas as pd
+from configparser import ConfigParser
+
+from prophet_folder.fourier_ridge import FourierRidgeModel, to_seconds
+from prophet_folder.model_backends import FourierRidgeBackend
+
+parser = ConfigParser()
+parser.read("config.ini")
+
+CHANNELS = ["temp2", "temp3", "temp4"]
+# Column of the predictions of every probe.
+PREDICTED_COLUMNS = {"temp1": "predicted_temp",
+                     "temp2": "predicted_temp2",
+                     "temp3": "predicted_temp3",
+                     "temp4": "predicted_temp4",
+                     }
+
+
+def get_channels():
+  """
+  Returns the probes imputed with temp1, as set in config.ini.
+  """
+  channels = parser.get("channels", "channels", fallback="")
+  channels = [channel.strip() for channel in channels.replace(",", " ").split() if channel.strip()]
+  unknown = [channel for channel in channels if channel not in CHANNELS]
+  if unknown:
+    raise ValueError(f"Unknown temperature channels {unknown}. Use some of {CHANNELS}.")
+
+  return channels
+
+
+def get_active_channels(df_veh_plate):
+  """
+  Returns the probes of a vehicle that are imputed: the ones set in
+  config.ini with at least 'min_entries' real temperatures.
+  """
+  min_entries = parser.getint("channels", "min_entries", fallback=100)
+
+  return [channel for channel in get_channels()
+          if channel in df_veh_plate.columns and df_veh_plate[channel].notna().sum() >= min_entries]
+
+
+def get_rows_to_predict(df_veh_plate, channels, real_column="y"):
+  """
+  Returns the mask of the entries of a vehicle with any temperature to
+  predict: temp1, or any of the probes imputed.
+  """
+  mask = df_veh_plate[real_column].isna()
+  for channel in channels:
+    mask |= df_veh_plate[channel].isna()
+
+  return mask
+
+
+class ChannelImputer:
+  """
+  Model of the other temperature probes of a vehicle. Every probe is fitted
+  as fourier_ridge.py fits temp1, with the same trend, changepoints and
+  seasonalities, but without a regressor, as the probes of an entry are
+  usually missing together.
+
+  Args:
+    pd.Dataframe : entries of the vehicle with the column ds and the probes.
+    list (optional) : probes imputed. Defaults to the active ones of the vehicle.
+  """
+  def __init__(self, df_veh_plate, channels=None):
+    self.channels = get_active_channels(df_veh_plate) if channels is None else list(channels)
+    self.basis = FourierRidgeModel(**FourierRidgeBackend().model_kwargs)
+    self.coef = np.empty((0, len(self.channels)))
+    self.y_scale = np.ones(len(self.channels))
+    if self.channels:
+      self.fit(df_veh_plate)
+
+
+  def fit(self, df_veh_plate):
+    """
+    Fits every probe with its real temperatures. The noise variance of the
+    penalties is estimated with a first solve and every probe is solved again
+    with it, from the Gram matrix, so the design is only multiplied once per
+    group of probes.
+
+    Returns:
+      ChannelImputer : the same object, fitted.
+    """
+    seconds = to_seconds(df_veh_plate["ds"])
+    observed = df_veh_plate[self.channels].notna().to_numpy()
+    self.basis.set_basis(seconds[observed.any(axis=1)])
+    X = self.basis.get_design(seconds)
+
+    grams = {}
+    coefs = []
+    for position, channel in enumerate(self.channels):
+      mask = observed[:, position]
+      key = np.packbits(mask).tobytes()
+      if key not in grams:
+        grams[key] = X[mask].T @ X[mask]
+      gram = grams[key]
+      y = df_veh_plate[channel].to_numpy(dtype="float64")[mask]
+      self.y_scale[position] = max(np.abs(y).max(), 1e-9)
+      y = y / self.y_scale[position]
+      # The entries without the probe add nothing to the product.
+      Xty = X.T @ np.where(mask, df_veh_plate[channel].to_numpy(dtype="float64"), 0) / self.y_scale[position]
+      noise_var = np.var(y) * 0.01 + 1e-9
+      for _ in range(2):
+        coef = np.linalg.solve(gram + np.diag(self.basis.get_penalties(X.shape[1], noise_var)), Xty)
+        noise_var = max(y @ y - 2 * coef @ Xty + coef @ gram @ coef, 0) / len(y) + 1e-9
+      coefs.append(coef)
+    self.coef = np.column_stack(coefs)
+
+    return self
+
+
+  def predict(self, df):
+    """
+    Predicts the probes in some entries, with one product of the design and
+    the coefficients of all of them. The entries with a real temperature of a
+    probe are left without its prediction.
+
+    Args:
+      pd.Dataframe : entries with the column ds and optionally the probes.
+
+    Returns:
+      pd.Dataframe : one predicted column per probe, with the index of the entries.
+    """
+    columns = [PREDICTED_COLUMNS[channel] for channel in self.channels]
+    if not self.channels or df.empty:
+      return pd.DataFrame(columns=columns, index=df.index, dtype="float64")
+    predicted = self.basis.get_design(to_seconds(df["ds"])) @ self.coef * self.y_scale
+    predicted = pd.DataFrame(predicted, columns=columns, index=df.index)
+    for channel, column in zip(self.channels, columns):
+      if channel in df.columns:
+        predicted[column] = predicted[column].where(df[channel].isna())
+
+    return predicted
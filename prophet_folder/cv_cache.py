@@ -0,0 +1,151 @@
+"""
+cv_cache.py
+This source code is part of temp-monitoring program.
+It contains the code to cache the cross validation results obtained for every
+vehicle plate and combination of hyperparameters, so the same work is not
+repeated when the tuning of a vehicle is run again with the same data.
+"""
+
+import json
+import hashlib
+import os
+from pathlib import Path
+
+import pandas as pd
+from configparser import ConfigParser
+
+parser = ConfigParser()
+parser.read("config.ini")
+my_path = Path.cwd()
+
+
+class CVCache:
+  """
+  Content-addressed cache of the 'performance_metrics' results. Each entry is
+  a .json file named after a hash of the training data of the vehicle, the
+  hyperparameters and the cross validation settings, and it also keeps the
+  regressor coefficients of the fitted model.
+  """
+  def __init__(self):
+    self.path_template = str(my_path)+parser.get("path_folder", "cv_cache")
+    self.cache_folder = Path(self.path_template).parent
+
+
+  @staticmethod
+  def get_key(df, vehicle_plate, params, backend="prophet", **cv_kwargs):
+    """
+    Generates the key of a cross validation run. Only the columns used by the
+    model are hashed, so changes in other attributes don't invalidate the cache.
+
+    Args:
+      pd.Dataframe : training data of the vehicle, with Prophet nomenclature.
+      str : vehicle plate.
+      dict : hyperparameters of the model.
+      str (optional) : backend that fits the model.
+      **cv_kwargs : arguments passed to 'cross_validation' (initial, period, horizon...).
+
+    Returns:
+      str : hexadecimal hash of the run.
+    """
+    columns = [column for column in ["ds", "y", "temp2"] if column in df.columns]
+    frame_hash = pd.util.hash_pandas_object(df[columns], index=False).values
+    payload = json.dumps({"vehicle_plate": vehicle_plate,
+                          "params": params,
+                          "cv": {key: str(value) for key, value in cv_kwargs.items()},
+                          },
+                          sort_keys=True)
+    # The prophet runs keep the keys they had before there were other backends.
+    if backend != "prophet":
+      payload += backend
+    key = hashlib.sha256(frame_hash.tobytes())
+    key.update(payload.encode())
+
+    return key.hexdigest()
+
+
+  def get(self, key):
+    """
+    Looks for a cached run.
+
+    Args:
+      str : key of the run.
+
+    Returns:
+      tuple : (performance metrics, regressor coefficients) dataframes, or None
+              if the run has not been cached.
+    """
+    path = Path(self.path_template.format(key))
+    if not path.is_file():
+      return None
+    with open(path, "r") as cache_file:
+      entry = json.load(cache_file)
+
+    return self.entry_to_frames(entry)
+
+
+  def put(self, key, vehicle_plate, params, df_perf, reg_coef, timestamp):
+    """
+    Saves the results of a cross validation run. The file is written to a
+    temporary path first so a killed process never leaves a broken entry.
+
+    Args:
+      str : key of the run.
+      str : vehicle plate.
+      dict : hyperparameters of the model.
+      pd.Dataframe : results of 'performance_metrics'.
+      pd.Dataframe : results of 'regressor_coefficients'.
+      str : timestamp of the tuning run.
+    """
+    df_perf = df_perf.copy()
+    df_perf["horizon"] = df_perf["horizon"].astype(str)
+    entry = {"vehicle_plate": vehicle_plate,
+             "params": params,
+             "timestamp": timestamp,
+             "metrics": df_perf.to_dict(orient="records"),
+             "regressor_coefficients": reg_coef.to_dict(orient="records"),
+             }
+    path = self.path_template.format(key)
+    with open(path + ".tmp", "w") as cache_file:
+      json.dump(entry, cache_file)
+    os.replace(path + ".tmp", path)
+
+
+  @staticmethod
+  def entry_to_frames(entry):
+    """
+    Converts a cache entry back into the dataframes it was created from.
+    """
+    df_perf = pd.DataFrame(entry["metrics"])
+    df_perf["horizon"] = pd.to_timedelta(df_perf["horizon"])
+    reg_coef = pd.DataFrame(entry["regressor_coefficients"])
+
+    return df_perf, reg_coef
+
+
+  def get_tuning_results(self, vehicle_plate):
+    """
+    Rebuilds, from every cached run of the vehicle plate, the same table that
+    is saved in 'perf_metrics_<vehicle_plate>.csv'.
+
+    Args:
+      str : vehicle plate.
+
+    Returns:
+      pd.Dataframe : one row per cached combination of hyperparameters.
+    """
+    rows = []
+    for path in self.cache_folder.glob(Path(self.path_template).name.format("*")):
+      with open(path, "r") as cache_file:
+        entry = json.load(cache_file)
+      if entry["vehicle_plate"] != vehicle_plate:
+        continue
+      df_perf, _ = self.entry_to_frames(entry)
+      for metrics in df_perf.to_dict(orient="records"):
+        rows.append({"timestamp": entry["timestamp"], **entry["params"], **metrics})
+    columns = ["timestamp", "changepoint_prior_scale", "changepoint_range",
+               "daily_seasonality", "weekly_seasonality", "horizon", "mse",
+               "rmse", "mae", "mape", "mdape", "smape", "coverage"]
+    tuning_results = pd.DataFrame(rows, columns=columns)
+    tuning_results.sort_values("timestamp", kind="stable", inplace=True, ignore_index=True)
+
+    return tuning_results
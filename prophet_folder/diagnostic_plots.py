@@ -0,0 +1,220 @@
+"""
+diagnostic_plots.py
+This source code is part of temp-monitoring program.
+It contains the code to render, once a model has been trained, the figure
+with the fit and a forecast of the model and its R2 score. The figures are
+rendered in background worker processes, so the training of the next vehicles
+doesn't have to wait for them, and they can also be rendered on demand:
+
+    (venv) $ python -m prophet_folder.diagnostic_plots 0000AAA 0001AAA
+"""
+
+import sys
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from configparser import ConfigParser
+
+from prophet_folder.fourier_ridge import FourierRidgeModel
+from prophet_folder.model_serializer import ModelSerializer
+
+parser = ConfigParser()
+parser.read("config.ini")
+my_path = Path.cwd()
+
+
+def render_diagnostic_figure(vehicle_plate, df_veh_plate, figure_path):
+  """
+  Makes predictions with the saved model of the vehicle for its training period
+  and a 20% longer horizon, and saves the figure with the results and the R2 score.
+  It runs inside the worker processes, so it uses the non-interactive backend
+  of matplotlib and the figure is closed once it is saved.
+
+  Args:
+    str : vehicle plate.
+    pd.Dataframe : training data of the vehicle, with Prophet nomenclature.
+    str : path where the figure is saved.
+
+  Returns:
+    str : path of the saved figure.
+  """
+  import matplotlib
+  matplotlib.use("Agg")
+  from matplotlib import pyplot as plt
+  from sklearn.metrics import r2_score
+
+  model = ModelSerializer().load(vehicle_plate)
+  if isinstance(model, FourierRidgeModel):
+    return render_fourier_ridge_figure(vehicle_plate, model, df_veh_plate, figure_path)
+
+  # Models saved without history need it back to be plotted.
+  if model.history.empty:
+    model.history = model.setup_dataframe(df_veh_plate[["ds", "y"]].copy())
+    model.history_dates = pd.to_datetime(pd.Series(df_veh_plate["ds"].unique(),
+                                                   name="ds")).sort_values()
+
+  # Makes future predictions.
+  future_periods = model.make_future_dataframe(periods=int(len(df_veh_plate)*0.2),
+                                               freq="0.3min")
+  forecast = model.predict(future_periods)
+  forecast = forecast[["ds", "yhat", "yhat_lower", "yhat_upper"]]
+
+  # Combines the results of these predictions to the corresponding
+  # vehicle dataframe.
+  metric2 = pd.merge(forecast, df_veh_plate[["y", "ds"]], on="ds")
+  metric2 = metric2[metric2["y"].notna()]
+  r_sq_score = r2_score(metric2.y, metric2.yhat)
+
+  # Plots the results of the model, including the predictions.
+  fig = model.plot(forecast, uncertainty=False)
+  fig.subplots_adjust(bottom=0.22, top=0.95)
+  ax = fig.gca()
+  ax.tick_params(axis="x", labelrotation=90)
+  ax.set_xlabel("Date")
+  ax.set_ylabel("Temperature")
+  ax.set_title(f"Fit & Prediction. Prophet. {vehicle_plate}. R2 = " + str("%.2f" % r_sq_score))
+  ax.legend(["Real temp", "Predicted"])
+
+  # save the figure in 'saved_figures' folder and releases its memory.
+  fig.savefig(figure_path)
+  plt.close(fig)
+
+  return figure_path
+
+
+def render_fourier_ridge_figure(vehicle_plate, model, df_veh_plate, figure_path):
+  """
+  Saves the same figure for a model of the fourier_ridge backend, which has
+  neither history nor plot of its own.
+
+  Returns:
+    str : path of the saved figure.
+  """
+  from matplotlib import pyplot as plt
+  from sklearn.metrics import r2_score
+
+  # Predicts the training period and a 20% longer horizon.
+  last_date = df_veh_plate["ds"].max()
+  future_dates = pd.date_range(last_date, periods=int(len(df_veh_plate)*0.2) + 1, freq="0.3min")[1:]
+  fit = model.predict(df_veh_plate[["ds", "temp2"]])
+  forecast = model.predict(pd.DataFrame({"ds": future_dates}))
+  r_sq_score = r2_score(df_veh_plate["y"], fit["yhat"])
+
+  fig, ax = plt.subplots(figsize=(10, 6))
+  fig.subplots_adjust(bottom=0.22, top=0.95)
+  ax.plot(df_veh_plate["ds"], df_veh_plate["y"], "k.", markersize=2)
+  ax.plot(pd.concat([fit, forecast])["ds"], pd.concat([fit, forecast])["yhat"], color="#0072B2")
+  ax.tick_params(axis="x", labelrotation=90)
+  ax.set_xlabel("Date")
+  ax.set_ylabel("Temperature")
+  ax.set_title(f"Fit & Prediction. Fourier ridge. {vehicle_plate}. R2 = " + str("%.2f" % r_sq_score))
+  ax.legend(["Real temp", "Predicted"])
+
+  fig.savefig(figure_path)
+  plt.close(fig)
+
+  return figure_path
+
+
+class DiagnosticPlotter:
+  """
+  Sends the rendering of the diagnostic figures to a pool of worker processes.
+  The stage can be switched off, and the number of workers changed, in the
+  [diagnostics] section of config.ini.
+
+  Args:
+    bool (optional) : if False, no figure is rendered.
+    int (optional) : number of worker processes.
+  """
+  def __init__(self, enabled=None, workers=None):
+    if enabled is None:
+      enabled = parser.getboolean("diagnostics", "enabled", fallback=True)
+    if workers is None:
+      workers = parser.getint("diagnostics", "workers", fallback=1)
+    self.enabled = enabled
+    self.workers = workers
+    self.p_figures_folder = str(my_path)+parser.get("path_folder", "saved_figures")
+    self.executor = None
+    self.futures = {}
+
+
+  def submit(self, vehicle_plate, df_veh_plate):
+    """
+    Queues the figure of a trained vehicle model. It returns immediately.
+
+    Args:
+      str : vehicle plate.
+      pd.Dataframe : training data of the vehicle, with Prophet nomenclature.
+    """
+    if not self.enabled:
+      return
+    if self.executor is None:
+      self.executor = ProcessPoolExecutor(max_workers=self.workers)
+    self.futures[vehicle_plate] = self.executor.submit(render_diagnostic_figure,
+                                                      vehicle_plate,
+                                                      df_veh_plate[["ds", "y", "temp2"]].copy(),
+                                                      self.p_figures_folder.format(vehicle_plate))
+
+
+  def wait(self):
+    """
+    Waits for all the queued figures and shuts the worker pool down. A figure
+    that fails is reported but doesn't stop the rest.
+
+    Returns:
+      list : vehicle plates whose figure has been saved.
+    """
+    rendered = []
+    for vehicle_plate, future in self.futures.items():
+      try:
+        future.result()
+        rendered.append(vehicle_plate)
+      except Exception as error:
+        print(f"Figure for vehicle plate {vehicle_plate} could not be rendered: {error}")
+    self.futures = {}
+    if self.executor is not None:
+      self.executor.shutdown()
+      self.executor = None
+
+    return rendered
+
+
+  def render(self, main_df, vehicle_plates):
+    """
+    Renders on demand the figures of the selected vehicle plates, whose models
+    must have been saved previously.
+
+    Args:
+      pd.Dataframe : dataset with data of the vehicles, with Prophet nomenclature.
+      list : vehicle plates to plot.
+
+    Returns:
+      list : vehicle plates whose figure has been saved.
+    """
+    Path(self.p_figures_folder).parent.mkdir(parents=True, exist_ok=True)
+    for vehicle_plate in vehicle_plates:
+      df_veh_plate = main_df[main_df["vehicle_plate"] == vehicle_plate]
+      df_veh_plate = df_veh_plate.dropna(subset=["y", "temp2"])
+      if df_veh_plate.empty:
+        print(f"There is no data for vehicle plate {vehicle_plate}.")
+        continue
+      self.submit(vehicle_plate, df_veh_plate)
+
+    return self.wait()
+
+
+def main(vehicle_plates):
+  """
+  Renders the figures of the given vehicle plates from the saved main dataset.
+  """
+  main_dataset_path = str(my_path)+parser.get("path_folder", "main_dataset")+"/main_dataset.csv"
+  main_df = pd.read_csv(main_dataset_path, parse_dates=["date"])
+  main_df.rename(columns={"temp1": "y", "date": "ds"}, inplace=True)
+  plotter = DiagnosticPlotter(enabled=True)
+  for vehicle_plate in plotter.render(main_df, vehicle_plates):
+    print(f"Figure for vehicle plate {vehicle_plate} saved.")
+
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -0,0 +1,321 @@
+"""
+fourier_ridge.py
+This source code is part of temp-monitoring program.
+It contains a light alternative to the prophet models, written only with
+numpy: a piecewise-linear trend with changepoints, daily and weekly Fourier
+terms and the 'temp2' regressor, fitted by closed-form ridge regression. The
+penalties follow the priors of prophet, so the same hyperparameters
+(changepoint_prior_scale, changepoint_range, daily_seasonality and
+weekly_seasonality) have the same meaning. It also contains the
+leave-block-out cross validation used to tune it.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+DAY_SECONDS = 86400.0
+
+
+def to_seconds(dates):
+  """
+  Returns the dates as float seconds since the epoch.
+  """
+  return pd.to_datetime(pd.Series(dates)).dt.tz_localize(None).to_numpy(dtype="datetime64[ns]").astype("int64") / 1e9
+
+
+def get_fourier_terms(seconds, period, order):
+  """
+  Returns the sine and cosine terms of a seasonality, one column per term.
+
+  Args:
+    np.array : dates, as seconds since the epoch.
+    float : period of the seasonality, in seconds.
+    int : number of harmonics.
+
+  Returns:
+    np.array : matrix of shape (dates, 2 * order).
+  """
+  angles = 2 * np.pi * np.outer(seconds / period, np.arange(1, order + 1))
+
+  return np.hstack([np.sin(angles), np.cos(angles)])
+
+
+def solve_ridge(X, y, penalties):
+  """
+  Solves the ridge regression with a penalty per coefficient.
+
+  Returns:
+    np.array : coefficients.
+  """
+  return np.linalg.solve(X.T @ X + np.diag(penalties), X.T @ y)
+
+
+class FourierRidgeModel:
+  """
+  Additive model of the temperature of a vehicle, with the interface of the
+  prophet models used by the program: 'fit' receives the training entries
+  with Prophet nomenclature (ds, y and temp2) and 'predict' returns the
+  forecast with the columns ds and yhat.
+  The 'temp2' regressor enters as its difference with its own trend and
+  seasonality, so the entries without temp2 are predicted with the trend and
+  the seasonality alone. As prophet does with its automatic seasonalities, the
+  weekly one is only fitted if the history is at least two weeks long, as a
+  shorter one can't tell it from the trend.
+
+  Args:
+    float (optional) : scale of the prior of the changes of the trend.
+    float (optional) : proportion of the history where the changepoints are placed.
+    bool (optional) : if True, daily seasonality is added.
+    bool (optional) : if True, weekly seasonality is added.
+    int (optional) : number of changepoints.
+    int (optional) : harmonics of the daily seasonality.
+    int (optional) : harmonics of the weekly seasonality.
+    float (optional) : scale of the prior of the seasonalities and the regressor.
+  """
+  def __init__(self, changepoint_prior_scale=0.05, changepoint_range=0.8,
+               daily_seasonality=True, weekly_seasonality=True, n_changepoints=25,
+               daily_order=4, weekly_order=3, seasonality_prior_scale=10.0):
+    self.changepoint_prior_scale = changepoint_prior_scale
+    self.changepoint_range = changepoint_range
+    self.daily_seasonality = daily_seasonality
+    self.weekly_seasonality = weekly_seasonality
+    self.n_changepoints = n_changepoints
+    self.daily_order = daily_order
+    self.weekly_order = weekly_order
+    self.seasonality_prior_scale = seasonality_prior_scale
+    self.weekly_fitted = weekly_seasonality
+    self.t_start = 0.0
+    self.t_scale = 1.0
+    self.y_scale = 1.0
+    self.changepoints = np.array([])
+    self.coef = np.array([])
+    self.regressor_coef = None
+    self.regressor_base = np.array([])
+    self.regressor_scale = 1.0
+
+
+  def get_params(self):
+    """
+    Returns the arguments the model was created with.
+    """
+    return {"changepoint_prior_scale": self.changepoint_prior_scale,
+            "changepoint_range": self.changepoint_range,
+            "daily_seasonality": self.daily_seasonality,
+            "weekly_seasonality": self.weekly_seasonality,
+            "n_changepoints": self.n_changepoints,
+            "daily_order": self.daily_order,
+            "weekly_order": self.weekly_order,
+            "seasonality_prior_scale": self.seasonality_prior_scale}
+
+
+  def get_design(self, seconds):
+    """
+    Returns the matrix of the trend and the seasonalities for some dates.
+    """
+    t = (seconds - self.t_start) / self.t_scale
+    columns = [np.ones_like(t)[:, None], t[:, None],
+               np.maximum(t[:, None] - self.changepoints[None, :], 0)]
+    if self.daily_seasonality:
+      columns.append(get_fourier_terms(seconds, DAY_SECONDS, self.daily_order))
+    if self.weekly_fitted:
+      columns.append(get_fourier_terms(seconds, 7 * DAY_SECONDS, self.weekly_order))
+
+    return np.hstack(columns)
+
+
+  def get_penalties(self, n_columns, noise_var):
+    """
+    Returns the ridge penalty of every column of the design: the ratio of the
+    noise variance to the variance of the prior of the coefficient. The
+    intercept and the slope are not penalized.
+    """
+    penalties = np.full(n_columns, noise_var / self.seasonality_prior_scale ** 2)
+    penalties[:2] = 1e-9
+    penalties[2:2+len(self.changepoints)] = noise_var / self.changepoint_prior_scale ** 2
+
+    return penalties
+
+
+  def set_basis(self, seconds):
+    """
+    Sets the scale of the time, the changepoints and the seasonalities of the
+    design from the dates of the training entries.
+
+    Args:
+      np.array : dates, as seconds since the epoch.
+    """
+    self.t_start = seconds.min()
+    self.t_scale = max(seconds.max() - self.t_start, 1.0)
+    self.weekly_fitted = self.weekly_seasonality and self.t_scale >= 14 * DAY_SECONDS
+
+    # Changepoints placed uniformly through the first 'changepoint_range' of the
+    # entries, as prophet does.
+    order = np.argsort(seconds, kind="stable")
+    last = max(int(np.floor(len(seconds) * self.changepoint_range)) - 1, 0)
+    positions = np.unique(np.linspace(0, last, self.n_changepoints + 1).round().astype(int))[1:]
+    self.changepoints = (seconds[order][positions] - self.t_start) / self.t_scale
+
+
+  def fit(self, df):
+    """
+    Fits the model to the training entries. The noise variance of the
+    penalties is estimated with a first fit and the model is fitted again with it.
+
+    Args:
+      pd.Dataframe : entries with the columns ds, y and optionally temp2.
+
+    Returns:
+      FourierRidgeModel : the same model, fitted.
+    """
+    seconds = to_seconds(df["ds"])
+    y = df["y"].to_numpy(dtype="float64")
+    self.set_basis(seconds)
+    self.y_scale = max(np.abs(y).max(), 1e-9)
+    y = y / self.y_scale
+
+    X = self.get_design(seconds)
+    regressor = None
+    if "temp2" in df.columns and df["temp2"].notna().all():
+      temp2 = df["temp2"].to_numpy(dtype="float64") / self.y_scale
+      self.regressor_base = solve_ridge(X, temp2, self.get_penalties(X.shape[1], np.var(temp2) * 0.01 + 1e-9))
+      regressor = temp2 - X @ self.regressor_base
+      self.regressor_scale = max(regressor.std(), 1e-9)
+      X = np.hstack([X, (regressor / self.regressor_scale)[:, None]])
+
+    noise_var = np.var(y) * 0.01 + 1e-9
+    for _ in range(2):
+      coef = solve_ridge(X, y, self.get_penalties(X.shape[1], noise_var))
+      noise_var = np.mean((y - X @ coef) ** 2) + 1e-9
+    if regressor is not None:
+      self.coef, self.regressor_coef = coef[:-1], coef[-1]
+    else:
+      self.coef, self.regressor_coef = coef, None
+
+    return self
+
+
+  def predict(self, df):
+    """
+    Predicts the temperature of some dates. The regressor is used in the
+    entries with temp2.
+
+    Args:
+      pd.Dataframe : entries with the column ds and optionally temp2.
+
+    Returns:
+      pd.Dataframe : forecast with the columns ds and yhat.
+    """
+    seconds = to_seconds(df["ds"])
+    X = self.get_design(seconds)
+    yhat = X @ self.coef
+    if self.regressor_coef is not None and "temp2" in df.columns:
+      temp2 = df["temp2"].to_numpy(dtype="float64") / self.y_scale
+      regressor = (temp2 - X @ self.regressor_base) / self.regressor_scale
+      yhat = yhat + self.regressor_coef * np.nan_to_num(regressor)
+
+    return pd.DataFrame({"ds": pd.to_datetime(df["ds"]).to_numpy(),
+                         "yhat": yhat * self.y_scale})
+
+
+  def get_regressor_coefficients(self):
+    """
+    Returns the coefficient of the regressor, in temperature degrees per degree
+    of difference of temp2 with its trend and seasonality.
+    """
+    coef = np.nan if self.regressor_coef is None else self.regressor_coef / self.regressor_scale
+
+    return pd.DataFrame({"regressor": ["temp2"], "regressor_mode": ["additive"], "coef": [coef]})
+
+
+  def to_arrays(self):
+    """
+    Returns the fitted model as a dict of numpy arrays, to be saved in a .npz bundle.
+    """
+    meta = {"backend": "fourier_ridge",
+            "params": self.get_params(),
+            "weekly_fitted": self.weekly_fitted,
+            "t_start": self.t_start,
+            "t_scale": self.t_scale,
+            "y_scale": self.y_scale,
+            "regressor_coef": self.regressor_coef,
+            "regressor_scale": self.regressor_scale}
+
+    return {"meta": np.array(json.dumps(meta, default=float)),
+            "changepoints": self.changepoints,
+            "coef": self.coef,
+            "regressor_base": self.regressor_base}
+
+
+  @classmethod
+  def from_arrays(cls, arrays):
+    """
+    Rebuilds a fitted model from the arrays returned by 'to_arrays'.
+    """
+    meta = json.loads(str(arrays["meta"]))
+    model = cls(**meta["params"])
+    model.weekly_fitted = meta["weekly_fitted"]
+    model.t_start = meta["t_start"]
+    model.t_scale = meta["t_scale"]
+    model.y_scale = meta["y_scale"]
+    model.regressor_coef = meta["regressor_coef"]
+    model.regressor_scale = meta["regressor_scale"]
+    model.changepoints = arrays["changepoints"]
+    model.coef = arrays["coef"]
+    model.regressor_base = arrays["regressor_base"]
+
+    return model
+
+
+def get_metrics(y, yhat, horizon):
+  """
+  Returns the error metrics of some predictions, with the columns of prophet's
+  'performance_metrics'. The coverage is not calculated, as the model has no
+  uncertainty intervals.
+  """
+  errors = yhat - y
+  nonzero = y != 0
+  ape = np.abs(errors[nonzero] / y[nonzero])
+  metrics = {"horizon": [horizon],
+             "mse": [np.mean(errors ** 2)],
+             "rmse": [np.sqrt(np.mean(errors ** 2))],
+             "mae": [np.mean(np.abs(errors))],
+             "mape": [ape.mean() if len(ape) else np.nan],
+             "mdape": [np.median(ape) if len(ape) else np.nan],
+             "smape": [np.mean(2 * np.abs(errors) / np.maximum(np.abs(y) + np.abs(yhat), 1e-9))],
+             "coverage": [np.nan]}
+
+  return pd.DataFrame(metrics)
+
+
+def cross_validate_blocks(df, params, n_blocks=5, **model_kwargs):
+  """
+  Leave-block-out cross validation: the entries are split in 'n_blocks'
+  consecutive blocks of time, and every block is predicted by a model fitted
+  with the rest, as the missing temperatures are predicted inside the
+  history of the vehicle.
+
+  Args:
+    pd.Dataframe : entries with the columns ds, y and optionally temp2.
+    dict : hyperparameters of the model.
+    int (optional) : number of blocks.
+    **model_kwargs : other arguments of FourierRidgeModel.
+
+  Returns:
+    pd.Dataframe : one row with the metrics of all the predicted blocks.
+  """
+  df = df.sort_values("ds", kind="stable")
+  blocks = np.array_split(np.arange(len(df)), n_blocks)
+  y, yhat, durations = [], [], []
+  for block in blocks:
+    if not len(block):
+      continue
+    train = np.ones(len(df), dtype=bool)
+    train[block] = False
+    model = FourierRidgeModel(**params, **model_kwargs).fit(df.iloc[train])
+    y.append(df["y"].to_numpy(dtype="float64")[block])
+    yhat.append(model.predict(df.iloc[block])["yhat"].to_numpy())
+    durations.append(df["ds"].iloc[block[-1]] - df["ds"].iloc[block[0]])
+
+  return get_metrics(np.concatenate(y), np.concatenate(yhat), pd.Series(durations).median())
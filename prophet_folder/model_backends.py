@@ -0,0 +1,163 @@
+"""
+model_backends.py
+This source code is part of temp-monitoring program.
+It contains the backends that create, evaluate and fit the models of the
+vehicles for ProphetModel. The backend is selected with 'backend' in the
+[model_config] section of config.ini:
+'prophet' fits the models with prophet (cmdstanpy) and evaluates them with
+its cross validation. 'fourier_ridge' fits the numpy models of
+fourier_ridge.py, much faster, and evaluates them with a leave-block-out
+cross validation. Both use the same hyperparameters, and the saved models of
+both are loaded and used to predict in the same way.
+"""
+
+import numpy as np
+from configparser import ConfigParser
+
+from prophet_folder.fourier_ridge import FourierRidgeModel, cross_validate_blocks
+
+parser = ConfigParser()
+parser.read("config.ini")
+
+
+def select_folds(cutoffs, max_folds):
+  """
+  Returns at most 'max_folds' cutoffs, spread evenly through the history.
+  """
+  positions = np.unique(np.linspace(0, len(cutoffs) - 1, max_folds).round().astype(int))
+
+  return [cutoffs[position] for position in positions]
+
+
+class ProphetBackend:
+  """
+  Models fitted by prophet.
+  """
+  name = "prophet"
+
+
+  def evaluate(self, df_veh_plate, params, cv_kwargs):
+    """
+    Fits a model with the hyperparameters and the 'temp2' regressor and
+    evaluates it with prophet's cross validation. If 'max_folds' is among the
+    arguments, only that number of the cutoffs is used.
+
+    Args:
+      pd.Dataframe : training data of the vehicle, with Prophet nomenclature.
+      dict : hyperparameters of the model.
+      dict : arguments of 'cross_validation' (initial, period and horizon) and
+            optionally 'max_folds'.
+
+    Returns:
+      tuple : (performance metrics, regressor coefficients) dataframes.
+    """
+    # Prophet and its diagnostics tools are only imported when a model has to be
+    # trained, so loading this module doesn't pay for cmdstanpy.
+    from prophet import Prophet
+    from prophet.diagnostics import cross_validation, generate_cutoffs, performance_metrics
+    from prophet.utilities import regressor_coefficients
+
+    model = Prophet(**params)
+
+    # Adds regressors to the model.
+    model.add_regressor("temp2")
+    # model.add_regressor('ignition')
+    # model.add_regressor('interval_time')
+    # model.add_regressor('door1_status')
+    # model.add_regressor('temp2_status')
+
+    # Trains the model with the selected hyperparameters by vehcile.
+    model.fit(df_veh_plate)
+
+    cv_kwargs = dict(cv_kwargs)
+    max_folds = cv_kwargs.pop("max_folds", None)
+    if max_folds is not None:
+      cutoffs = generate_cutoffs(model.history, cv_kwargs["horizon"], cv_kwargs["initial"],
+                                 cv_kwargs["period"])
+      df_cv = cross_validation(model, horizon=cv_kwargs["horizon"], parallel="processes",
+                               cutoffs=select_folds(cutoffs, max_folds))
+    else:
+      df_cv = cross_validation(model, parallel="processes", **cv_kwargs)
+
+    df_perf = performance_metrics(df_cv, rolling_window=1).round(decimals=3)
+
+    return df_perf, regressor_coefficients(model)
+
+
+  def fit(self, df_veh_plate, best_params):
+    """
+    Fits the model of a vehicle with its best combination of hyperparameters.
+
+    Returns:
+      prophet.Prophet : fitted model.
+    """
+    from prophet import Prophet
+
+    # Generates a new model using the best combination of hyperparameters.
+    model = Prophet(changepoint_prior_scale=best_params["changepoint_prior_scale"],
+                    changepoint_range=best_params["changepoint_range"],
+                    daily_seasonality=best_params["daily_seasonality"],
+                    weekly_seasonality=best_params["weekly_seasonality"],
+                    )
+
+    # Trains the model on the corresponding vehicle dataframe.
+    model.fit(df_veh_plate)
+
+    return model
+
+
+class FourierRidgeBackend:
+  """
+  Numpy models of fourier_ridge.py. The number of changepoints, the harmonics
+  of the seasonalities and the blocks of the cross validation are read from
+  the [fourier_ridge] section of config.ini.
+  """
+  name = "fourier_ridge"
+
+  def __init__(self):
+    self.model_kwargs = {"n_changepoints": parser.getint("fourier_ridge", "n_changepoints", fallback=25),
+                         "daily_order": parser.getint("fourier_ridge", "daily_order", fallback=4),
+                         "weekly_order": parser.getint("fourier_ridge", "weekly_order", fallback=3),
+                         }
+    self.cv_blocks = parser.getint("fourier_ridge", "cv_blocks", fallback=5)
+
+
+  def evaluate(self, df_veh_plate, params, cv_kwargs):
+    """
+    Evaluates the hyperparameters with a leave-block-out cross validation. The
+    arguments of prophet's cross validation are not used, but 'max_folds'
+    limits the number of blocks.
+
+    Returns:
+      tuple : (performance metrics, regressor coefficients) dataframes.
+    """
+    n_blocks = min(self.cv_blocks, cv_kwargs.get("max_folds", self.cv_blocks))
+    df_perf = cross_validate_blocks(df_veh_plate, params, n_blocks, **self.model_kwargs)
+    model = FourierRidgeModel(**params, **self.model_kwargs).fit(df_veh_plate)
+
+    return df_perf.round(decimals=3), model.get_regressor_coefficients()
+
+
+  def fit(self, df_veh_plate, best_params):
+    """
+    Fits the model of a vehicle with its best combination of hyperparameters
+    and the 'temp2' regressor.
+
+    Returns:
+      FourierRidgeModel : fitted model.
+    """
+    return FourierRidgeModel(**best_params, **self.model_kwargs).fit(df_veh_plate)
+
+
+BACKENDS = {backend.name: backend for backend in [ProphetBackend, FourierRidgeBackend]}
+
+
+def get_backend(name=None):
+  """
+  Returns the backend selected in config.ini, or the one named.
+  """
+  name = name or parser.get("model_config", "backend", fallback="prophet")
+  if name not in BACKENDS:
+    raise ValueError(f"Unknown model backend '{name}'. Use one of {list(BACKENDS)}.")
+
+  return BACKENDS[name]()
@@ -0,0 +1,232 @@
+"""
+model_serializer.py
+This source code is part of temp-monitoring program.
+It contains the code to save and load the prophet model of every vehicle plate,
+either as the .json file written by prophet or as a compact binary .npz bundle.
+The models of the fourier_ridge backend are always saved as .npz bundles.
+"""
+
+import copy
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from configparser import ConfigParser
+
+from prophet_folder.fourier_ridge import FourierRidgeModel
+
+parser = ConfigParser()
+parser.read("config.ini")
+my_path = Path.cwd()
+
+NPZ_MAGIC = b"PK\x03\x04"
+
+
+class ModelSerializer:
+  """
+  Class in charge of writing and reading the prophet models. The format used
+  to save new models is selected in the [model_config] section of config.ini:
+  'json' uses prophet's model_to_json, 'npz' writes the fitted params, scaling
+  constants and seasonality specs as a binary numpy bundle. Models saved in any
+  of both formats can be loaded, whatever the format selected.
+
+  Args:
+    str (optional) : format used to save the models, 'json' or 'npz'.
+    bool (optional) : if False, the training history is dropped from .npz bundles.
+  """
+  def __init__(self, model_format=None, keep_history=None):
+    self.path_template = str(my_path)+parser.get("path_folder", "model_file")
+    if model_format is None:
+      model_format = parser.get("model_config", "model_format", fallback="json")
+    if keep_history is None:
+      keep_history = parser.getboolean("model_config", "keep_history", fallback=True)
+    if model_format not in ("json", "npz"):
+      raise ValueError(f"Unknown model format '{model_format}'. Use 'json' or 'npz'.")
+    self.model_format = model_format
+    self.keep_history = keep_history
+
+
+  def get_path(self, vehicle_plate, model_format=None):
+    """
+    Returns the path of the model file of a vehicle plate for the given format.
+
+    Args:
+      str : vehicle plate of the model.
+      str (optional) : format of the file. Defaults to the configured one.
+
+    Returns:
+      str : path of the model file.
+    """
+    model_format = model_format or self.model_format
+    path = Path(self.path_template.format(vehicle_plate))
+
+    return str(path.with_suffix("." + model_format))
+
+
+  def find_path(self, vehicle_plate):
+    """
+    Looks for a saved model of the vehicle plate, starting with the configured
+    format.
+
+    Returns:
+      str : path of the saved model, None if there is no model for the plate.
+    """
+    formats = [self.model_format] + [f for f in ("json", "npz") if f != self.model_format]
+    for model_format in formats:
+      path = self.get_path(vehicle_plate, model_format)
+      if Path(path).exists():
+        return path
+
+    return None
+
+
+  def exists(self, vehicle_plate):
+    """
+    Checks if a model has been saved for the vehicle plate in any format.
+    """
+    return self.find_path(vehicle_plate) is not None
+
+
+  def save(self, model, vehicle_plate):
+    """
+    Saves a fitted model of the vehicle plate with the configured format. The
+    files of a previous model in the other format are removed, so they are
+    never loaded instead of it.
+
+    Returns:
+      str : path of the saved model.
+    """
+    path = self.get_path(vehicle_plate)
+    if isinstance(model, FourierRidgeModel):
+      path = self.get_path(vehicle_plate, "npz")
+      with open(path, "wb") as model_file:
+        np.savez(model_file, **model.to_arrays())
+    elif self.model_format == "npz":
+      self.save_npz(model, path, self.keep_history)
+    else:
+      from prophet.serialize import model_to_json
+      with open(path, "w") as model_file:
+        model_file.write(model_to_json(model))
+    for model_format in ("json", "npz"):
+      old_path = Path(self.get_path(vehicle_plate, model_format))
+      if str(old_path) != path and old_path.exists():
+        old_path.unlink()
+
+    return path
+
+
+  def load(self, vehicle_plate):
+    """
+    Loads the saved model of the vehicle plate.
+
+    Returns:
+      prophet.Prophet : fitted model ready to predict.
+    """
+    path = self.find_path(vehicle_plate)
+    if path is None:
+      raise FileNotFoundError(f"There is no saved model for vehicle plate {vehicle_plate}.")
+
+    return self.load_file(path)
+
+
+  @classmethod
+  def load_file(cls, path):
+    """
+    Loads a model file, detecting if it is a .npz bundle or a .json file from
+    its first bytes.
+
+    Args:
+      str : path of the model file.
+
+    Returns:
+      prophet.Prophet : fitted model ready to predict.
+    """
+    with open(path, "rb") as model_file:
+      magic = model_file.read(len(NPZ_MAGIC))
+    if magic == NPZ_MAGIC:
+      return cls.load_npz(path)
+    from prophet.serialize import model_from_json
+    with open(path, "r") as model_file:
+      return model_from_json(model_file.read())
+
+
+  @staticmethod
+  def save_npz(model, path, keep_history=True):
+    """
+    Saves a fitted model as a .npz bundle. The stan params and the numeric
+    columns of the training history are stored as raw arrays, and the rest of
+    the attributes (scaling constants, changepoints, seasonalities and
+    regressors specs) as a small json header inside the bundle.
+    Text columns of the history are not used by prophet once the model is
+    fitted, so they are not saved.
+
+    Args:
+      prophet.Prophet : fitted model.
+      str : path of the .npz file.
+      bool : if False, the history is dropped. The model can still predict
+            new dates, but neither plot nor make_future_dataframe can be used.
+    """
+    from prophet.serialize import model_to_dict
+
+    # Serializes everything but the history and the params with prophet itself.
+    light_model = copy.copy(model)
+    light_model.history = model.history.iloc[:0]
+    light_model.history_dates = model.history_dates.iloc[:0]
+    meta = model_to_dict(light_model)
+    params = meta.pop("params")
+    arrays = {"params__" + name: np.asarray(value) for name, value in params.items()}
+
+    history_columns = []
+    if keep_history:
+      for column in model.history.columns:
+        values = model.history[column]
+        if pd.api.types.is_datetime64_any_dtype(values):
+          arrays["history__" + column] = values.to_numpy(dtype="datetime64[ns]").view("int64")
+          history_columns.append([column, "datetime64[ns]"])
+        elif pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+          arrays["history__" + column] = values.to_numpy()
+          history_columns.append([column, str(values.dtype)])
+      arrays["history_dates"] = model.history_dates.to_numpy(dtype="datetime64[ns]").view("int64")
+    meta["history_columns"] = history_columns
+    meta["keep_history"] = keep_history
+
+    with open(path, "wb") as model_file:
+      np.savez(model_file, meta=np.array(json.dumps(meta)), **arrays)
+
+
+  @staticmethod
+  def load_npz(path):
+    """
+    Loads a model saved with 'save_npz', or a model of the fourier_ridge backend.
+
+    Args:
+      str : path of the .npz file.
+
+    Returns:
+      prophet.Prophet or FourierRidgeModel : fitted model ready to predict.
+    """
+    with np.load(path, allow_pickle=False) as bundle:
+      meta = json.loads(str(bundle["meta"]))
+      if meta.get("backend") == "fourier_ridge":
+        return FourierRidgeModel.from_arrays(bundle)
+      from prophet.serialize import model_from_dict
+
+      history_columns = meta.pop("history_columns")
+      keep_history = meta.pop("keep_history")
+      meta["params"] = {}
+      model = model_from_dict(meta)
+      model.params = {name[len("params__"):]: bundle[name] for name in bundle.files
+                      if name.startswith("params__")}
+
+      if keep_history:
+        history = {}
+        for column, dtype in history_columns:
+          values = bundle["history__" + column]
+          if dtype.startswith("datetime64"):
+            values = values.view(dtype)
+          history[column] = values
+        model.history = pd.DataFrame(history)
+        model.history_dates = pd.Series(bundle["history_dates"].view("datetime64[ns]"), name="ds")
+
+    return model
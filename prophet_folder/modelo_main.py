@@ -13,15 +13,16 @@ from pathlib import Path
 from datetime import datetime
 
 import pandas as pd
-from prophet import Prophet
-from matplotlib import pyplot as plt
-from sklearn.metrics import r2_score
-from prophet.diagnostics import cross_validation, performance_metrics
-from prophet.serialize import model_to_json
-from prophet.utilities import regressor_coefficients
 import numpy as np
 from configparser import ConfigParser
 
+from prophet_folder.model_serializer import ModelSerializer
+from prophet_folder.cv_cache import CVCache
+from prophet_folder.diagnostic_plots import DiagnosticPlotter
+from prophet_folder.model_backends import get_backend
+from prophet_folder.vehicle_clusters import VehicleClusters, clusters_enabled
+from data.instrumentation import PipelineTracer
+
 warnings.simplefilter('ignore')
 parser = ConfigParser()
 parser.read("config.ini")
@@ -30,20 +31,28 @@ my_path = Path.cwd()
 class ProphetModel:
   """
   Receives a dataset and prepares the data before sending it to the Prophet
-  algorithm to create the best model for every vehicle plate.
+  algorithm to create the best model for every vehicle plate or, if the
+  clusters are enabled in config.ini, for every cluster of similar vehicles.
+  The models are fitted by the backend selected in config.ini.
   
   Args:
     pd.Dataframe : dataframe where to run the model from.  
+    PipelineTracer (optional) : tracer that measures the training of every vehicle.
   """
-  def __init__(self, main_df):
+  def __init__(self, main_df, tracer=None):
     self.main_df = self.rename_features(main_df)
+    self.tracer = tracer or PipelineTracer(enabled=False)
     self.create_folders()
     self.p_best_params = str(my_path)+parser.get("path_folder", "best_params")
     self.p_regrs_coef_path = str(my_path)+parser.get("path_folder", "regressors_coef")
-    self.p_model_file = str(my_path)+parser.get("path_folder", "model_file")
-    self.p_figures_folder = str(my_path)+parser.get("path_folder", "saved_figures")
+    self.backend = get_backend()
+    self.tuning_mode = parser.get("tuning", "mode", fallback="full")
+    self.serializer = ModelSerializer()
+    self.cv_cache = CVCache()
+    self.plotter = DiagnosticPlotter()
     self.perf_metrics = str(my_path)+parser.get("path_folder", "perf_metrics")
     self.timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
+    self.clusters = VehicleClusters().update(self.main_df) if clusters_enabled() else None
     
   @staticmethod
   def create_folders():
@@ -52,7 +61,8 @@ class ProphetModel:
     where the different files will be saved.
     """
     config_value_list = ["regressors_coef", "best_params", 
-                          "model_file", "perf_metrics", "saved_figures"]
+                          "model_file", "perf_metrics", "saved_figures",
+                          "cv_cache"]
     for value in config_value_list:
       value_path = parser.get("path_folder", value)
       value_path_folder = Path(value_path).parents[0]
@@ -79,137 +89,259 @@ class ProphetModel:
     return main_df
   
 
+  @staticmethod
+  def get_param_combinations():
+    """
+    Returns every combination of hyperparameters evaluated in the tuning.
+    """
+    # Dictionary of the values of the hyperparametrs to be used in the model.
+    param_grid = {"changepoint_prior_scale": [0.001, 0.01, 0.1],
+                  "changepoint_range": [0.75, 0.8, 0.85],
+                  "daily_seasonality": [True, False],
+                  "weekly_seasonality": [True, False],
+                  }
+
+    # Generates all possible combinations of hyperparameters.
+    all_params = [dict(zip(param_grid.keys(), v)) for v in\
+                       itertools.product(*param_grid.values())]
+
+    return all_params
+
+
+  def get_model_keys(self, veh_plates):
+    """
+    Returns the models to train for the vehicle plates: one per vehicle, or
+    one per cluster and per override if the clusters are enabled.
+    """
+    if self.clusters is None:
+      return list(veh_plates)
+
+    return self.clusters.get_model_keys(veh_plates)
+
+
+  def get_vehicle_df(self, veh_plate):
+    """
+    Returns the entries of a vehicle used to train its model, the ones with
+    both temperatures. For the model of a cluster, the entries of all its
+    vehicles are returned, without their offsets.
+    """
+    if self.clusters is not None and self.clusters.is_cluster(veh_plate):
+      return self.clusters.get_training_df(self.main_df, veh_plate)
+    df_veh_plate = self.main_df[self.main_df["vehicle_plate"] == veh_plate]
+
+    return df_veh_plate.dropna(subset=["y", "temp2"])
+
+
   def run_model(self):
     """
-    Detects if a model has been saved for each vehicle.
+    Detects if a model has been saved for each vehicle, or for each cluster.
     If a model doesn't exits for a vehicle, it is generated with the best
     comnination of hyperpareters and saved.
     """
-    # Iterates for every vehicle plate in the dataset. 
-    for veh_plate in self.main_df["vehicle_plate"].unique():
-      if Path((self.p_model_file).format(veh_plate)).exists():
+    # Iterates for every vehicle plate, or cluster, in the dataset. 
+    for veh_plate in self.get_model_keys(self.main_df["vehicle_plate"].dropna().unique()):
+      if self.serializer.exists(veh_plate):
         print(f"Model for vehicle plate {veh_plate} already exists.")
         continue
       
       else:
-        df_veh_plate = self.main_df[self.main_df["vehicle_plate"] == veh_plate]
-        df_veh_plate.dropna(subset=["y", "temp2"], inplace=True)
-        duration_plate_days = (df_veh_plate["ds"].iloc[-1] - df_veh_plate["ds"].iloc[0])
-        
-        # Dictionary of the values of the hyperparametrs to be used in the model.
-        param_grid = {"changepoint_prior_scale": [0.001, 0.01, 0.1],
-                      "changepoint_range": [0.75, 0.8, 0.85],
-                      "daily_seasonality": [True, False],
-                      "weekly_seasonality": [True, False],
-                      }
-
-        # Generates all possible combinations of hyperparameters.
-        all_params = [dict(zip(param_grid.keys(), v)) for v in\
-                           itertools.product(*param_grid.values())]
-      
-        rmses = []  
-        # Loop that runs through all the combinations of hyperparameters for each vehicle.
-        df_full_metrics = pd.DataFrame()
-        for params in all_params:
-          model = Prophet(**params)
-          
-          # Adds regressors to the model.
-          model.add_regressor("temp2")
-          # model.add_regressor('ignition')
-          # model.add_regressor('interval_time')
-          # model.add_regressor('door1_status')
-          # model.add_regressor('temp2_status')
-          
-          # Trains the model with the selected hyperparameters by vehcile. 
-          model.fit(df_veh_plate)  
-          
-          # Cross validation. Parameters are scaled to the number of
-          # entries in the dataframe.
-          df_cv = cross_validation(model, 
-                                  initial = duration_plate_days*0.3, 
-                                  period=duration_plate_days*0.1, 
-                                  horizon=duration_plate_days*0.1, 
-                                  parallel="processes")
-
-          df_perf = performance_metrics(df_cv, rolling_window=1).round(
-                                                                    decimals=3)              
-          df_full_metrics = pd.concat([df_full_metrics, df_perf], 
-                                      ignore_index=True)  # nuevo
-
-          # Creates a list that holds the rmse for each combination of hyperparemeters
-          # of the model.
-          rmses.append(df_perf["rmse"].values[0])
-
-        # Saves the metrics of each parameter in a .csv
-        tuning_results = pd.DataFrame(all_params)
-        tuning_results = pd.concat([tuning_results, df_full_metrics], axis=1, 
-                                  ignore_index=True)
-        tuning_results.insert(0, "timestamp", self.timestamp)
-        columns = ["timestamp", "changepoint_prior_scale", "changepoint_range",
-                  "daily_seasonality", "weekly_seasonality", "horizon","mse", 
-                  "rmse", "mae", "mape", "mdape", "smape", "coverage"]
-        tuning_results.columns = columns
-        tuning_results.to_csv(self.perf_metrics.format(veh_plate), 
-                              mode="a",)
-
-        # Displays the results of the RMSE of all the combination of 
-        # hyperparameters in the terminal.
-        print("="*70)
-        print(tuning_results[["changepoint_prior_scale", "changepoint_range",
-                  "daily_seasonality", "weekly_seasonality", "rmse"]])
-
-        # Selects the combination of hyperparameters with the lowest RMSE score and
-        # returns it to the terminal.
-        best_params = all_params[np.argmin(rmses)]
-        print("\nBest parameters for {vplate}:\n{params}".format(vplate=veh_plate,
-                                                            params=best_params))
-        print("="*70)
-
-        # Saves the correlation coefficients of each regressor to a .txt
-        reg_coef = regressor_coefficients(model)
-        with open (self.p_regrs_coef_path.format(veh_plate), "w") as reg_txt:
-          reg_txt.write(str(reg_coef))
-
-        # Saves the best combination of hyperparameters in a .json
-        with open((self.p_best_params).format(veh_plate), "w") as param_file:
-          param_file.write(json.dumps(best_params))
-        
-        # Generates a new model using the best combination of hyperparameters.
-        model = Prophet(changepoint_prior_scale=best_params["changepoint_prior_scale"], 
-                        changepoint_range=best_params["changepoint_range"], 
-                        daily_seasonality=best_params["daily_seasonality"], 
-                        weekly_seasonality=best_params["weekly_seasonality"],
-                        )
-
-        # Trains the model on the corresponding vehicle dataframe, creating predictions
-        # and plotting the results.
-        model.fit(df_veh_plate)
-
-        # Saves the current model in a .json file. Each vehicle has its own file
-        # which will be used in prediction_maker to precit the missing temperature data.
-        with open((self.p_model_file).format(veh_plate), "w") as model_file:
-          model_file.write(model_to_json(model))
-
-        # Makes future predictions.
-        future_periods = model.make_future_dataframe(periods=int(len(df_veh_plate)*0.2), 
-                                                    freq="0.3min")
-        forecast = model.predict(future_periods)
-        forecast = forecast[["ds", "yhat", "yhat_lower", "yhat_upper"]]
-
-        # Combines the results of these predictions to the corresponding
-        # vehicle dataframe.
-        metric2 = pd.merge(forecast, self.main_df[["y", "ds"]], on="ds")
-        metric2 = metric2[metric2["y"].notna()]
-        r_sq_score = r2_score(metric2.y, metric2.yhat)
-        
-        # Plots the results of the model, including the predictions.
-        fig = model.plot(forecast, uncertainty=False)
-        fig.subplots_adjust(bottom=0.22, top=0.95)
-        plt.xticks(rotation=90)
-        plt.xlabel("Date")
-        plt.ylabel("Temperature")
-        plt.title(f"Fit & Prediction. Prophet. {veh_plate}. R2 = " + str("%.2f" % r_sq_score))
-        plt.legend(["Real temp", "Predicted"])
-
-        # save the figure in 'saved_figures' folder.
-        plt.savefig(self.p_figures_folder.format(veh_plate))
\ No newline at end of file
+        with self.tracer.span("train.vehicle", vehicle_plate=veh_plate):
+          best_params = self.tune_vehicle(veh_plate)
+          self.train_vehicle(veh_plate, best_params)
+
+    # Waits for the pending figures before finishing.
+    with self.tracer.span("train.figures"):
+      self.plotter.wait()
+
+
+  @staticmethod
+  def decimate(df_veh_plate, frequency):
+    """
+    Returns the means of the temperatures of every 'frequency' period, as
+    entries dated at the start of the period.
+    """
+    df_decimated = df_veh_plate.groupby(df_veh_plate["ds"].dt.floor(frequency))[["y", "temp2"]].mean()
+
+    return df_decimated.reset_index()
+
+
+  def get_tuning_data(self, veh_plate, tuning_mode=None):
+    """
+    Returns the entries and the cross validation arguments used to tune the
+    model of a vehicle. In 'decimated' mode, the entries are the means of
+    every 'frequency' of the [tuning] section of config.ini, and the cross
+    validation is limited to its 'max_folds' folds.
+
+    Args:
+      str : vehicle plate.
+      str (optional) : 'full' or 'decimated'. Defaults to the one in config.ini.
+
+    Returns:
+      tuple : (entries with Prophet nomenclature, cross validation arguments).
+    """
+    tuning_mode = tuning_mode or self.tuning_mode
+    if tuning_mode not in ("full", "decimated"):
+      raise ValueError(f"Unknown tuning mode '{tuning_mode}'. Use 'full' or 'decimated'.")
+    df_veh_plate = self.get_vehicle_df(veh_plate)
+    if tuning_mode == "decimated":
+      df_veh_plate = self.decimate(df_veh_plate, parser.get("tuning", "frequency", fallback="15min"))
+    duration_plate_days = (df_veh_plate["ds"].iloc[-1] - df_veh_plate["ds"].iloc[0])
+
+    # Cross validation parameters are scaled to the number of
+    # entries in the dataframe.
+    cv_kwargs = {"initial": duration_plate_days*0.3, 
+                 "period": duration_plate_days*0.1, 
+                 "horizon": duration_plate_days*0.1,
+                 }
+    if tuning_mode == "decimated":
+      cv_kwargs["max_folds"] = parser.getint("tuning", "max_folds", fallback=3)
+
+    return df_veh_plate, cv_kwargs
+
+
+  def evaluate_params(self, veh_plate, df_veh_plate, cv_kwargs, on_params_done=None):
+    """
+    Evaluates every combination of hyperparameters for a vehicle with cross
+    validation. Every run is saved in the cross validation cache as soon as it
+    finishes, so if the tuning stops it continues from the last finished run.
+
+    Args:
+      str : vehicle plate.
+      pd.Dataframe : entries used to tune the model.
+      dict : cross validation arguments.
+      function (optional) : called with the hyperparameters and the RMSE of
+                            every finished run.
+
+    Returns:
+      tuple : (metrics of every combination, list of their RMSE, regressor
+              coefficients of the last one, number of runs read from the cache).
+    """
+    rmses = []  
+    cache_hits = 0
+    # Loop that runs through all the combinations of hyperparameters for each vehicle.
+    df_full_metrics = pd.DataFrame()
+    for params in self.get_param_combinations():
+      # Reuses the cross validation results if the same vehicle data has already
+      # been evaluated with these hyperparameters.
+      cache_key = self.cv_cache.get_key(df_veh_plate, veh_plate, params,
+                                        backend=self.backend.name, **cv_kwargs)
+      cached_run = self.cv_cache.get(cache_key)
+      if cached_run is not None:
+        df_perf, reg_coef = cached_run
+        cache_hits += 1
+
+      else:
+        # Trains a model with the selected hyperparameters by vehcile and
+        # evaluates it with the cross validation of the backend.
+        df_perf, reg_coef = self.backend.evaluate(df_veh_plate, params, cv_kwargs)
+        self.cv_cache.put(cache_key, veh_plate, params, df_perf, reg_coef, 
+                          self.timestamp)
+
+      df_full_metrics = pd.concat([df_full_metrics, df_perf], 
+                                  ignore_index=True)  # nuevo
+
+      # Creates a list that holds the rmse for each combination of hyperparemeters
+      # of the model.
+      rmses.append(df_perf["rmse"].values[0])
+      if on_params_done is not None:
+        on_params_done(params, float(rmses[-1]))
+
+    return df_full_metrics, rmses, reg_coef, cache_hits
+
+
+  def tune_vehicle(self, veh_plate, on_params_done=None):
+    """
+    Evaluates every combination of hyperparameters for a vehicle with cross
+    validation and saves the results, the regressor coefficients and the best
+    combination. In 'decimated' mode, the combinations are evaluated with the
+    decimated entries, and only the final training uses the full resolution.
+
+    Args:
+      str : vehicle plate.
+      function (optional) : called with the hyperparameters and the RMSE of
+                            every finished run.
+
+    Returns:
+      dict : best combination of hyperparameters.
+    """
+    with self.tracer.span("tune.vehicle", vehicle_plate=veh_plate) as span:
+      df_veh_plate, cv_kwargs = self.get_tuning_data(veh_plate)
+      span["rows_in"] = len(df_veh_plate)
+
+      all_params = self.get_param_combinations()
+      df_full_metrics, rmses, reg_coef, span["cv_cache_hits"] = self.evaluate_params(
+                                          veh_plate, df_veh_plate, cv_kwargs, on_params_done)
+
+      # Saves the metrics of each parameter in a .csv
+      tuning_results = pd.DataFrame(all_params)
+      tuning_results = pd.concat([tuning_results, df_full_metrics], axis=1, 
+                                ignore_index=True)
+      tuning_results.insert(0, "timestamp", self.timestamp)
+      columns = ["timestamp", "changepoint_prior_scale", "changepoint_range",
+                "daily_seasonality", "weekly_seasonality", "horizon","mse", 
+                "rmse", "mae", "mape", "mdape", "smape", "coverage"]
+      tuning_results.columns = columns
+      tuning_results.to_csv(self.perf_metrics.format(veh_plate), 
+                            mode="a",)
+
+      # Displays the results of the RMSE of all the combination of 
+      # hyperparameters in the terminal.
+      print("="*70)
+      print(tuning_results[["changepoint_prior_scale", "changepoint_range",
+                "daily_seasonality", "weekly_seasonality", "rmse"]])
+
+      # Selects the combination of hyperparameters with the lowest RMSE score and
+      # returns it to the terminal.
+      best_params = all_params[np.argmin(rmses)]
+      print("\nBest parameters for {vplate}:\n{params}".format(vplate=veh_plate,
+                                                          params=best_params))
+      print("="*70)
+
+      # Saves the correlation coefficients of each regressor to a .txt
+      with open (self.p_regrs_coef_path.format(veh_plate), "w") as reg_txt:
+        reg_txt.write(str(reg_coef))
+
+      # Saves the best combination of hyperparameters in a .json
+      with open((self.p_best_params).format(veh_plate), "w") as param_file:
+        param_file.write(json.dumps(best_params))
+
+    return best_params
+
+
+  def get_best_params(self, veh_plate):
+    """
+    Returns the best combination of hyperparameters saved by the tuning of a vehicle.
+    """
+    with open((self.p_best_params).format(veh_plate), "r") as param_file:
+      best_params = json.load(param_file)
+
+    return best_params
+
+
+  def train_vehicle(self, veh_plate, best_params=None):
+    """
+    Trains the model of a vehicle with its best combination of hyperparameters,
+    saves it and queues its diagnostic figure.
+
+    Args:
+      str : vehicle plate.
+      dict (optional) : hyperparameters. Defaults to the ones saved by the tuning.
+    """
+    if best_params is None:
+      best_params = self.get_best_params(veh_plate)
+    with self.tracer.span("fit.vehicle", vehicle_plate=veh_plate) as span:
+      df_veh_plate = self.get_vehicle_df(veh_plate)
+      span["rows_in"] = len(df_veh_plate)
+
+      # Generates and trains a new model using the best combination of
+      # hyperparameters.
+      model = self.backend.fit(df_veh_plate, best_params)
+
+      # Saves the current model in a .json or .npz file, as set in config.ini. Each
+      # vehicle has its own file which will be used in prediction_maker to precit
+      # the missing temperature data.
+      self.serializer.save(model, veh_plate)
+
+    # Queues the diagnostic figure of the model, which is rendered by a background
+    # worker while the next vehicle is trained.
+    self.plotter.submit(veh_plate, df_veh_plate)
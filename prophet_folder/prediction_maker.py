@@ -9,9 +9,12 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 
-from prophet.serialize import model_from_json
 from configparser import ConfigParser
 
+from prophet_folder.channel_imputer import PREDICTED_COLUMNS, ChannelImputer
+from prophet_folder.model_serializer import ModelSerializer
+from prophet_folder.vehicle_clusters import get_model_route
+
 parser = ConfigParser()
 parser.read("config.ini")
 my_path = Path.cwd()
@@ -23,31 +26,36 @@ class PredictTempForNaN:
   and the dataset with all the entries. The class makes predictions of missing temeperature
   data for corrresponding dates using the saved model for this vehicle. The end result is a dataframe
   for each vehicle that includes the dates that had missing values and the corresponding 
-  temperature prediction.
+  temperature prediction. If the clusters are enabled, the model of the cluster of the
+  vehicle is used, and the offset of the vehicle added to its predictions. If the
+  entries of the vehicle are passed, its other temperature probes are imputed too,
+  in the predicted_temp2/3/4 columns.
 
   Args: 
     pd.Dataframe : dataframe with data filtered per vehicle plate.
     string : vehicle plate that will be used to load the saved prophet model.
+    pd.Dataframe (optional) : all the entries of the vehicle, used to fit its
+                            other probes with channel_imputer.py.
   """
-  def __init__(self, df, vehicle_plate):
+  def __init__(self, df, vehicle_plate, df_history=None):
     # self.config = Config()
     self.df = df
     self.vehicle_plate = vehicle_plate
+    self.model_key, self.offset = get_model_route(vehicle_plate)
+    self.channel_imputer = ChannelImputer(df_history) if df_history is not None else None
     self.model = self.prophet_model_loader()
     self.predict_result = self.get_prediction()
 
   
   def prophet_model_loader(self):
     """
-    Opens the corresponding prophet model for the selected vehicle plate. The path is allocated in the 
-    'self.config' instance variable.
+    Opens the corresponding prophet model for the selected vehicle plate, or for its
+    cluster. Models saved either as .json or .npz files are understood.
     
     Returns:
       prophet.model.object : 
     """
-    absolute_path = str(my_path)+parser.get("path_folder", "model_file")
-    with open(absolute_path.format(self.vehicle_plate), 'r') as fin:
-      model = model_from_json(fin.read())
+    model = ModelSerializer().load(self.model_key)
 
     return model
 
@@ -55,19 +63,34 @@ class PredictTempForNaN:
   def get_prediction(self):
     """
     Passes a dataframe with the entries is going to be predicted. Returns the predictions made by the model for the missing temperature 
-    data for the vehicle.
+    data for the vehicle. Only the entries without temp1 are predicted by its model,
+    and the other probes are predicted in the entries without them.
 
     Returns:
       pd.Dataframe : dataframe with the predicted temp.
     """
-    # Prepares the dataframe
-    df_dates = self.df.loc[:,"ds"].to_frame(name="ds")
+    # Prepares the dataframe. The models of the fourier_ridge backend use temp2
+    # when it is known, and prophet models ignore it.
+    df_temp1 = self.df[self.df["y"].isna()] if "y" in self.df.columns else self.df
+    df_dates = df_temp1.loc[:,[column for column in ["ds", "temp2"] if column in self.df.columns]]
 
     # Makes a prediction
-    forecast = self.model.predict(df_dates)
+    if df_dates.empty:
+      forecast = pd.DataFrame({"ds": pd.Series(dtype="datetime64[ns]"), "yhat": pd.Series(dtype="float64")})
+    else:
+      forecast = self.model.predict(df_dates)
 
     # Substract columns 'ds' and 'yhat' for the predicted dataframe
     predict_result = forecast[['ds','yhat']]
+    predict_result['yhat'] = predict_result['yhat'] + self.offset
+
+    # Adds the predictions of the other probes, all of them made at once.
+    if self.channel_imputer is not None and self.channel_imputer.channels:
+      channels_result = self.channel_imputer.predict(self.df).round(1)
+      channels_result["ds"] = pd.to_datetime(self.df["ds"]).dt.tz_localize(None)
+      channels_result = channels_result.dropna(how="all", subset=channels_result.columns[:-1])
+      predict_result["ds"] = pd.to_datetime(predict_result["ds"]).dt.tz_localize(None)
+      predict_result = predict_result.merge(channels_result, on="ds", how="outer", sort=True)
 
     # Create a new attribute with the vehicle plate and prepare the dataframe to be returned.
     predict_result['vehicle_plate'] = self.vehicle_plate
@@ -85,16 +108,81 @@ class MergePredictions:
   """
   Class that takes the predictions for all the vehicles (concatenated in one file)
   and merges them into the main dataset. Ensures that all the predictions are in one
-  column (named predicted_temp). Renames columns to ensure coherent naming. The final
-  database only includes the relevant columns.
+  column (named predicted_temp), and the ones of the other probes in predicted_temp2/3/4.
+  Renames columns to ensure coherent naming. The final database only includes the
+  relevant columns.
   
   Args:
     pd.Dataframe : dataframe with predictions made previously.
     pd.Dataframe : main_dataset with temp data and empy temp entries.
+    str (optional) : 'aligned' writes the predictions into the main dataset in place,
+                    'outer' merges both dataframes with an outer join.
   """
-  def __init__(self, predictions, main_df):
+  columns = ["date", "vehicle_plate", "vehicle_id", 
+             "date_flag", "temp1", "temp2", "temp3", "temp4", "ignition", 
+             "interval_time", "hour", "day_of_week",
+             "predicted_temp", "predicted_temp2", "predicted_temp3", "predicted_temp4"]
+
+  def __init__(self, predictions, main_df, method="aligned"):
     self.prediction = predictions
-    self.df = self.rename_columns(main_df)
+    if method == "aligned":
+      self.df = self.align_predictions(main_df)
+    elif method == "outer":
+      self.df = self.rename_columns(main_df)
+    else:
+      raise ValueError(f"Unknown merge method '{method}'. Use 'aligned' or 'outer'.")
+
+
+  def align_predictions(self, df):
+    """
+    Writes the predictions into the main dataset, locating the row of every
+    prediction by its vehicle plate and date. The dataset is modified in place,
+    one column at a time, so no second copy of it is created.
+
+    Args:
+      pd.Dataframe : dataframe with all the entries, one per vehicle plate and date.
+
+    Returns: 
+      pd.Dataframe : the same dataframe with the predictions and only the relevant columns.
+    """
+    df.rename(columns={"ds": "date", "y": "temp1"}, inplace=True)
+    df["date"] = pd.to_datetime(df["date"]).dt.tz_localize(None)
+    prediction_dates = pd.to_datetime(self.prediction["date"]).dt.tz_localize(None)
+
+    # Finds the position in the dataset of every (vehicle plate, date) predicted.
+    dataset_index = pd.MultiIndex.from_arrays([df["vehicle_plate"], df["date"]])
+    if not dataset_index.is_unique:
+      raise ValueError("The main dataset has more than one entry for the same vehicle plate and date.")
+    positions = dataset_index.get_indexer(
+                  pd.MultiIndex.from_arrays([self.prediction["vehicle_plate"], prediction_dates]))
+    found = positions >= 0
+
+    # Writes the predictions over the previous ones, one predicted column at a
+    # time. The entries predicted for one probe only leave the others as they were.
+    predicted_columns = [column for column in PREDICTED_COLUMNS.values() if column in self.prediction.columns]
+    for column in predicted_columns:
+      if column in df.columns:
+        predicted = df[column].to_numpy(dtype="float64", copy=True)
+      else:
+        predicted = np.full(len(df), np.nan)
+      values = self.prediction[column].to_numpy(dtype="float64")
+      written = found & ~np.isnan(values)
+      predicted[positions[written]] = values[written]
+      df[column] = predicted
+
+    # Keeps only the relevant columns.
+    df.drop(columns=[column for column in df.columns if column not in self.columns], inplace=True)
+    for column in self.columns:
+      if column not in df.columns:
+        df[column] = np.nan
+
+    # Predictions for dates that are not in the dataset are added as new entries.
+    if not found.all():
+      missing = self.prediction.loc[~found, ["date", "vehicle_plate"] + predicted_columns].copy()
+      missing["date"] = prediction_dates[~found]
+      df = pd.concat([df, missing], ignore_index=True)
+
+    return df
 
 
   def rename_columns(self, df):
@@ -113,22 +201,19 @@ class MergePredictions:
     df["date"] = pd.to_datetime(df["date"]).dt.tz_localize(None)
     merged_df = pd.merge(self.prediction, df,  how='outer', left_on=['date', 'vehicle_plate'], right_on=['date', 'vehicle_plate'])
     merged_df['temp1'] = merged_df['y']
-    merged_df["predicted_temp"] = np.nan
-    merged_df["predicted_temp"].fillna(merged_df["predicted_temp_x"], inplace=True)
-    merged_df["predicted_temp"].fillna(merged_df["predicted_temp_y"], inplace=True)
+    # The predicted columns of both dataframes are combined, the new
+    # predictions first.
+    for column in PREDICTED_COLUMNS.values():
+      if column + "_x" in merged_df.columns:
+        merged_df[column] = merged_df[column + "_x"].fillna(merged_df[column + "_y"])
     merged_df.rename(columns={"ignition_y": "ignition",
                           "temp2_y":"temp2", 
                           "interval_time_y":"interval_time",
                           "hour_y":"hour", 
                           "day_of_week_y":"day_of_week",
-                          "predicted_temp2_x":"predicted_temp2",
                           "vehicle_id_y":"vehicle_id", 
                           }, 
                       inplace=True)
-    merged_df = merged_df[["date", "vehicle_plate", "vehicle_id", 
-                          "date_flag", "temp1", "temp2", "ignition", 
-                          "interval_time", "hour", "day_of_week",
-                          "predicted_temp", "predicted_temp2"]
-                          ]
+    merged_df = merged_df.reindex(columns=self.columns)
     
     return merged_df
\ No newline at end of file
@@ -0,0 +1,354 @@
+"""
+vehicle_clusters.py
+This source code is part of temp-monitoring program.
+It contains the code to group the vehicles with a similar temperature profile
+(setpoint, mean temperature of every hour of the day and variance), so one
+model is tuned and trained per cluster instead of one per vehicle. Every
+vehicle keeps an offset, the difference between its mean temperature and the
+one of its cluster, which is removed from its entries to train the model of
+the cluster and added back to its predictions. The vehicles listed as
+overrides keep a model of their own. The clusters are saved in 'cluster_file'
+and can be fitted again, and the distance of every vehicle to its cluster
+shown, from the root folder of the project:
+
+    (venv) $ python -m prophet_folder.vehicle_clusters --refit
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from configparser import ConfigParser
+
+parser = ConfigParser()
+parser.read("config.ini")
+my_path = Path.cwd()
+
+CLUSTER_PREFIX = "cluster_"
+
+# Clusters read by 'load_clusters', with the modification time of their file.
+loaded_clusters = {}
+
+
+def clusters_enabled():
+  """
+  Checks if the vehicles share the models of their clusters.
+  """
+  return parser.getboolean("clusters", "enabled", fallback=False)
+
+
+def get_cluster_path():
+  """
+  Returns the path of the cluster file defined in the config file.
+  """
+  return str(my_path)+parser.get("clusters", "cluster_file",
+                                 fallback="/prophet_folder/clusters/clusters.json")
+
+
+def get_overrides():
+  """
+  Returns the vehicle plates that keep a model of their own.
+  """
+  overrides = parser.get("clusters", "overrides", fallback="")
+
+  return [plate.strip() for plate in overrides.replace(",", " ").split() if plate.strip()]
+
+
+def get_profile_features(main_df):
+  """
+  Calculates the temperature profile of every vehicle from its real
+  temperatures: the setpoint (median), the standard deviation and the mean
+  temperature of every hour of the day, as a difference with the mean of the
+  vehicle. The hours without entries are left at 0.
+
+  Args:
+    pd.Dataframe : entries of the vehicles, with Prophet nomenclature.
+
+  Returns:
+    tuple : (features, one row per vehicle plate, and mean temperature of every vehicle plate).
+  """
+  df = main_df.dropna(subset=["y"])
+  y = df["y"].astype("float64")
+  groups = y.groupby(df["vehicle_plate"])
+  means = groups.mean()
+  hourly = (y.groupby([df["vehicle_plate"], df["ds"].dt.hour]).mean()
+             .unstack().reindex(columns=range(24)))
+  hourly = hourly.sub(means, axis=0).fillna(0)
+  hourly.columns = [f"hour_{hour:02d}" for hour in hourly.columns]
+  features = pd.concat([groups.median().rename("setpoint"),
+                        groups.std().fillna(0).rename("std"),
+                        hourly], axis=1)
+
+  return features, means
+
+
+class VehicleClusters:
+  """
+  Assignment of every vehicle to a cluster, with its offset. The features are
+  standardized across the fleet, and the 24 hourly ones weighted so the daily
+  pattern counts as much as the setpoint or the variance. The number of
+  clusters, the overrides and the maximum number of entries used to train the
+  model of a cluster are read from the [clusters] section of config.ini.
+
+  Args:
+    str (optional) : path of the cluster file. Defaults to the one in config.ini.
+  """
+  def __init__(self, path=None):
+    self.path = path or get_cluster_path()
+    self.n_clusters = parser.getint("clusters", "n_clusters", fallback=8)
+    self.max_training_rows = parser.getint("clusters", "max_training_rows", fallback=100000)
+    self.overrides = get_overrides()
+    self.vehicles = {}
+    self.centers = None
+    self.levels = None
+    self.center = None
+    self.scale = None
+    if Path(self.path).is_file():
+      self.load()
+
+
+  def get_weights(self, columns):
+    """
+    Returns the weight of every feature: 1 for the setpoint and the standard
+    deviation, and 1/sqrt(24) for the hourly means.
+    """
+    return np.array([1 / np.sqrt(24) if column.startswith("hour_") else 1.0 for column in columns])
+
+
+  def transform(self, features):
+    """
+    Standardizes and weights the features with the values of the last fit.
+    """
+    return (features.to_numpy() - self.center) / self.scale * self.get_weights(features.columns)
+
+
+  def fit(self, main_df):
+    """
+    Groups the vehicles with KMeans. The overrides are left out of the fit.
+
+    Args:
+      pd.Dataframe : entries of the vehicles, with Prophet nomenclature.
+
+    Returns:
+      VehicleClusters : the same object, fitted.
+    """
+    from sklearn.cluster import KMeans
+
+    features, means = get_profile_features(main_df)
+    features = features.drop(index=self.overrides, errors="ignore")
+    if features.empty:
+      print("There are no vehicles with real temperatures to cluster.")
+      return self
+    self.center = features.mean().to_numpy()
+    scale = features.std(ddof=0).to_numpy()
+    self.scale = np.where(scale > 0, scale, 1.0)
+    n_clusters = min(self.n_clusters, len(features))
+    kmeans = KMeans(n_clusters=n_clusters, n_init=10, random_state=0).fit(self.transform(features))
+    self.centers = kmeans.cluster_centers_
+    labels = pd.Series(kmeans.labels_, index=features.index)
+    self.levels = means.reindex(labels.index).groupby(labels).mean().reindex(range(n_clusters)).to_numpy()
+    self.vehicles = {}
+    self.assign(features, means)
+
+    return self
+
+
+  def assign(self, features, means):
+    """
+    Assigns every vehicle to its nearest cluster, and updates its offset and
+    its distance to the center of the cluster. The vehicles already assigned
+    keep their cluster.
+    """
+    distances = np.linalg.norm(self.transform(features)[:, None, :] - self.centers[None, :, :], axis=2)
+    for plate, plate_distances in zip(features.index, distances):
+      cluster = self.vehicles.get(plate, {}).get("cluster", int(np.argmin(plate_distances)))
+      self.vehicles[plate] = {"cluster": cluster,
+                              "offset": round(float(means[plate] - self.levels[cluster]), 3),
+                              "distance": round(float(plate_distances[cluster]), 3)}
+
+
+  def update(self, main_df):
+    """
+    Fits the clusters if they have not been fitted yet, or assigns the new
+    vehicles to the saved ones, and saves them. The offsets are calculated
+    again with the current entries of every vehicle.
+
+    Args:
+      pd.Dataframe : entries of the vehicles, with Prophet nomenclature.
+
+    Returns:
+      VehicleClusters : the same object, updated.
+    """
+    if self.centers is None:
+      self.fit(main_df)
+    else:
+      features, means = get_profile_features(main_df)
+      self.assign(features.drop(index=self.overrides, errors="ignore"), means)
+    if self.centers is not None:
+      self.save()
+
+    return self
+
+
+  def get_model_key(self, vehicle_plate):
+    """
+    Returns the name of the model used by a vehicle: the one of its cluster,
+    or its own plate if it is an override or it has no cluster.
+    """
+    if vehicle_plate in self.overrides or vehicle_plate not in self.vehicles:
+      return vehicle_plate
+
+    return f"{CLUSTER_PREFIX}{self.vehicles[vehicle_plate]['cluster']}"
+
+
+  def get_offset(self, vehicle_plate):
+    """
+    Returns the offset added to the predictions of the model of a vehicle.
+    """
+    if self.get_model_key(vehicle_plate) == vehicle_plate:
+      return 0.0
+
+    return self.vehicles[vehicle_plate]["offset"]
+
+
+  def get_model_keys(self, vehicle_plates):
+    """
+    Returns the models used by the vehicle plates, without repetitions.
+    """
+    return list(dict.fromkeys(self.get_model_key(plate) for plate in vehicle_plates))
+
+
+  def is_cluster(self, model_key):
+    """
+    Checks if a model is the one of a cluster.
+    """
+    return model_key.startswith(CLUSTER_PREFIX) and model_key not in self.overrides
+
+
+  def get_members(self, model_key):
+    """
+    Returns the vehicle plates that use the model of a cluster.
+    """
+    return [plate for plate in self.vehicles if self.get_model_key(plate) == model_key]
+
+
+  def get_training_df(self, main_df, model_key):
+    """
+    Returns the entries used to train the model of a cluster: the ones with
+    both temperatures of all its vehicles, with their offsets removed. If there
+    are more than 'max_training_rows', a random sample of them is used.
+
+    Args:
+      pd.Dataframe : entries of the vehicles, with Prophet nomenclature.
+      str : name of the model of the cluster.
+
+    Returns:
+      pd.Dataframe : entries sorted by date.
+    """
+    members = self.get_members(model_key)
+    df_cluster = main_df[main_df["vehicle_plate"].isin(members)].dropna(subset=["y", "temp2"])
+    offsets = df_cluster["vehicle_plate"].map({plate: self.vehicles[plate]["offset"] for plate in members})
+    df_cluster = df_cluster.assign(y=df_cluster["y"] - offsets, temp2=df_cluster["temp2"] - offsets)
+    if len(df_cluster) > self.max_training_rows:
+      df_cluster = df_cluster.sample(self.max_training_rows, random_state=0)
+
+    return df_cluster.sort_values("ds", kind="stable")
+
+
+  def get_summary(self):
+    """
+    Returns the vehicles with their cluster, offset and distance to the center
+    of the cluster, the farthest first, so the outliers are easy to spot.
+    """
+    summary = pd.DataFrame.from_dict(self.vehicles, orient="index",
+                                     columns=["cluster", "offset", "distance"])
+    summary["model"] = [self.get_model_key(plate) for plate in summary.index]
+
+    return summary.sort_values("distance", ascending=False)
+
+
+  def save(self):
+    """
+    Writes the cluster file, through a temporary file.
+    """
+    Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+    clusters = {"center": self.center.tolist(),
+                "scale": self.scale.tolist(),
+                "centers": self.centers.tolist(),
+                "levels": self.levels.tolist(),
+                "vehicles": self.vehicles}
+    with open(self.path + ".tmp", "w") as cluster_file:
+      json.dump(clusters, cluster_file, indent=1)
+    os.replace(self.path + ".tmp", self.path)
+
+
+  def load(self):
+    """
+    Reads the cluster file.
+    """
+    with open(self.path, "r") as cluster_file:
+      clusters = json.load(cluster_file)
+    self.center = np.array(clusters["center"])
+    self.scale = np.array(clusters["scale"])
+    self.centers = np.array(clusters["centers"])
+    self.levels = np.array(clusters["levels"])
+    self.vehicles = clusters["vehicles"]
+
+
+def load_clusters(path=None):
+  """
+  Returns the clusters saved in the cluster file. The file is only read
+  again when it changes, so the clusters can be asked for every vehicle.
+
+  Args:
+    str (optional) : path of the cluster file. Defaults to the one in config.ini.
+
+  Returns:
+    VehicleClusters : clusters of the file. They must not be modified.
+  """
+  path = path or get_cluster_path()
+  try:
+    mtime = os.stat(path).st_mtime_ns
+  except FileNotFoundError:
+    mtime = None
+  if path not in loaded_clusters or loaded_clusters[path][0] != mtime:
+    loaded_clusters[path] = (mtime, VehicleClusters(path))
+
+  return loaded_clusters[path][1]
+
+
+def get_model_route(vehicle_plate):
+  """
+  Returns the model used to predict the temperatures of a vehicle and the
+  offset added to its predictions. Without clusters, every vehicle uses its
+  own model.
+
+  Returns:
+    tuple : (name of the model, offset).
+  """
+  if not clusters_enabled():
+    return vehicle_plate, 0.0
+  clusters = load_clusters()
+
+  return clusters.get_model_key(vehicle_plate), clusters.get_offset(vehicle_plate)
+
+
+if __name__ == "__main__":
+  arg_parser = argparse.ArgumentParser(description="Clusters of vehicles with a similar temperature profile.")
+  arg_parser.add_argument("--refit", action="store_true",
+                          help="fits the clusters again, instead of only assigning the new vehicles.")
+  args = arg_parser.parse_args()
+
+  main_dataset_path = str(my_path)+parser.get("path_folder", "main_dataset")+"/main_dataset.csv"
+  main_df = pd.read_csv(main_dataset_path, parse_dates=["date"])
+  main_df.rename(columns={"temp1": "y", "date": "ds"}, inplace=True)
+  clusters = VehicleClusters()
+  if args.refit:
+    clusters.centers = None
+  clusters.update(main_df)
+  summary = clusters.get_summary()
+  print(summary.to_string())
+  print(f"{len(summary)} vehicles share {summary['model'].nunique()} models.")